@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Compares the executors of the parallel stages (--executor process, thread and
+serial) on the synthetic data from simulate.py. Severus runs end to end with
+every executor and thread count, and the best wall time of every stage from
+severus_profile.json is reported side by side with the fastest configuration.
+
+Usage:
+  executors.py --data-dir bench/data [--threads 2,4] [--executors process,thread,serial]
+"""
+
+import os
+import sys
+import json
+import shutil
+import argparse
+import subprocess
+
+from run_benchmark import BENCH_DIR, run_severus, collect_run, best_of
+
+
+def configurations(executors, threads):
+    """
+    (name, executor, threads) of the runs; the serial executor runs once, with a single thread
+    """
+    configs = []
+    for executor in executors:
+        if executor == 'serial':
+            configs.append(('serial', 'serial', 1))
+            continue
+        for t in threads:
+            configs.append((f"{executor}:{t}", executor, t))
+    return configs
+
+
+def report(results):
+    """
+    Per-stage wall time of every configuration and the fastest one
+    """
+    names = list(results)
+    stages = []
+    for stats in results.values():
+        stages += [stage for stage in stats if stage not in stages]
+    lines = [f"{'stage':<45}" + "".join(f"{name:>12}" for name in names) + f"{'fastest':>12}"]
+    for stage in stages:
+        walls = {name: results[name][stage]['wall_s'] for name in names if stage in results[name]}
+        fastest = min(walls, key=walls.get)
+        lines.append(f"{stage:<45}" + "".join(f"{walls[name]:>12.3f}" if name in walls else f"{'-':>12}" for name in names) +
+                     f"{fastest:>12}")
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-stage comparison of the Severus executors")
+    parser.add_argument("--data-dir", dest="data_dir", required=True, metavar="path",
+                        help="synthetic data from simulate.py, generated with the default settings if missing")
+    parser.add_argument("--work-dir", dest="work_dir", default=None, metavar="path", help="directory for Severus outputs [<data-dir>/executors]")
+    parser.add_argument("--executors", dest="executors", default="process,thread,serial", metavar="list",
+                        help="comma separated executors [process,thread,serial]")
+    parser.add_argument("-t", "--threads", dest="threads", default="2,4", metavar="list", help="comma separated thread counts [2,4]")
+    parser.add_argument("--repeats", dest="repeats", type=int, default=3, metavar="int", help="Severus runs; the best time of each stage is kept [3]")
+    parser.add_argument("--severus-args", dest="severus_args", default="", metavar="string", help="extra Severus arguments, quoted")
+    parser.add_argument("--json", dest="json_out", default=None, metavar="path", help="write results to a json file")
+    args = parser.parse_args()
+
+    if not os.path.isfile(os.path.join(args.data_dir, "tumor.bam")):
+        subprocess.check_call([sys.executable, os.path.join(BENCH_DIR, "simulate.py"), "--out-dir", args.data_dir])
+    work_dir = args.work_dir or os.path.join(args.data_dir, "executors")
+
+    results = {}
+    for name, executor, threads in configurations(args.executors.split(","), [int(t) for t in args.threads.split(",")]):
+        runs = []
+        for i in range(args.repeats):
+            out_dir = os.path.join(work_dir, name.replace(":", "_"), f"run_{i + 1}")
+            shutil.rmtree(out_dir, ignore_errors=True)
+            runs.append(collect_run(run_severus(args.data_dir, out_dir, threads, ["--executor", executor] + args.severus_args.split())))
+        results[name] = best_of(runs)
+
+    print("\n".join(report(results)))
+    if args.json_out:
+        with open(args.json_out, "w") as f:
+            json.dump(results, f, indent=1)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
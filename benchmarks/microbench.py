@@ -0,0 +1,370 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Microbenchmarks for the Severus inner kernels. Kernel inputs are recorded
+from an in-process Severus run (synthetic data from simulate.py by default)
+and replayed at several scales. Kernels working on a whole contig or locus
+(cluster_bp, get_double_breaks, extract_insertions, check_insseq,
+calc_gen_segments) get single calls with that many input items, tiled from
+the recorded inputs; per-read and per-SV kernels repeat the recorded calls.
+For every kernel and scale, reports throughput in input items per second
+(reads, segments, breakpoints or breaks, depending on the kernel), time per
+call and allocations per call (tracemalloc peak and net allocated blocks),
+measured on the calls of that scale: for the tiled kernels they grow with the
+input, for the others they are the mean over the first recorded calls.
+
+Usage:
+  microbench.py --data-dir bench/data [--scales 1000,100000,1000000] [--kernels get_segment,cluster_bp]
+"""
+
+import os
+import sys
+import gc
+import copy
+import json
+import time
+import pickle
+import argparse
+import tracemalloc
+import subprocess
+import itertools
+
+import pysam
+
+BENCH_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from severus import bam_processing, breakpoint_finder, resolve_vntr, vcf_output
+import severus.main
+
+
+FIXTURE_VERSION = 1
+MAX_RECORDED_CALLS = 2000
+ALLOC_SAMPLE_CALLS = 200
+CHUNK_ITEMS = 20000
+
+
+class KernelSpec(object):
+    __slots__ = ('module', 'size', 'fresh_args', 'tile')
+    def __init__(self, module, size, fresh_args, tile=None):
+        self.module = module
+        self.size = size
+        self.fresh_args = fresh_args
+        self.tile = tile
+
+
+def _shift(obj, offsets, suffix, seen):
+    """
+    Moves the segments and breakpoints reachable from obj by offsets[ref_id] and appends suffix to their read ids
+    """
+    if id(obj) in seen:
+        return
+    seen.add(id(obj))
+    if isinstance(obj, bam_processing.ReadSegment):
+        offset = offsets.get(obj.ref_id, 0)
+        obj.ref_start += offset
+        obj.ref_end += offset
+        obj.ref_start_ori += offset
+        obj.ref_end_ori += offset
+        if obj.ins_pos:
+            obj.ins_pos = (obj.ins_pos[0] + offset, obj.ins_pos[1] + offset)
+        obj.read_id += suffix
+    elif isinstance(obj, breakpoint_finder.Breakpoint):
+        obj.position += offsets.get(obj.ref_id, 0)
+        obj.read_ids = [read_id + suffix for read_id in obj.read_ids]
+        _shift(obj.connections, offsets, suffix, seen)
+    elif isinstance(obj, breakpoint_finder.DoubleBreak):
+        obj.supp_read_ids = [read_id + suffix for read_id in obj.supp_read_ids]
+        _shift(obj.bp_1, offsets, suffix, seen)
+        _shift(obj.bp_2, offsets, suffix, seen)
+    elif isinstance(obj, dict):
+        for value in obj.values():
+            _shift(value, offsets, suffix, seen)
+    elif isinstance(obj, (list, tuple, set)):
+        for value in obj:
+            _shift(value, offsets, suffix, seen)
+
+
+def _copies(obj, k, ref_lengths=None):
+    """
+    k copies of obj with distinct read ids. With ref_lengths, copy i is moved by i contig lengths,
+    otherwise all copies stay at the same locus
+    """
+    copies = []
+    for i in range(k):
+        obj_copy = copy.deepcopy(obj)
+        offsets = {ctg: i * length for ctg, length in ref_lengths.items()} if ref_lengths else {}
+        _shift(obj_copy, offsets, f"_tile{i}", set())
+        copies.append(obj_copy)
+    return copies
+
+
+def _concat_by_contig(dicts):
+    out = {}
+    for d in dicts:
+        for ctg, ls in d.items():
+            out.setdefault(ctg, []).extend(ls)
+    return out
+
+
+def _tiled_lengths(ref_lengths, k):
+    return {ctg: length * k for ctg, length in ref_lengths.items()}
+
+
+def _tile_cluster_bp(a, k):
+    return (a[0], sum(_copies(a[1], k, a[4]), []), a[2], a[3], _tiled_lengths(a[4], k)) + a[5:]
+
+def _tile_get_double_breaks(a, k):
+    return a[:2] + (sum(_copies(a[2], k), []),) + a[3:]
+
+def _tile_extract_insertions(a, k):
+    copies = _copies(a[:2], k, a[2])
+    return (_concat_by_contig(c[0] for c in copies), _concat_by_contig(c[1] for c in copies), _tiled_lengths(a[2], k), a[3])
+
+def _tile_check_insseq(a, k):
+    return (sum(_copies(a[0], k), []),)
+
+def _tile_calc_gen_segments(a, k):
+    return (sum(_copies(a[0], k, a[2]), []), a[1], _tiled_lengths(a[2], k)) + a[3:]
+
+
+#size is the number of input items of a call, fresh_args are the arguments a kernel modifies
+#and that are copied before every call. Kernels with tile take a whole contig or locus: a scale
+#is a single call built from k copies of the largest recorded input, copies on a contig are placed
+#one contig length apart (the contigs get k times longer), copies at a locus add support.
+#Other kernels take a single read or SV and scale by repeating the recorded calls
+KERNELS = {'get_segment': KernelSpec(bam_processing, lambda a: 1, ()),
+           'merge_short_seg': KernelSpec(bam_processing, lambda a: len(a[0]), (0,)),
+           'label_reads': KernelSpec(bam_processing, lambda a: len(a[0]), (0,)),
+           'resolve_read_vntr': KernelSpec(resolve_vntr, lambda a: len(a[0]), (0,)),
+           'cluster_bp': KernelSpec(breakpoint_finder, lambda a: len(a[1]), (), _tile_cluster_bp),
+           'get_double_breaks': KernelSpec(breakpoint_finder, lambda a: len(a[2]), (), _tile_get_double_breaks),
+           'extract_insertions': KernelSpec(breakpoint_finder, lambda a: sum(len(v) for v in a[0].values()), (0, 1), _tile_extract_insertions),
+           'check_insseq': KernelSpec(breakpoint_finder, lambda a: len(a[0]), (), _tile_check_insseq),
+           'calc_gen_segments': KernelSpec(breakpoint_finder, lambda a: len(a[0]), (5, 6), _tile_calc_gen_segments),
+           'add_pon': KernelSpec(breakpoint_finder, lambda a: len(a[0]), ()),
+           'db_2_vcf': KernelSpec(vcf_output, lambda a: len(a[0]), (0,))}
+
+
+def _plain_args(args):
+    """
+    Copy of the argparse namespace without open files
+    """
+    return argparse.Namespace(**{k: v for k, v in vars(args).items() if isinstance(v, (int, float, str, bool, list, type(None)))})
+
+
+class Recorder(object):
+    def __init__(self):
+        self.calls = {name: [] for name in KERNELS}
+        self.shared_memo = {name: {} for name in KERNELS}
+        self.header = None
+
+    def wrap(self, name, func):
+        spec = KERNELS[name]
+        def recorded(*args):
+            calls = self.calls[name]
+            if len(calls) < MAX_RECORDED_CALLS:
+                calls.append(self.snapshot(name, spec, args))
+            return func(*args)
+        return recorded
+
+    def snapshot(self, name, spec, args):
+        """
+        Copies the arguments at call time: modified arguments are copied for every call,
+        the rest are shared between the calls of a kernel
+        """
+        out = []
+        for i, arg in enumerate(args):
+            if isinstance(arg, pysam.AlignedSegment):
+                if self.header is None:
+                    self.header = arg.header.to_dict()
+                out.append(_RecordedRead(arg.to_string()))
+            elif isinstance(arg, argparse.Namespace):
+                out.append(_plain_args(arg))
+            elif i in spec.fresh_args:
+                out.append(copy.deepcopy(arg))
+            else:
+                out.append(copy.deepcopy(arg, self.shared_memo[name]))
+        return tuple(out)
+
+
+class _RecordedRead(object):
+    __slots__ = ('sam',)
+    def __init__(self, sam):
+        self.sam = sam
+
+
+def record_fixtures(data_dir, severus_args, out_dir):
+    """
+    Runs Severus in-process with the serial executor and records the arguments of every kernel
+    """
+    recorder = Recorder()
+    originals = {}
+    for name, spec in KERNELS.items():
+        originals[name] = getattr(spec.module, name)
+        setattr(spec.module, name, recorder.wrap(name, originals[name]))
+    argv = sys.argv
+    if severus_args is None:
+        severus_args = ["--target-bam", os.path.join(data_dir, "tumor.bam"), "--control-bam", os.path.join(data_dir, "normal.bam"),
+                        "--phasing-vcf", os.path.join(data_dir, "phased.vcf.gz"), "--vntr-bed", os.path.join(data_dir, "vntr.bed"),
+                        "--PON", os.path.join(data_dir, "pon.tsv"), "--single-bp", "--between-junction-ins"]
+    sys.argv = ["severus"] + severus_args + ["--out-dir", out_dir, "-t", "1", "--executor", "serial", "--plots", "none"]
+    try:
+        severus.main.main()
+    finally:
+        sys.argv = argv
+        for name, spec in KERNELS.items():
+            setattr(spec.module, name, originals[name])
+    return {'version': FIXTURE_VERSION, 'header': recorder.header, 'calls': recorder.calls}
+
+
+def load_calls(fixtures):
+    header = pysam.AlignmentHeader.from_dict(fixtures['header']) if fixtures['header'] else None
+    calls = {}
+    for name, recorded in fixtures['calls'].items():
+        calls[name] = [tuple(pysam.AlignedSegment.fromstring(a.sam, header) if isinstance(a, _RecordedRead) else a for a in args)
+                       for args in recorded]
+    return calls
+
+
+def call_plan(calls, spec, n_items):
+    """
+    Calls with n_items input items in total: a single call tiled from the largest recorded one
+    for kernels with tile, otherwise the recorded calls cycled
+    """
+    if spec.tile is not None:
+        largest = max(calls, key=spec.size)
+        return [spec.tile(largest, max(1, -(-n_items // max(spec.size(largest), 1))))]
+    plan = []
+    items = 0
+    for args in itertools.cycle(calls):
+        if items >= n_items:
+            break
+        plan.append(args)
+        items += spec.size(args)
+    return plan
+
+
+def prepare(args, spec):
+    if not spec.fresh_args:
+        return args
+    return tuple(copy.deepcopy(a) if i in spec.fresh_args else a for i, a in enumerate(args))
+
+
+def time_kernel(func, plan, spec, time_limit):
+    """
+    Total kernel time over the plan, with the argument copies made outside of the timer
+    """
+    elapsed = 0
+    n_calls = 0
+    n_items = 0
+    i = 0
+    while i < len(plan) and elapsed < time_limit:
+        chunk = []
+        chunk_items = 0
+        while i < len(plan) and chunk_items < CHUNK_ITEMS:
+            chunk.append(prepare(plan[i], spec))
+            chunk_items += spec.size(plan[i])
+            i += 1
+        gc.collect()
+        start = time.perf_counter()
+        for args in chunk:
+            func(*args)
+        elapsed += time.perf_counter() - start
+        n_calls += len(chunk)
+        n_items += chunk_items
+    return elapsed, n_calls, n_items
+
+
+def alloc_per_call(func, plan, spec):
+    """
+    Mean tracemalloc peak and net allocated blocks per call over the first calls of the plan
+    """
+    sample = [prepare(args, spec) for args in plan[:ALLOC_SAMPLE_CALLS]]
+    peak = 0
+    blocks = 0
+    gc.collect()
+    gc.disable()
+    tracemalloc.start()
+    try:
+        for args in sample:
+            tracemalloc.reset_peak()
+            before_mem = tracemalloc.get_traced_memory()[0]
+            before_blocks = sys.getallocatedblocks()
+            func(*args)
+            blocks += sys.getallocatedblocks() - before_blocks
+            peak += tracemalloc.get_traced_memory()[1] - before_mem
+    finally:
+        tracemalloc.stop()
+        gc.enable()
+    return peak / len(sample) / 1024, blocks / len(sample)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmarks for Severus kernels on recorded inputs")
+    parser.add_argument("--data-dir", dest="data_dir", required=True, metavar="path",
+                        help="synthetic data directory (generated with simulate.py if empty)")
+    parser.add_argument("--fixtures", dest="fixtures", default=None, metavar="path", help="recorded inputs [<data-dir>/microbench_fixtures.pkl]")
+    parser.add_argument("--record", dest="record", action="store_true", help="record the inputs again even if the fixtures file exists")
+    parser.add_argument("--record-args", dest="record_args", default=None, metavar="string",
+                        help="Severus input arguments to record from instead of the synthetic data, quoted")
+    parser.add_argument("--kernels", dest="kernels", default=",".join(KERNELS), metavar="list", help="comma separated kernels [all]")
+    parser.add_argument("--scales", dest="scales", default="1000,100000", metavar="list",
+                        help="comma separated numbers of input items per kernel [1000,100000]")
+    parser.add_argument("--time-limit", dest="time_limit", type=float, default=60, metavar="float",
+                        help="stop a kernel at this many seconds of kernel time and report the items processed so far [60]")
+    parser.add_argument("--no-alloc", dest="no_alloc", action="store_true",
+                        help="skip the allocation measurement, which runs the calls again under tracemalloc, several times slower")
+    parser.add_argument("--json", dest="json_out", default=None, metavar="path", help="write results to a json file")
+    args = parser.parse_args()
+
+    kernels = args.kernels.split(",")
+    unknown = [k for k in kernels if k not in KERNELS]
+    if unknown:
+        print(f"Error: unknown kernels: {', '.join(unknown)}", file=sys.stderr)
+        return 1
+    scales = [int(float(s)) for s in args.scales.split(",")]
+
+    fixtures_file = args.fixtures or os.path.join(args.data_dir, "microbench_fixtures.pkl")
+    if args.record or not os.path.isfile(fixtures_file):
+        if args.record_args is None and not os.path.isfile(os.path.join(args.data_dir, "tumor.bam")):
+            subprocess.check_call([sys.executable, os.path.join(BENCH_DIR, "simulate.py"), "--out-dir", args.data_dir])
+        record_args = args.record_args.split() if args.record_args else None
+        fixtures = record_fixtures(args.data_dir, record_args, os.path.join(args.data_dir, "microbench_run"))
+        with open(fixtures_file, "wb") as f:
+            pickle.dump(fixtures, f, protocol=pickle.HIGHEST_PROTOCOL)
+    else:
+        with open(fixtures_file, "rb") as f:
+            fixtures = pickle.load(f)
+        if fixtures.get('version') != FIXTURE_VERSION:
+            print("Error: fixtures were recorded by a different version, rerun with --record", file=sys.stderr)
+            return 1
+    calls = load_calls(fixtures)
+
+    results = []
+    print(f"{'kernel':<20}{'scale':>10}{'calls':>10}{'items':>10}{'time_s':>10}{'items/s':>12}{'us/call':>14}{'peak_kb/call':>14}{'blocks/call':>13}")
+    for name in kernels:
+        spec = KERNELS[name]
+        func = getattr(spec.module, name)
+        if not calls[name]:
+            print(f"{name:<20}  no recorded calls")
+            continue
+        for scale in scales:
+            plan = call_plan(calls[name], spec, scale)
+            elapsed, n_calls, n_items = time_kernel(func, plan, spec, args.time_limit)
+            peak_kb, blocks = alloc_per_call(func, plan, spec) if not args.no_alloc else (None, None)
+            result = {'kernel': name, 'scale': scale, 'calls': n_calls, 'items': n_items, 'time_s': elapsed,
+                      'items_per_s': n_items / elapsed if elapsed else 0, 'us_per_call': elapsed / n_calls * 1e6,
+                      'peak_kb_per_call': peak_kb, 'blocks_per_call': blocks}
+            results.append(result)
+            print(f"{name:<20}{scale:>10}{n_calls:>10}{n_items:>10}{elapsed:>10.3f}{result['items_per_s']:>12.0f}"
+                  f"{result['us_per_call']:>14.1f}" + (f"{peak_kb:>14.1f}{blocks:>13.1f}" if peak_kb is not None else f"{'-':>14}{'-':>13}"))
+
+    if args.json_out:
+        with open(args.json_out, "w") as f:
+            json.dump(results, f, indent=1)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
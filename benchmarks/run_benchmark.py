@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Runs Severus end to end on the synthetic data from simulate.py and compares
+per-stage wall time and peak RSS (from severus_profile.json) to a stored
+baseline. Exits with 1 if any stage is slower or larger than the baseline
+by more than the tolerance, or if the read statistics of the run are
+implausible for the synthetic data (too few PASS reads or a median coverage
+far below the simulated depth), which would make the timings meaningless.
+
+Usage:
+  run_benchmark.py --work-dir bench --save-baseline baseline.json
+  run_benchmark.py --work-dir bench --baseline baseline.json
+"""
+
+import os
+import sys
+import json
+import shutil
+import argparse
+import platform
+import subprocess
+
+
+BENCH_DIR = os.path.dirname(os.path.realpath(__file__))
+SEVERUS = os.path.join(os.path.dirname(BENCH_DIR), "severus.py")
+SEVERUS_ARGS = ["--output-LOH", "--write-collapsed-dup", "--single-bp", "--between-junction-ins"]
+#version of the simulated data; data generated by older versions of simulate.py is regenerated
+DATA_VERSION = 2
+MIN_PASS_FRACTION = 0.5
+MIN_COVERAGE_FRACTION = 0.5
+
+
+def generate_data(data_dir, args):
+    cmd = [sys.executable, os.path.join(BENCH_DIR, "simulate.py"), "--out-dir", data_dir,
+           "--scale", str(args.scale), "--depth", str(args.depth), "--read-length", str(args.read_length),
+           "--error-rate", str(args.error_rate), "--seed", str(args.seed)]
+    subprocess.check_call(cmd)
+
+
+def run_severus(data_dir, out_dir, threads, extra_args):
+    cmd = [sys.executable, SEVERUS, "--target-bam", os.path.join(data_dir, "tumor.bam"),
+           "--control-bam", os.path.join(data_dir, "normal.bam"), "--out-dir", out_dir, "-t", str(threads),
+           "--phasing-vcf", os.path.join(data_dir, "phased.vcf.gz"), "--vntr-bed", os.path.join(data_dir, "vntr.bed"),
+           "--plots", "none"] + SEVERUS_ARGS + extra_args
+    subprocess.check_call(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    with open(os.path.join(out_dir, "severus_profile.json")) as f:
+        return json.load(f)
+
+
+def check_plausible(out_dir, depth):
+    """
+    Returns error messages if the PASS fraction of read segments or the median
+    PASS coverage of any sample in a run on the synthetic data is implausible
+    """
+    counts = {}
+    with open(os.path.join(out_dir, "read_qual.txt")) as f:
+        for line in f.read().split("Total length of segments:")[0].replace("Number of segments:", "").splitlines():
+            if line.strip():
+                name, count = line.split("\t")
+                counts[name] = int(count)
+    errors = []
+    total = sum(counts.values())
+    pass_fraction = counts.get("PASS", 0) / total if total else 0
+    if pass_fraction < MIN_PASS_FRACTION:
+        errors.append(f"PASS fraction of read segments is {pass_fraction:.2f} (< {MIN_PASS_FRACTION})")
+    with open(os.path.join(out_dir, "severus.log")) as f:
+        for line in f:
+            if "Median coverage by PASS reads for" in line:
+                sample = line.split(" for ")[1].split(" (")[0]
+                coverage = sum(float(c) for c in line.split(":")[-1].split("/"))
+                if coverage < depth * MIN_COVERAGE_FRACTION:
+                    errors.append(f"median coverage of {sample} is {coverage:.1f} for depth {depth:g}")
+    return errors
+
+
+def collect_run(profile):
+    run = {"total": {"wall_s": profile["wall_s"], "peak_rss_mb": profile["peak_rss_mb"]}}
+    for stage in profile["stages"]:
+        run[stage["name"]] = {"wall_s": stage["wall_s"],
+                              "peak_rss_mb": max(stage["peak_rss_mb"], stage.get("tasks", {}).get("worker_peak_rss_mb", 0))}
+    return run
+
+
+def best_of(runs):
+    """
+    Minimum wall time and peak RSS of every stage over repeated runs
+    """
+    stages = {}
+    for run in runs:
+        for name, stats in run.items():
+            if name not in stages:
+                stages[name] = dict(stats)
+            else:
+                for key, value in stats.items():
+                    stages[name][key] = min(stages[name][key], value)
+    return stages
+
+
+def compare(stages, baseline, tolerance, min_wall):
+    """
+    Returns report lines and the number of regressed stages
+    """
+    lines = [f"{'stage':<45}{'wall_s':>10}{'base':>10}{'ratio':>8}{'rss_mb':>10}{'base':>10}{'ratio':>8}"]
+    regressions = 0
+    for name, stats in stages.items():
+        base = baseline.get(name)
+        if base is None:
+            lines.append(f"{name:<45}{stats['wall_s']:>10.3f}{'-':>10}{'':>8}{stats['peak_rss_mb']:>10.1f}{'-':>10}")
+            continue
+        wall_ratio = stats["wall_s"] / base["wall_s"] if base["wall_s"] else 1.0
+        rss_ratio = stats["peak_rss_mb"] / base["peak_rss_mb"] if base["peak_rss_mb"] else 1.0
+        flags = []
+        if wall_ratio > 1 + tolerance and stats["wall_s"] - base["wall_s"] > min_wall:
+            flags.append("WALL")
+        if rss_ratio > 1 + tolerance:
+            flags.append("RSS")
+        regressions += bool(flags)
+        lines.append(f"{name:<45}{stats['wall_s']:>10.3f}{base['wall_s']:>10.3f}{wall_ratio:>8.2f}"
+                     f"{stats['peak_rss_mb']:>10.1f}{base['peak_rss_mb']:>10.1f}{rss_ratio:>8.2f}  {' '.join(flags)}")
+    for name in baseline:
+        if name not in stages:
+            lines.append(f"{name:<45}{'missing':>10}")
+    return lines, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Synthetic end-to-end Severus benchmark with per-stage regression checks")
+    parser.add_argument("--work-dir", dest="work_dir", required=True, metavar="path", help="directory for synthetic data and Severus outputs")
+    parser.add_argument("--baseline", dest="baseline", default=None, metavar="path", help="baseline json to compare against")
+    parser.add_argument("--save-baseline", dest="save_baseline", default=None, metavar="path", help="write the measured stages as a new baseline")
+    parser.add_argument("--repeats", dest="repeats", type=int, default=3, metavar="int", help="Severus runs; the best time of each stage is kept [3]")
+    parser.add_argument("--tolerance", dest="tolerance", type=float, default=0.25, metavar="float", help="allowed relative slowdown or memory growth [0.25]")
+    parser.add_argument("--min-wall", dest="min_wall", type=float, default=0.2, metavar="float",
+                        help="ignore wall time regressions smaller than this many seconds [0.2]")
+    parser.add_argument("-t", "--threads", dest="threads", type=int, default=2, metavar="int", help="Severus threads [2]")
+    parser.add_argument("--regenerate", dest="regenerate", action="store_true", help="regenerate synthetic data even if present")
+    parser.add_argument("--scale", dest="scale", type=float, default=1.0, metavar="float", help="genome size multiplier (1 = 2.4 Mb) [1]")
+    parser.add_argument("--depth", dest="depth", type=float, default=20, metavar="float", help="sequencing depth per sample [20]")
+    parser.add_argument("--read-length", dest="read_length", type=int, default=15000, metavar="int", help="mean read length [15000]")
+    parser.add_argument("--error-rate", dest="error_rate", type=float, default=0.003, metavar="float", help="mean substitution error rate per read [0.003]")
+    parser.add_argument("--seed", dest="seed", type=int, default=7, metavar="int", help="random seed [7]")
+    parser.add_argument("--severus-args", dest="severus_args", default="", metavar="string", help="extra Severus arguments, quoted")
+    args = parser.parse_args()
+
+    if not shutil.which("samtools"):
+        print("Error: samtools not found", file=sys.stderr)
+        return 1
+
+    data_dir = os.path.join(args.work_dir, "data")
+    settings = {"scale": args.scale, "depth": args.depth, "read_length": args.read_length,
+                "error_rate": args.error_rate, "seed": args.seed, "version": DATA_VERSION}
+    settings_file = os.path.join(data_dir, "settings.json")
+    current = None
+    if os.path.isfile(settings_file):
+        with open(settings_file) as f:
+            current = json.load(f)
+    if args.regenerate or current != settings:
+        shutil.rmtree(data_dir, ignore_errors=True)
+        generate_data(data_dir, args)
+        with open(settings_file, "w") as f:
+            json.dump(settings, f)
+
+    runs = []
+    for i in range(args.repeats):
+        out_dir = os.path.join(args.work_dir, f"run_{i + 1}")
+        shutil.rmtree(out_dir, ignore_errors=True)
+        runs.append(collect_run(run_severus(data_dir, out_dir, args.threads, args.severus_args.split())))
+    stages = best_of(runs)
+    errors = check_plausible(os.path.join(args.work_dir, "run_1"), args.depth)
+    for error in errors:
+        print(f"Error: implausible synthetic run: {error}", file=sys.stderr)
+    if errors:
+        return 1
+
+    result = {"settings": settings, "threads": args.threads, "repeats": args.repeats,
+              "host": platform.node(), "python": platform.python_version(), "stages": stages}
+    with open(os.path.join(args.work_dir, "benchmark.json"), "w") as f:
+        json.dump(result, f, indent=1)
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(result, f, indent=1)
+
+    if not args.baseline:
+        for name, stats in stages.items():
+            print(f"{name:<45}{stats['wall_s']:>10.3f} s{stats['peak_rss_mb']:>10.1f} MB")
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline["settings"] != settings or baseline["threads"] != args.threads:
+        print("Warning: baseline was recorded with different settings", file=sys.stderr)
+    lines, regressions = compare(stages, baseline["stages"], args.tolerance, args.min_wall)
+    print("\n".join(lines))
+    if regressions:
+        print(f"{regressions} stage(s) regressed beyond {args.tolerance:.0%}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
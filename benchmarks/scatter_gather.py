@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Runs Severus in the scatter/gather mode on one machine: the contigs are split
+into shards that are parsed by separate Severus processes, then the shards are
+gathered. With --split regions, the genome is cut into consecutive --regions
+pieces instead, so that reads span the boundaries between shards. With
+--compare, also runs Severus on the whole genome and checks that both runs
+report the same SVs, with the same support and coverage, and the same read
+statistics.
+
+Usage:
+  scatter_gather.py --work-dir bench --shards 3 [--split regions] [--compare]
+"""
+
+import os
+import sys
+import time
+import gzip
+import shutil
+import argparse
+import subprocess
+
+import pysam
+
+BENCH_DIR = os.path.dirname(os.path.realpath(__file__))
+SEVERUS = os.path.join(os.path.dirname(BENCH_DIR), "severus.py")
+SEVERUS_ARGS = ["--single-bp", "--between-junction-ins", "--plots", "none"]
+
+
+def severus_cmd(data_dir, out_dir, threads, extra_args):
+    cmd = [sys.executable, SEVERUS, "--target-bam", os.path.join(data_dir, "tumor.bam"),
+           "--control-bam", os.path.join(data_dir, "normal.bam"), "--out-dir", out_dir, "-t", str(threads),
+           "--phasing-vcf", os.path.join(data_dir, "phased.vcf.gz"), "--vntr-bed", os.path.join(data_dir, "vntr.bed")]
+    if os.path.isfile(os.path.join(data_dir, "pon.tsv")):
+        cmd += ["--PON", os.path.join(data_dir, "pon.tsv")]
+    return cmd + SEVERUS_ARGS + extra_args
+
+
+def split_contigs(bam_file, n_shards):
+    """
+    Assigns contigs to shards, longest first to the shard with the least sequence
+    """
+    with pysam.AlignmentFile(bam_file, "rb") as a:
+        contigs = sorted(zip(a.lengths, a.references), reverse=True)
+    shards = [[0, []] for _ in range(min(n_shards, len(contigs)))]
+    for length, ctg in contigs:
+        shard = min(shards, key=lambda s: s[0])
+        shard[0] += length
+        shard[1].append(ctg)
+    return [ctgs for _, ctgs in shards]
+
+
+def split_regions(bam_file, n_shards):
+    """
+    Cuts the genome into n_shards consecutive pieces of equal length, as (contig, start, end) intervals
+    """
+    with pysam.AlignmentFile(bam_file, "rb") as a:
+        contigs = list(zip(a.references, a.lengths))
+    total = sum(length for _, length in contigs)
+    bounds = [total * i // n_shards for i in range(n_shards + 1)]
+    shards = [[] for _ in range(n_shards)]
+    offset = 0
+    for ctg, length in contigs:
+        for i in range(n_shards):
+            start, end = max(bounds[i], offset), min(bounds[i + 1], offset + length)
+            if start < end:
+                shards[i].append((ctg, start - offset, end - offset))
+        offset += length
+    return [intervals for intervals in shards if intervals]
+
+
+def vcf_records(out_dir):
+    """
+    Records of the output vcfs without the ids, which depend on the processing order,
+    with the per-sample support and coverage
+    """
+    records = []
+    for root, _dirs, files in os.walk(out_dir):
+        for name in files:
+            if not (name.endswith(".vcf") or name.endswith(".vcf.gz")):
+                continue
+            path = os.path.join(root, name)
+            with (gzip.open(path, "rt") if name.endswith(".gz") else open(path)) as f:
+                for line in f:
+                    if not line.startswith("#"):
+                        fields = line.split("\t")
+                        records.append((name, tuple(fields[:2] + fields[3:7] + fields[8:])))
+    return sorted(records)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scatter/gather Severus run with shards as separate local processes")
+    parser.add_argument("--work-dir", dest="work_dir", required=True, metavar="path", help="directory for synthetic data and Severus outputs")
+    parser.add_argument("--data-dir", dest="data_dir", default=None, metavar="path",
+                        help="synthetic data directory [<work-dir>/data, generated with simulate.py if empty]")
+    parser.add_argument("--shards", dest="shards", type=int, default=3, metavar="int", help="number of shards [3]")
+    parser.add_argument("--split", dest="split", choices=["contigs", "regions"], default="contigs",
+                        help="shards of whole contigs (--chrom) or of consecutive regions cutting through contigs (--regions) [contigs]")
+    parser.add_argument("-t", "--threads", dest="threads", type=int, default=1, metavar="int", help="Severus threads per process [1]")
+    parser.add_argument("--compare", dest="compare", action="store_true", help="also run on the whole genome and compare the SVs and read statistics")
+    args = parser.parse_args()
+
+    if not shutil.which("samtools"):
+        print("Error: samtools not found", file=sys.stderr)
+        return 1
+    data_dir = args.data_dir or os.path.join(args.work_dir, "data")
+    if not os.path.isfile(os.path.join(data_dir, "tumor.bam")):
+        subprocess.check_call([sys.executable, os.path.join(BENCH_DIR, "simulate.py"), "--out-dir", data_dir])
+
+    shard_dir = os.path.join(args.work_dir, "shards")
+    shutil.rmtree(shard_dir, ignore_errors=True)
+    os.makedirs(shard_dir)
+    start = time.time()
+    procs = []
+    shard_files = []
+    if args.split == "contigs":
+        shard_args = [["--chrom"] + contigs for contigs in split_contigs(os.path.join(data_dir, "tumor.bam"), args.shards)]
+    else:
+        shard_args = []
+        for i, intervals in enumerate(split_regions(os.path.join(data_dir, "tumor.bam"), args.shards)):
+            bed_file = os.path.join(shard_dir, f"shard_{i + 1}.bed")
+            with open(bed_file, "w") as f:
+                f.writelines(f"{ctg}\t{start}\t{end}\n" for ctg, start, end in intervals)
+            shard_args.append(["--regions", bed_file])
+    for i, extra_args in enumerate(shard_args):
+        shard_file = os.path.join(shard_dir, f"shard_{i + 1}.pkl.gz")
+        cmd = severus_cmd(data_dir, os.path.join(shard_dir, f"scatter_{i + 1}"), args.threads,
+                          extra_args + ["--scatter", shard_file])
+        procs.append(subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+        shard_files.append(shard_file)
+    for proc in procs:
+        if proc.wait() != 0:
+            print(f"Error: scatter process failed: {' '.join(proc.args)}", file=sys.stderr)
+            return 1
+    scatter_time = time.time() - start
+
+    gather_dir = os.path.join(args.work_dir, "gather")
+    shutil.rmtree(gather_dir, ignore_errors=True)
+    start = time.time()
+    subprocess.check_call(severus_cmd(data_dir, gather_dir, args.threads, ["--gather"] + shard_files),
+                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    gather_time = time.time() - start
+    shard_bytes = sum(os.path.getsize(f) for f in shard_files)
+    print(f"scatter: {len(shard_files)} shards, {scatter_time:.1f} s, {shard_bytes / 1024:.1f} KB")
+    print(f"gather: {gather_time:.1f} s")
+
+    if not args.compare:
+        return 0
+    single_dir = os.path.join(args.work_dir, "single")
+    shutil.rmtree(single_dir, ignore_errors=True)
+    start = time.time()
+    subprocess.check_call(severus_cmd(data_dir, single_dir, args.threads * len(shard_files), []),
+                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    print(f"single run: {time.time() - start:.1f} s")
+    gathered, single = vcf_records(gather_dir), vcf_records(single_dir)
+    if gathered != single:
+        only_gathered = len(set(gathered) - set(single))
+        only_single = len(set(single) - set(gathered))
+        print(f"Error: SVs differ ({only_gathered} only in gather, {only_single} only in the single run)", file=sys.stderr)
+        return 1
+    print(f"SVs match the single run: {len(single)} records")
+    #the segment counts are collected with the coverage histograms, so reads spanning shards are counted once
+    with open(os.path.join(gather_dir, "read_qual.txt")) as f1, open(os.path.join(single_dir, "read_qual.txt")) as f2:
+        if f1.read() != f2.read():
+            print("Error: read_qual.txt differs from the single run", file=sys.stderr)
+            return 1
+    print("Read statistics match the single run")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Generates a synthetic reference and haplotagged tumor/normal long-read bams
+with planted germline and somatic SVs: deletions, insertions, an inversion,
+a translocation, a tandem duplication, a VNTR expansion and a
+chromothripsis-like cluster. Also writes a phased vcf (PS tags), a VNTR bed,
+a panel of normals with the germline SVs and the list of planted SVs.
+
+Usage: simulate.py --out-dir bench_data [--scale 1] [--depth 20] [--read-length 15000] [--error-rate 0.003]
+"""
+
+import os
+import sys
+import random
+import argparse
+import pysam
+
+
+COMPLEMENT = str.maketrans("ACGT", "TGCA")
+CHROM_FRACTIONS = {"chr1": 1.0, "chr2": 0.8, "chr3": 0.6}
+BASE_CHROM_LEN = 1500000
+VNTR_MOTIF_LEN = 40
+VNTR_COPIES = 25
+MIN_ALIGNED_PIECE = 300
+MAX_DEL_IN_ALIGNMENT = 30000
+PHASE_BLOCK = 200000
+SNP_STEP = 1000
+#standard deviation of the per-read error rate, relative to the mean
+ERROR_RATE_SD = 0.3
+
+
+def revcomp(seq):
+    return seq.translate(COMPLEMENT)[::-1]
+
+
+def random_seq(rng, length):
+    return "".join(rng.choice("ACGT") for _ in range(length))
+
+
+def split_at(pieces, chrom, pos):
+    """
+    Splits the reference piece of chrom that spans pos into two pieces
+    """
+    out = []
+    for p in pieces:
+        if p[0] == "ref" and p[1] == chrom and p[2] < pos < p[3]:
+            out.append(("ref", chrom, p[2], pos, p[4]))
+            out.append(("ref", chrom, pos, p[3], p[4]))
+        else:
+            out.append(p)
+    return out
+
+
+def sv_deletion(chrom, start, end):
+    def apply(haps):
+        pieces = split_at(split_at(haps[chrom], chrom, start), chrom, end)
+        haps[chrom] = [p for p in pieces if not (p[0] == "ref" and p[1] == chrom and start <= p[2] and p[3] <= end)]
+    return apply
+
+
+def sv_insertion(chrom, pos, seq):
+    def apply(haps):
+        out = []
+        for p in split_at(haps[chrom], chrom, pos):
+            out.append(p)
+            if p[0] == "ref" and p[1] == chrom and p[3] == pos:
+                out.append(("novel", seq))
+        haps[chrom] = out
+    return apply
+
+
+def sv_inversion(chrom, start, end):
+    def apply(haps):
+        pieces = split_at(split_at(haps[chrom], chrom, start), chrom, end)
+        haps[chrom] = [("ref", chrom, p[2], p[3], -p[4]) if p[0] == "ref" and p[1] == chrom and start <= p[2] and p[3] <= end else p
+                       for p in pieces]
+    return apply
+
+
+def sv_duplication(chrom, start, end):
+    def apply(haps):
+        out = []
+        for p in split_at(split_at(haps[chrom], chrom, start), chrom, end):
+            out.append(p)
+            if p[0] == "ref" and p[1] == chrom and p[3] == end:
+                out.append(("ref", chrom, start, end, 1))
+        haps[chrom] = out
+    return apply
+
+
+def sv_translocation(chrom_1, pos_1, chrom_2, pos_2):
+    def apply(haps):
+        a = split_at(haps[chrom_1], chrom_1, pos_1)
+        b = split_at(haps[chrom_2], chrom_2, pos_2)
+        ia = next(i for i, p in enumerate(a) if p[0] == "ref" and p[3] == pos_1) + 1
+        ib = next(i for i, p in enumerate(b) if p[0] == "ref" and p[3] == pos_2) + 1
+        haps[chrom_1] = a[:ia] + b[ib:]
+        haps[chrom_2] = b[:ib] + a[ia:]
+    return apply
+
+
+def build_haplotype(ref, events):
+    haps = {c: [("ref", c, 0, len(s), 1)] for c, s in ref.items()}
+    for (_, _, _, _, _, _, _, apply) in events:
+        apply(haps)
+    return haps
+
+
+def haplotype_seq(ref, pieces):
+    out = []
+    for p in pieces:
+        if p[0] == "novel":
+            out.append(p[1])
+        else:
+            seq = ref[p[1]][p[2]:p[3]]
+            out.append(seq if p[4] == 1 else revcomp(seq))
+    return "".join(out)
+
+
+def project_read(pieces, read_start, read_end):
+    """
+    Projects donor interval [read_start, read_end) onto haplotype pieces
+    """
+    out = []
+    offset = 0
+    for p in pieces:
+        length = len(p[1]) if p[0] == "novel" else p[3] - p[2]
+        a, b = max(read_start, offset), min(read_end, offset + length)
+        if a < b:
+            qs, qe = a - read_start, b - read_start
+            if p[0] == "novel":
+                out.append((qs, qe, ("novel", p[1][a - offset:b - offset])))
+            elif p[4] == 1:
+                out.append((qs, qe, ("ref", p[1], p[2] + a - offset, p[2] + b - offset, 1)))
+            else:
+                out.append((qs, qe, ("ref", p[1], p[3] - (b - offset), p[3] - (a - offset), -1)))
+        offset += length
+    return out
+
+
+def to_alignments(projection):
+    """
+    Merges projected pieces into linear alignments, keeping short deletions and insertions in the cigar
+    """
+    alignments = []
+    cur = None
+    for qs, qe, p in projection:
+        if p[0] == "novel":
+            if cur is not None:
+                cur["pending_ins"] = cur.get("pending_ins", 0) + (qe - qs)
+            continue
+        if cur is not None and cur["chrom"] == p[1] and cur["strand"] == p[4]:
+            gap = p[2] - cur["rend"] if p[4] == 1 else cur["rstart"] - p[3]
+            if 0 <= gap <= MAX_DEL_IN_ALIGNMENT:
+                ins = cur.pop("pending_ins", 0)
+                if ins:
+                    cur["ops"].append((1, ins))
+                if gap:
+                    cur["ops"].append((2, gap))
+                cur["ops"].append((0, p[3] - p[2]))
+                if p[4] == 1:
+                    cur["rend"] = p[3]
+                else:
+                    cur["rstart"] = p[2]
+                cur["qe"] = qe
+                continue
+        if cur is not None:
+            cur.pop("pending_ins", None)
+            alignments.append(cur)
+        cur = {"chrom": p[1], "strand": p[4], "qs": qs, "qe": qe, "rstart": p[2], "rend": p[3],
+               "ops": [(0, p[3] - p[2])]}
+    if cur is not None:
+        cur.pop("pending_ins", None)
+        alignments.append(cur)
+    return [a for a in alignments if a["qe"] - a["qs"] >= MIN_ALIGNED_PIECE]
+
+
+def add_errors(rng, seq, error_rate):
+    """
+    Substitutions at a per-read rate drawn around error_rate, so that reads differ
+    in quality as in real data and the quantile-based mismatch filter passes most of them
+    """
+    if not error_rate:
+        return seq, 0
+    seq = list(seq)
+    read_rate = max(0.0, rng.gauss(error_rate, error_rate * ERROR_RATE_SD))
+    n_err = min(int(len(seq) * read_rate), len(seq))
+    for pos in rng.sample(range(len(seq)), n_err):
+        seq[pos] = rng.choice([b for b in "ACGT" if b != seq[pos]])
+    return "".join(seq), n_err
+
+
+def simulate_reads(ref, haps_by_hp, depth, read_length, error_rate, rng, prefix):
+    reads = []
+    for hp, haps in haps_by_hp.items():
+        for pieces in haps.values():
+            hap_seq = haplotype_seq(ref, pieces)
+            n_reads = int(len(hap_seq) * depth / len(haps_by_hp) / read_length)
+            for _ in range(n_reads):
+                length = max(2000, int(rng.gauss(read_length, read_length * 0.3)))
+                start = rng.randint(0, max(0, len(hap_seq) - length))
+                end = min(len(hap_seq), start + length)
+                alignments = to_alignments(project_read(pieces, start, end))
+                if not alignments:
+                    continue
+                seq, n_err = add_errors(rng, hap_seq[start:end], error_rate)
+                reads.append((f"{prefix}_{len(reads) + 1}", seq, alignments, hp, n_err / max(len(seq), 1)))
+    return reads
+
+
+def write_bam(path, ref, reads):
+    header = {"HD": {"VN": "1.6", "SO": "unsorted"},
+              "SQ": [{"SN": c, "LN": len(s)} for c, s in ref.items()]}
+    tids = {c: i for i, c in enumerate(ref)}
+    unsorted = path + ".unsorted.bam"
+    with pysam.AlignmentFile(unsorted, "wb", header=header) as out:
+        for read_id, seq, alignments, hp, err in reads:
+            read_len = len(seq)
+            primary = max(range(len(alignments)), key=lambda i: alignments[i]["qe"] - alignments[i]["qs"])
+            records = []
+            for a in alignments:
+                ops = a["ops"] if a["strand"] == 1 else a["ops"][::-1]
+                left, right = (a["qs"], read_len - a["qe"]) if a["strand"] == 1 else (read_len - a["qe"], a["qs"])
+                cigar = ([(4, left)] if left else []) + ops + ([(4, right)] if right else [])
+                aligned = sum(l for o, l in ops if o == 0)
+                nm = sum(l for o, l in ops if o in (1, 2)) + int(aligned * err)
+                cigar_str = "".join(f"{l}{'MIDNSHP=X'[o]}" for o, l in cigar)
+                sa = f"{a['chrom']},{a['rstart'] + 1},{'+' if a['strand'] == 1 else '-'},{cigar_str},60,{nm}"
+                records.append((a, cigar, nm, sa))
+            for i, (a, cigar, nm, _) in enumerate(records):
+                r = pysam.AlignedSegment()
+                r.query_name = read_id
+                r.reference_id = tids[a["chrom"]]
+                r.reference_start = a["rstart"]
+                r.mapping_quality = 60
+                r.flag = (16 if a["strand"] == -1 else 0) | (2048 if i != primary else 0)
+                r.cigartuples = cigar
+                r.query_sequence = seq if a["strand"] == 1 else revcomp(seq)
+                tags = [("NM", nm)]
+                if hp:
+                    tags.append(("HP", hp))
+                if len(records) > 1:
+                    tags.append(("SA", ";".join(rec[3] for j, rec in enumerate(records) if j != i) + ";"))
+                r.set_tags(tags)
+                out.write(r)
+    pysam.sort("-o", path, unsorted)
+    os.remove(unsorted)
+    pysam.index(path)
+
+
+def write_phasing_vcf(path, ref):
+    with open(path, "w") as f:
+        f.write("##fileformat=VCFv4.2\n")
+        for c, s in ref.items():
+            f.write(f"##contig=<ID={c},length={len(s)}>\n")
+        f.write('##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">\n')
+        f.write('##FORMAT=<ID=PS,Number=1,Type=Integer,Description="Phase set">\n')
+        f.write("#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tSAMPLE\n")
+        for c, s in ref.items():
+            for pos in range(SNP_STEP, len(s), SNP_STEP):
+                base = s[pos - 1]
+                alt = "A" if base != "A" else "C"
+                f.write(f"{c}\t{pos}\t.\t{base}\t{alt}\t50\tPASS\t.\tGT:PS\t0|1:{(pos // PHASE_BLOCK) * PHASE_BLOCK + 1}\n")
+    pysam.tabix_index(path, preset="vcf", force=True)
+
+
+def planted_svs(rng, chrom_len):
+    """
+    (type, origin, haplotype, chrom, position, chrom_2, end, apply) for every planted SV;
+    end is the insertion length for insertions. Positions scale with chromosome length
+    """
+    def at(chrom, frac):
+        return int(chrom_len[chrom] * frac) // 1000 * 1000
+
+    def deletion(origin, hp, chrom, start, length):
+        return ("DEL", origin, hp, chrom, start, chrom, start + length, sv_deletion(chrom, start, start + length))
+
+    def inversion(origin, hp, chrom, start, length):
+        return ("INV", origin, hp, chrom, start, chrom, start + length, sv_inversion(chrom, start, start + length))
+
+    def insertion(origin, hp, chrom, pos, length):
+        return ("INS", origin, hp, chrom, pos, chrom, length, sv_insertion(chrom, pos, random_seq(rng, length)))
+
+    vntr_start = at("chr2", 0.75)
+    events = [deletion("germline", 1, "chr1", at("chr1", 0.2), 20000),
+              insertion("germline", 0, "chr2", at("chr2", 0.33), 800),
+              deletion("somatic", 1, "chr1", at("chr1", 0.4), 100000),
+              insertion("somatic", 1, "chr2", at("chr2", 0.17), 3000),
+              inversion("somatic", 1, "chr1", at("chr1", 0.6), 50000),
+              ("BND", "somatic", 1, "chr1", at("chr1", 0.8), "chr3", at("chr3", 0.55),
+               sv_translocation("chr1", at("chr1", 0.8), "chr3", at("chr3", 0.55))),
+              ("DUP", "somatic", 1, "chr2", at("chr2", 0.6), "chr2", at("chr2", 0.6) + 60000,
+               sv_duplication("chr2", at("chr2", 0.6), at("chr2", 0.6) + 60000))]
+    #chromothripsis-like cluster of deletions and inversions on one haplotype
+    for i, frac in enumerate([0.1, 0.16, 0.22, 0.28, 0.34]):
+        if i % 2:
+            events.append(inversion("somatic", 2, "chr3", at("chr3", frac), 20000))
+        else:
+            events.append(deletion("somatic", 2, "chr3", at("chr3", frac), 15000))
+    return events, vntr_start
+
+
+def write_pon(path, events):
+    """
+    Panel of normals in the Severus PoN format with the germline SVs
+    """
+    with open(path, "w") as f:
+        for (sv_type, origin, _, chrom, pos, chrom_2, end, _) in events:
+            if origin == "germline":
+                f.write(f"{chrom},{pos},{chrom_2},{end},10,10,{sv_type},0.5\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic tumor/normal long-read bams with planted SVs")
+    parser.add_argument("--out-dir", dest="out_dir", required=True, metavar="path", help="output directory")
+    parser.add_argument("--scale", dest="scale", type=float, default=1.0, metavar="float", help="genome size multiplier (1 = 2.4 Mb) [1]")
+    parser.add_argument("--depth", dest="depth", type=float, default=20, metavar="float", help="sequencing depth per sample [20]")
+    parser.add_argument("--read-length", dest="read_length", type=int, default=15000, metavar="int", help="mean read length [15000]")
+    parser.add_argument("--error-rate", dest="error_rate", type=float, default=0.003, metavar="float", help="mean substitution error rate per read [0.003]")
+    parser.add_argument("--seed", dest="seed", type=int, default=7, metavar="int", help="random seed [7]")
+    args = parser.parse_args()
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    rng = random.Random(args.seed)
+    chrom_len = {c: int(BASE_CHROM_LEN * frac * args.scale) for c, frac in CHROM_FRACTIONS.items()}
+    ref = {c: random_seq(rng, l) for c, l in chrom_len.items()}
+
+    events, vntr_start = planted_svs(rng, chrom_len)
+    motif = random_seq(rng, VNTR_MOTIF_LEN)
+    vntr_end = vntr_start + VNTR_MOTIF_LEN * VNTR_COPIES
+    ref["chr2"] = ref["chr2"][:vntr_start] + motif * VNTR_COPIES + ref["chr2"][vntr_end:]
+    vntr_pos = vntr_start + VNTR_MOTIF_LEN * VNTR_COPIES // 2
+    events.append(("VNTR", "somatic", 1, "chr2", vntr_pos, "chr2", VNTR_MOTIF_LEN * VNTR_COPIES * 2,
+                   sv_insertion("chr2", vntr_pos, motif * VNTR_COPIES * 2)))
+
+    germline = [e for e in events if e[1] == "germline"]
+    normal = {hp: build_haplotype(ref, [e for e in germline if e[2] in (0, hp)]) for hp in (1, 2)}
+    tumor = {hp: build_haplotype(ref, [e for e in events if e[2] in (0, hp)]) for hp in (1, 2)}
+
+    with open(os.path.join(args.out_dir, "ref.fa"), "w") as f:
+        for c, s in ref.items():
+            f.write(f">{c}\n{s}\n")
+    write_bam(os.path.join(args.out_dir, "normal.bam"), ref,
+              simulate_reads(ref, normal, args.depth, args.read_length, args.error_rate, rng, "normal"))
+    write_bam(os.path.join(args.out_dir, "tumor.bam"), ref,
+              simulate_reads(ref, tumor, args.depth, args.read_length, args.error_rate, rng, "tumor"))
+    write_phasing_vcf(os.path.join(args.out_dir, "phased.vcf"), ref)
+    with open(os.path.join(args.out_dir, "vntr.bed"), "w") as f:
+        f.write(f"chr2\t{vntr_start}\t{vntr_end}\n")
+    with open(os.path.join(args.out_dir, "planted_svs.tsv"), "w") as f:
+        f.write("#sv_type\torigin\thaplotype\tchrom\tposition\tchrom_2\tend\n")
+        for (sv_type, origin, hp, chrom, pos, chrom_2, end, _) in events:
+            f.write(f"{sv_type}\t{origin}\t{hp}\t{chrom}\t{pos}\t{chrom_2}\t{end}\n")
+    write_pon(os.path.join(args.out_dir, "pon.tsv"), events)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Startup benchmark. Times `severus --version` and `severus --help`, reports the
+slowest imports of severus.main and checks that the heavy optional modules
+(plotting, graph and Arrow libraries) are loaded neither at startup nor in the
+pool workers. With --data-dir, also runs Severus on the synthetic data with a
+single pool worker and checks the modules it loaded by the end of the output
+stage: the html plots are rendered in the workers, which import plotly, and
+nothing else should be loaded there. Exits with an error if one of the checks
+fails, or if the import time is above --max-import-ms.
+
+Usage:
+  startup.py [--runs 5] [--max-import-ms 500] [--data-dir bench/data]
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+import statistics
+
+BENCH_DIR = os.path.dirname(os.path.realpath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+SEVERUS = os.path.join(ROOT_DIR, "severus.py")
+
+#imported only by the stages that need them
+LAZY_MODULES = ["plotly", "networkx", "pyarrow", "matplotlib", "http.server"]
+#imported by the pool workers rendering the html plots
+PLOT_WORKER_MODULES = ["plotly"]
+
+LOADED_MODULES = f"""
+import sys, json
+from multiprocessing import Pool
+sys.path.insert(0, {ROOT_DIR!r})
+import severus.main, severus.api
+lazy = {LAZY_MODULES!r}
+code = "[m for m in {{!r}} if m in __import__('sys').modules]".format(lazy)
+with Pool(1) as pool:
+    in_worker = pool.apply(eval, (code,))
+print(json.dumps({{'main': [m for m in lazy if m in sys.modules], 'worker': in_worker}}))
+"""
+
+#the pool of the run is replaced with one worker, checked when the pool is closed after the output stage
+OUTPUT_STAGE_MODULES = f"""
+import sys, json, os
+from multiprocessing.pool import Pool
+sys.path.insert(0, {ROOT_DIR!r})
+import severus.api
+lazy = {LAZY_MODULES!r}
+code = "[m for m in {{!r}} if m in __import__('sys').modules]".format(lazy)
+in_worker = []
+
+class CheckedPool(Pool):
+    def __exit__(self, *exc_info):
+        in_worker.extend(self.apply(eval, (code,)))
+        return super().__exit__(*exc_info)
+
+severus.api.make_pool = lambda executor, threads: CheckedPool(1)
+data_dir, out_dir = sys.argv[1:3]
+severus.api.run(os.path.join(data_dir, "tumor.bam"), os.path.join(data_dir, "normal.bam"), out_dir, threads=2,
+                phasing_vcf=os.path.join(data_dir, "phased.vcf.gz"), vntr_bed=os.path.join(data_dir, "vntr.bed"), plots="all")
+plots_dir = os.path.join(out_dir, "somatic_SVs", "plots")
+n_plots = len([f for f in os.listdir(plots_dir) if f.endswith(".html")]) if os.path.isdir(plots_dir) else 0
+print(json.dumps({{'worker': in_worker, 'plots': n_plots}}))
+"""
+
+
+def time_command(cmd, runs):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.check_call(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def import_times():
+    """
+    (self, cumulative) import time in us by module, from python -X importtime
+    """
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", "import severus.main"], cwd=ROOT_DIR,
+                         stderr=subprocess.PIPE, stdout=subprocess.DEVNULL, universal_newlines=True, check=True).stderr
+    times = {}
+    for line in out.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        times[name.strip()] = (int(self_us), int(cumulative_us))
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Severus startup time and lazy import check")
+    parser.add_argument("--runs", dest="runs", type=int, default=5, metavar="int", help="runs per command [5]")
+    parser.add_argument("--top", dest="top", type=int, default=10, metavar="int", help="slowest imports to report [10]")
+    parser.add_argument("--max-import-ms", dest="max_import_ms", type=float, default=None, metavar="float",
+                        help="fail if importing severus.main takes longer [None]")
+    parser.add_argument("--data-dir", dest="data_dir", default=None, metavar="path",
+                        help="synthetic data from simulate.py, to also check the pool worker after the output stage [None]")
+    args = parser.parse_args()
+
+    for opt in ["--version", "--help"]:
+        print(f"severus {opt}: {time_command([sys.executable, SEVERUS, opt], args.runs) * 1000:.0f} ms")
+
+    times = import_times()
+    total_ms = times["severus.main"][1] / 1000
+    print(f"import severus.main: {total_ms:.0f} ms")
+    for name, (self_us, _) in sorted(times.items(), key=lambda x: -x[1][0])[:args.top]:
+        print(f"\t{name}: {self_us / 1000:.1f} ms")
+
+    loaded = json.loads(subprocess.check_output([sys.executable, "-c", LOADED_MODULES], cwd=ROOT_DIR, universal_newlines=True))
+    failed = False
+    for where, modules in loaded.items():
+        if modules:
+            print(f"Error: loaded at startup in {where} process: {', '.join(modules)}", file=sys.stderr)
+            failed = True
+    if args.data_dir:
+        with tempfile.TemporaryDirectory(prefix="severus_startup_") as out_dir:
+            output_stage = json.loads(subprocess.check_output([sys.executable, "-c", OUTPUT_STAGE_MODULES, args.data_dir, out_dir],
+                                                              cwd=ROOT_DIR, universal_newlines=True, stderr=subprocess.DEVNULL).splitlines()[-1])
+        print(f"pool worker after the output stage ({output_stage['plots']} plots): {', '.join(output_stage['worker']) or 'none'}")
+        unexpected = [m for m in output_stage['worker'] if m not in PLOT_WORKER_MODULES]
+        if unexpected:
+            print(f"Error: loaded in the pool worker by the output stage: {', '.join(unexpected)}", file=sys.stderr)
+            failed = True
+    if args.max_import_ms is not None and total_ms > args.max_import_ms:
+        print(f"Error: import time {total_ms:.0f} ms is above {args.max_import_ms:.0f} ms", file=sys.stderr)
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
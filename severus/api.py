@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Python API. Runs Severus in the calling process and returns the calls as
+columnar tables (dicts of column name to numpy array) instead of text outputs:
+
+    from severus.api import run
+    result = run(["tumor.bam"], control_bam="normal.bam", phasing_vcf="phased.vcf.gz", min_support=5)
+    result.breakpoints["pos"], result.support["vaf"]
+
+Options are the command line options with '-' replaced by '_' (min_support,
+vntr_bed, TIN_ratio, PON, executor, ...). Output files are written only if out_dir is given.
+"""
+
+import os
+import tempfile
+import contextlib
+from collections import defaultdict
+
+import pysam
+
+from severus.main import build_parser, _set_defaults, _min_aligned_length, _check_inputs, _genome_ids, _read_regions
+from severus.build_graph import output_graphs, build_cluster_graph, graph_keys
+from severus.bam_processing import get_all_reads_parallel, init_hist, init_mm_hist, update_coverage_hist, in_regions
+from severus.breakpoint_finder import find_breakpoints, filter_breakpoints, get_phasingblocks, annotate_svs
+from severus.resolve_vntr import update_segments_by_read
+from severus.tables import breakpoint_tables, coverage_table, read_stats_table
+from severus.parquet_output import pyarrow_available
+from severus.executor import make_pool
+
+
+#run modes of the command line, not available in the API
+CLI_MODES = ['checkpoint', 'resume', 'scatter_shard', 'gather_shards', 'cohort_dir', 'sweep', 'serve']
+
+
+class SeverusError(Exception):
+    pass
+
+
+class SeverusResult(object):
+    """
+    Tables of a run. breakpoints: one row per SV; support: one row per SV, genome and haplotype;
+    clusters: one row per SV of every germline / somatic graph cluster; coverage: one row per
+    genome, haplotype and coverage window; read_stats: segment counts by quality label
+    """
+    __slots__ = ('breakpoints', 'support', 'clusters', 'coverage', 'read_stats', 'double_breaks', 'min_aligned_length')
+    def __init__(self, breakpoints, support, clusters, coverage, read_stats, double_breaks, min_aligned_length):
+        self.breakpoints = breakpoints
+        self.support = support
+        self.clusters = clusters
+        self.coverage = coverage
+        self.read_stats = read_stats
+        self.double_breaks = double_breaks
+        self.min_aligned_length = min_aligned_length
+
+
+def _argv(target_bam, control_bam, out_dir, threads, options):
+    argv = ['--target-bam'] + ([target_bam] if isinstance(target_bam, str) else list(target_bam))
+    if control_bam:
+        argv += ['--control-bam'] + ([control_bam] if isinstance(control_bam, str) else list(control_bam))
+    argv += ['--out-dir', out_dir, '--threads', str(threads)]
+    for opt, value in options.items():
+        if value is None or value is False:
+            continue
+        argv.append('--' + opt.replace('_', '-'))
+        if isinstance(value, (list, tuple)):
+            argv += [str(v) for v in value]
+        elif value is not True:
+            argv.append(str(value))
+    return argv
+
+
+def run(target_bam, control_bam=None, out_dir=None, threads=8, **options):
+    """
+    Calls SVs and returns a SeverusResult. Output files are written to out_dir if it is given,
+    otherwise intermediate files go to a temporary directory that is removed afterwards
+    """
+    try:
+        args = build_parser().parse_args(_argv(target_bam, control_bam, out_dir or '.', threads, options))
+    except SystemExit:
+        raise SeverusError(f"invalid options: {options}")
+    modes = [mode for mode in CLI_MODES if getattr(args, mode)]
+    if modes:
+        raise SeverusError(f"options only available on the command line: {', '.join(modes)}")
+    min_aligned_length = _min_aligned_length(args)
+    _set_defaults(args)
+    input_error = _check_inputs(args)
+    if input_error:
+        raise SeverusError(input_error)
+    if args.parquet and not pyarrow_available():
+        raise SeverusError("parquet output requires the pyarrow package")
+
+    all_bams = args.target_bam + args.control_bam
+    with pysam.AlignmentFile(all_bams[0], "rb") as a:
+        ref_lengths = dict(zip(a.references, a.lengths))
+    regions_error = _read_regions(args, ref_lengths)
+    if regions_error:
+        raise SeverusError(regions_error)
+    genome_ids, bam_files, target_genomes, control_genomes = _genome_ids(args)
+
+    if out_dir and not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    with contextlib.ExitStack() as stack:
+        args.out_dir = out_dir or stack.enter_context(tempfile.TemporaryDirectory(prefix="severus_"))
+        args.write_segdups_out = ''
+        if args.write_segdup and out_dir:
+            args.write_segdups_out = stack.enter_context(open(os.path.join(out_dir, "severus_collaped_dup.bed"), "w"))
+        args.write_log_out = ''
+        if args.output_loh and out_dir:
+            args.write_log_out = stack.enter_context(open(os.path.join(out_dir, "severus_LOH.bed"), "w"))
+        args.outpath_readqual = os.path.join(args.out_dir, "read_qual.txt")
+        thread_pool = stack.enter_context(make_pool(args.executor, threads))
+
+        args.min_aligned_length = min_aligned_length
+        coverage_histograms = init_hist(genome_ids, ref_lengths)
+        mismatch_histograms = init_mm_hist(ref_lengths)
+        n90 = [min_aligned_length]
+        bg_mm = []
+        read_qual = defaultdict(int)
+        read_qual_len = defaultdict(int)
+        segments_by_read = []
+        for bam_file, genome_id in zip(all_bams, genome_ids):
+            segments_by_read += get_all_reads_parallel(bam_file, thread_pool, ref_lengths, genome_id, coverage_histograms,
+                                                       mismatch_histograms, n90, bg_mm, read_qual, read_qual_len, args)
+        args.min_aligned_length = min(n90) if not args.multisample else min_aligned_length
+        update_segments_by_read(segments_by_read, mismatch_histograms, bg_mm, ref_lengths, read_qual, read_qual_len, args)
+        update_coverage_hist(coverage_histograms, genome_ids, ref_lengths, segments_by_read, control_genomes, target_genomes, args.write_log_out)
+
+        double_breaks, ins_clusters, single_bps = find_breakpoints(segments_by_read, ref_lengths, bam_files, genome_ids,
+                                                                   control_genomes, thread_pool, args)
+        double_breaks = filter_breakpoints(double_breaks, ins_clusters, single_bps, segments_by_read, ref_lengths, coverage_histograms,
+                                           bam_files, genome_ids, control_genomes, thread_pool, args)
+        segments_by_read = None
+        if args.regions is not None:
+            for key, db_list in double_breaks.items():
+                double_breaks[key] = [db for db in db_list if in_regions(args.regions, db.bp_1.ref_id, db.bp_1.position) or
+                                      in_regions(args.regions, db.bp_2.ref_id, db.bp_2.position)]
+
+        if out_dir:
+            graphs = output_graphs(double_breaks, coverage_histograms, thread_pool, target_genomes, control_genomes,
+                                   genome_ids, ref_lengths, args)
+        else:
+            hb_points = []
+            if args.phase_vcf:
+                hb_points = get_phasingblocks(args.phase_vcf, thread_pool, os.path.join(args.out_dir, "phasing_blocks.json"))
+            keys = graph_keys(control_genomes, args)
+            if 'germline' not in keys:
+                annotate_svs(double_breaks['germline'], coverage_histograms, hb_points, args.min_sv_size)
+            graphs = {key: build_cluster_graph(double_breaks[key], coverage_histograms, hb_points, key,
+                                               target_genomes, control_genomes, ref_lengths, args) for key in keys}
+
+    breakpoints, support, clusters = breakpoint_tables(double_breaks, graphs)
+    return SeverusResult(breakpoints, support, clusters, coverage_table(coverage_histograms, genome_ids, ref_lengths),
+                         read_stats_table(read_qual, read_qual_len), double_breaks, args.min_aligned_length)
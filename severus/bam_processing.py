@@ -1,10 +1,15 @@
 import pysam
 import numpy as np
 import bisect
+import gzip
+import re
 from collections import  defaultdict
 import logging
 import datetime
 
+from severus.profiling import pool_starmap, pool_imap
+from severus.filters import SEG_PASS, SEG_VNTR_ONLY, SEG_LOW_MAPQ, SEG_HIGH_MM_RATE, SEG_LOW_ALIGNED_LEN, SEG_UNLABELED, seg_filter_name
+
 logger = logging.getLogger()
 COV_WINDOW_MM  = 1000
 COV_WINDOW  = 1000
@@ -35,7 +40,7 @@ class ReadSegment(object):
         self.mapq = mapq
         self.genome_id = genome_id
         self.mismatch_rate = mismatch_rate
-        self.is_pass = ''
+        self.is_pass = SEG_UNLABELED
         self.is_insertion = is_insertion
         self.is_clipped = False
         self.error_rate = error_rate
@@ -47,7 +52,7 @@ class ReadSegment(object):
         return "".join(["read_start=", str(self.read_start), " read_end=", str(self.read_end), " ref_start=", str(self.ref_start),
                          " ref_end=", str(self.ref_end), " read_id=", str(self.read_id), " ref_id=", str(self.ref_id), " strand=", str(self.strand),
                          " read_length=", str(self.read_length), " haplotype=", str(self.haplotype),
-                         " mapq=", str(self.mapq), "mismatch_rate=", str(self.mismatch_rate), " read_qual=", str(self.is_pass), " genome_id=", str(self.genome_id)])
+                         " mapq=", str(self.mapq), "mismatch_rate=", str(self.mismatch_rate), " read_qual=", seg_filter_name(self.is_pass), " genome_id=", str(self.genome_id)])
     def get_pos(self, bp_pos):
         if bp_pos == "right":
             ref_bp = self.ref_end if self.strand == 1 else self.ref_start
@@ -255,7 +260,7 @@ def extract_clipped_end(segments_by_read):
     MIN_CLIPPED_LENGTH = 500
 
     for read in segments_by_read:
-        read2 = [seg for seg  in read if not seg.is_insertion and seg.is_pass == 'PASS']
+        read2 = [seg for seg  in read if not seg.is_insertion and seg.is_pass == SEG_PASS]
         if not read2:
             continue
         read2.sort(key=lambda s: s.read_start)
@@ -267,7 +272,7 @@ def extract_clipped_end(segments_by_read):
             read.append(ReadSegment(0, 0, s1.read_start, pos, pos, pos, pos, s1.read_id,
                                     s1.ref_id, st, s1.read_length, s1.align_len, s1.segment_length, s1.haplotype, s1.mapq, s1.genome_id, s1.mismatch_rate, False, s1.error_rate, None))
             read[-1].is_clipped = True
-            read[-1].is_pass = 'PASS'
+            read[-1].is_pass = SEG_PASS
         end_clip_length = s2.read_length - s2.read_end
         if end_clip_length > MIN_CLIPPED_LENGTH:
             pos = s2.ref_end if s2.strand == 1 else s2.ref_start
@@ -275,7 +280,7 @@ def extract_clipped_end(segments_by_read):
             read.append(ReadSegment(s2.read_end, s2.read_end, s2.read_length, pos, pos, pos, pos, s2.read_id,
                                     s2.ref_id, st, s2.read_length, s2.align_len, s2.segment_length, s2.haplotype, s2.mapq, s2.genome_id, s2.mismatch_rate, False, s2.error_rate, None))
             read[-1].is_clipped = True
-            read[-1].is_pass = 'PASS'
+            read[-1].is_pass = SEG_PASS
         read.sort(key=lambda s: s.read_start)
         
 def get_cov(bam_file, genome_id, ref_id, poslist, min_mapq):
@@ -336,9 +341,8 @@ def get_coverage_parallel(bam_files, genome_ids, thread_pool, min_mapq, double_b
     for genome_id in genome_ids:
         covlist = defaultdict(list)
         tasks = [(bam_files[genome_id], genome_id, ref_id, pos, min_mapq) for ref_id, poslist in db_list.items() for pos in poslist]
-        parsing_results = None
-        parsing_results = thread_pool.starmap(get_cov, tasks)
-        for item in parsing_results:
+        #every breakpoint position is in one task, the order does not matter
+        for item in pool_imap(thread_pool, get_cov, tasks, ordered=False, unit='regions', count=len, item_unit='positions'):
             for key, value in item.items():
                 covlist[key] = value
         for db in double_breaks:
@@ -346,13 +350,76 @@ def get_coverage_parallel(bam_files, genome_ids, thread_pool, min_mapq, double_b
             db.bp_2.spanning_reads[genome_id] = covlist[(db.bp_2.ref_id, db.bp_2.position)]
     
         
-def get_all_reads(bam_file, region, genome_id,sv_size,use_supplementary_tag):
+def read_regions(bed_file, chroms, ref_lengths):
+    """
+    Merged [start, end) intervals by contig from a bed file, a list of contigs or both
+    """
+    intervals = defaultdict(list)
+    if bed_file:
+        f = gzip.open(bed_file, 'rt') if bed_file.endswith('.gz') else open(bed_file)
+        for line in f:
+            if not line.strip() or line.startswith(('#', 'track', 'browser')):
+                continue
+            fields = line.split()
+            intervals[fields[0]].append((max(0, int(fields[1])), int(fields[2])))
+        f.close()
+    if chroms:
+        if bed_file:
+            intervals = {ctg: ls for ctg, ls in intervals.items() if ctg in chroms}
+        else:
+            intervals = {ctg: [(0, ref_lengths.get(ctg, 0))] for ctg in chroms}
+
+    regions = {}
+    for ctg, ls in intervals.items():
+        merged = []
+        for start, end in sorted(ls):
+            end = min(end, ref_lengths.get(ctg, end))
+            if merged and start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        regions[ctg] = merged
+    return regions
+
+
+def in_regions(regions, ref_id, start, end=None):
+    """
+    Checks if [start, end] overlaps the regions
+    """
+    if ref_id not in regions:
+        return False
+    end = start if end is None else end
+    intervals = regions[ref_id]
+    ind = bisect.bisect_right(intervals, [end, float('inf')])
+    return ind > 0 and intervals[ind - 1][1] > start
+
+
+def _sa_partners(aln, regions):
+    """
+    (ref_id, start, read_id) of the other alignments of a split read that are outside of the regions
+    """
+    partners = []
+    for sa in aln.get_tag('SA').split(';'):
+        if not sa:
+            continue
+        ref_id, pos, _strand, cigar, _mapq, _nm = sa.split(',')
+        start = int(pos) - 1
+        ref_len = sum(int(l) for l, op in re.findall(r'(\d+)([MDN=X])', cigar))
+        if not in_regions(regions, ref_id, start, start + ref_len - 1):
+            partners.append((ref_id, start, aln.query_name))
+    return partners
+
+
+def get_all_reads(bam_file, region, genome_id,sv_size,use_supplementary_tag, regions=None, prev_end=0):
     """
     Yields set of split reads for each contig separately. Only reads primary alignments
-    and infers the split reads from SA alignment tag
+    and infers the split reads from SA alignment tag. With regions, also returns the
+    split read alignments outside of the regions listed in SA tags. Alignments starting
+    before prev_end, the end of the previous fetched interval, were parsed with it and are skipped
     """
 
     alignments = []
+    partners = []
     read_info_final = []
     ncol= 10000
     read_info = np.zeros((ncol,9), dtype = int)
@@ -360,10 +427,14 @@ def get_all_reads(bam_file, region, genome_id,sv_size,use_supplementary_tag):
     aln_file = pysam.AlignmentFile(bam_file, "rb")
     t=0
     for aln in aln_file.fetch(ref_id, region_start, region_end,  multiple_iterators=True):
+        if aln.reference_start < prev_end:
+            continue
         if not aln.is_secondary and not aln.is_unmapped:
             new_segment, read_inf = get_segment(aln, genome_id, sv_size,use_supplementary_tag, ref_ind)
             if new_segment:
                 alignments += new_segment
+                if regions is not None and aln.has_tag('SA'):
+                    partners += _sa_partners(aln, regions)
             if not len(read_inf):
                 continue
             read_info[t] = read_inf
@@ -377,49 +448,150 @@ def get_all_reads(bam_file, region, genome_id,sv_size,use_supplementary_tag):
                 read_info = np.zeros((ncol,9), dtype = int)
                
     if not len(read_info_final):
-        t = 1 if t ==0 else t
-        read_info_final = read_info[0:t-1]
+        read_info_final = read_info[0:t]
     else:
-        read_info_final = np.concatenate((read_info_final, read_info[0:t-1]), axis=0)                
-    return (alignments, read_info_final)
+        read_info_final = np.concatenate((read_info_final, read_info[0:t]), axis=0)                
+    return (alignments, read_info_final, partners)
+
+
+def get_partner_reads(bam_file, ref_ind, ref_id, partners, genome_id, sv_size, use_supplementary_tag):
+    """
+    Parses the split read alignments given by (start, read_id) on one contig
+    """
+    WINDOW = 10000
+    wanted = set(partners)
+    windows = []
+    for pos in sorted(set(pos for pos, _ in partners)):
+        if windows and pos - windows[-1][1] < WINDOW:
+            windows[-1][1] = pos + 1
+        else:
+            windows.append([pos, pos + 1])
+
+    alignments = []
+    aln_file = pysam.AlignmentFile(bam_file, "rb")
+    for start, end in windows:
+        for aln in aln_file.fetch(ref_id, start, end, multiple_iterators=True):
+            if aln.is_secondary or aln.is_unmapped or not (aln.reference_start, aln.query_name) in wanted:
+                continue
+            wanted.remove((aln.reference_start, aln.query_name))
+            new_segment, _read_inf = get_segment(aln, genome_id, sv_size, use_supplementary_tag, ref_ind)
+            alignments += new_segment
+    return alignments
+
+
+def _fetch_list(all_reference_ids, ref_lengths, regions):
+    CHUNK_SIZE = 10000000
+    fetch_list = []
+    for j, ctg in enumerate(all_reference_ids):
+        if regions is None:
+            intervals = [(0, ref_lengths[ctg])]
+        else:
+            intervals = regions.get(ctg, [])
+        for int_start, int_end in intervals:
+            int_len = int_end - int_start
+            for i in range(0, max(int_len // CHUNK_SIZE, 1)):
+                reg_start = int_start + i * CHUNK_SIZE
+                reg_end = int_start + (i + 1) * CHUNK_SIZE
+                if int_end - reg_end < CHUNK_SIZE:
+                    reg_end = int_end
+                fetch_list.append((j, ctg, reg_start, reg_end))
+    return fetch_list
+
+
+def _background_fetch_list(all_reference_ids, ref_lengths, regions):
+    """
+    Evenly spaced windows outside of the regions, used to estimate read length and mismatch statistics
+    """
+    BG_WINDOWS = 20
+    BG_WINDOW_LEN = 200000
+    genome_len = sum(ref_lengths[ctg] for ctg in all_reference_ids)
+    step = genome_len // BG_WINDOWS
+    window_len = min(BG_WINDOW_LEN, step)
+    fetch_list = []
+    ctg_ind, ctg_offset = 0, 0
+    for k in range(BG_WINDOWS):
+        pos = k * step
+        while pos >= ctg_offset + ref_lengths[all_reference_ids[ctg_ind]]:
+            ctg_offset += ref_lengths[all_reference_ids[ctg_ind]]
+            ctg_ind += 1
+        ctg = all_reference_ids[ctg_ind]
+        reg_start = pos - ctg_offset
+        reg_end = min(reg_start + window_len, ref_lengths[ctg])
+        if not in_regions(regions, ctg, reg_start, reg_end - 1):
+            fetch_list.append((ctg_ind, ctg, reg_start, reg_end))
+    return fetch_list
 
 
 def get_all_reads_parallel(bam_file, thread_pool, ref_lengths, genome_id,
                            coverage_histograms, mismatch_histograms, n90ls, bg_mmls,read_qual,read_qual_len, args):
 
-    CHUNK_SIZE = 10000000
     sv_size = args.sv_size
     use_supplementary_tag = args.use_supplementary_tag
+    regions = args.regions
     
     all_reference_ids = [r for r in pysam.AlignmentFile(bam_file, "rb").references]
-    fetch_list = []
-    for j, ctg in enumerate(all_reference_ids):
-        ctg_len = ref_lengths[ctg]
-        for i in range(0, max(ctg_len // CHUNK_SIZE, 1)):
-            reg_start = i * CHUNK_SIZE
-            reg_end = (i + 1) * CHUNK_SIZE
-            if ctg_len - reg_end < CHUNK_SIZE:
-                reg_end = ctg_len
-            fetch_list.append((j, ctg, reg_start, reg_end))
-    tasks = [(bam_file, region, genome_id,sv_size,use_supplementary_tag) for region in fetch_list]
-    parsing_results = None
-    parsing_results = thread_pool.starmap(get_all_reads, tasks)
+    fetch_list = _fetch_list(all_reference_ids, ref_lengths, regions)
+    #an alignment overlapping several fetched intervals (chunks or nearby regions) is parsed with the first one.
+    #Shards of the scatter mode leave the alignments starting before their regions to the shard containing the start
+    prev_ends = []
+    for i, region in enumerate(fetch_list):
+        if i and fetch_list[i - 1][1] == region[1]:
+            prev_ends.append(fetch_list[i - 1][3])
+        else:
+            prev_ends.append(region[2] if args.scatter_shard else 0)
+    tasks = [(bam_file, region, genome_id,sv_size,use_supplementary_tag, regions, prev_end)
+             for region, prev_end in zip(fetch_list, prev_ends)]
+    #in the task order, which sets the order of the reads
+    parsing_results = []
     segments_by_read = defaultdict(list)
-    for alignments in parsing_results:
+    for alignments in pool_imap(thread_pool, get_all_reads, tasks, unit='regions',
+                                count=lambda alignments: len(alignments[1]), item_unit='alignments'):
         for aln in alignments[0]:
             if aln:
                 segments_by_read[aln.read_id].append(aln)
-    n90, bg_mm = calc_read_qual(parsing_results, segments_by_read, mismatch_histograms, coverage_histograms, genome_id, ref_lengths, read_qual, read_qual_len, args)
+        parsing_results.append(alignments)
+
+    background = None
+    if regions is not None:
+        partners = defaultdict(set)
+        for alignments in parsing_results:
+            for ref_id, start, read_id in alignments[2]:
+                partners[ref_id].add((start, read_id))
+        ref_ind = {ctg: j for j, ctg in enumerate(all_reference_ids)}
+        tasks = [(bam_file, ref_ind[ref_id], ref_id, list(ls), genome_id, sv_size, use_supplementary_tag)
+                 for ref_id, ls in partners.items() if ref_id in ref_ind]
+        for alignments in pool_starmap(thread_pool, get_partner_reads, tasks):
+            for aln in alignments:
+                segments_by_read[aln.read_id].append(aln)
+        logger.info(f"\tSplit read alignments outside of the regions: {sum(len(ls) for ls in partners.values())}")
+
+        tasks = [(bam_file, region, genome_id,sv_size,use_supplementary_tag) for region in
+                 _background_fetch_list(all_reference_ids, ref_lengths, regions)]
+        background = pool_starmap(thread_pool, get_all_reads, tasks)
+
+    n90, bg_mm = calc_read_qual(parsing_results, segments_by_read, mismatch_histograms, coverage_histograms, genome_id, ref_lengths, read_qual, read_qual_len, args, background)
     n90ls.append(n90)
     bg_mmls.append(bg_mm)
     
     return list(segments_by_read.values())
 
 
-def calc_read_qual(parsing_results,segments_by_read, mismatch_histograms, coverage_histograms, genome_id, ref_lengths, read_qual, read_qual_len, args):
-    bg_mm = background_mm_rat(parsing_results, args.multisample)
+def calc_read_qual(parsing_results,segments_by_read, mismatch_histograms, coverage_histograms, genome_id, ref_lengths, read_qual, read_qual_len, args, background=None):
+    """
+    Read statistics and histograms. Background windows parsed in the region-restricted mode
+    are used for the statistics only
+    """
+    stat_results, stat_segments = parsing_results, segments_by_read
+    if background:
+        stat_results = parsing_results + background
+        stat_segments = defaultdict(list, segments_by_read)
+        for alignments in background:
+            for aln in alignments[0]:
+                if not aln.read_id in segments_by_read:
+                    stat_segments[aln.read_id].append(aln)
+    bg_mm = background_mm_rat(stat_results, args.multisample)
     update_mm_hist(parsing_results, mismatch_histograms, ref_lengths)
-    n90 = get_read_statistics(parsing_results, segments_by_read)
+    n90 = get_read_statistics(stat_results, stat_segments)
     n90 = min(n90, args.min_aligned_length) if not args.multisample else args.min_aligned_length
     update_cov_hist(parsing_results, coverage_histograms, genome_id, ref_lengths, bg_mm, n90, read_qual, read_qual_len, args)
     return n90, bg_mm
@@ -429,10 +601,20 @@ def init_hist(genome_ids, ref_lengths):
     for genome_id in genome_ids:
         for chr_id, chr_len in ref_lengths.items():
             for hp in range(0, NUM_HAPLOTYPES):
-                coverage_histograms[(genome_id, hp, chr_id)] = [0 for _ in range(chr_len // COV_WINDOW + 1)]
+                coverage_histograms[(genome_id, hp, chr_id)] = np.zeros(chr_len // COV_WINDOW + 1, dtype = np.int32)
     return coverage_histograms
 
 
+def range_median(histogram, hist_start, hist_end):
+    """
+    Median of histogram windows [hist_start, hist_end), 0 for an empty range
+    """
+    cov_list = histogram[hist_start : hist_end]
+    if not cov_list.size:
+        return 0
+    return int(np.median(cov_list))
+
+
 def update_cov_hist(parsing_results, coverage_histograms, genome_id, ref_lengths, bg_mm, n90, read_qual, read_qual_len, args):
     for alignments in parsing_results:
         if alignments[1].size == 0:
@@ -444,8 +626,7 @@ def update_cov_hist(parsing_results, coverage_histograms, genome_id, ref_lengths
                 read_qual_len['PASS'] += alignments[1][j][4]
                 hist_start = alignments[1][j][1] // COV_WINDOW
                 hist_end = alignments[1][j][2]// COV_WINDOW
-                for i in range(hist_start, hist_end + 1):
-                    coverage_histograms[(genome_id, alignments[1][j][5], chr_id)][i] += 1
+                coverage_histograms[(genome_id, alignments[1][j][5], chr_id)][hist_start : hist_end + 1] += 1
             else:
                 read_qual['FAIL'] += 1
                 read_qual_len['FAIL'] += alignments[1][j][4]
@@ -454,24 +635,21 @@ def update_coverage_hist(coverage_histograms,genome_ids, ref_lengths, segments_b
     
     for read in segments_by_read:
         for seg in read:
-            if seg.is_pass == 'PASS' and not seg.is_insertion and not seg.is_clipped:
+            if seg.is_pass == SEG_PASS and not seg.is_insertion and not seg.is_clipped:
                 hist_start = seg.ref_start_ori // COV_WINDOW
                 hist_end = min([seg.ref_end_ori, ref_lengths[seg.ref_id]])// COV_WINDOW
-                for i in range(hist_start + 1, hist_end):
-                    coverage_histograms[(seg.genome_id, seg.haplotype, seg.ref_id)][i] += 1
+                coverage_histograms[(seg.genome_id, seg.haplotype, seg.ref_id)][hist_start + 1 : hist_end] += 1
 
     for genome_id in genome_ids:
         by_hp = {}
         for hp in range(0, NUM_HAPLOTYPES):
-            by_hp[hp] = []
-            for chr_id, _chr_len in ref_lengths.items():
-                by_hp[hp].extend(coverage_histograms[(genome_id, hp, chr_id)])
+            by_hp[hp] = np.concatenate([coverage_histograms[(genome_id, hp, chr_id)] for chr_id in ref_lengths])
 
         hp1_cov, hp2_cov, hp0_cov = np.median(by_hp[1]), np.median(by_hp[2]), np.median(by_hp[0])
         logger.info(f"\tMedian coverage by PASS reads for {genome_id} (H1 / H2 / H0): {hp1_cov} / {hp2_cov} / {hp0_cov}")
         
-        if loh_out:
-            extract_LOH(coverage_histograms, ref_lengths, control_genomes, target_genomes, loh_out)
+    if loh_out and control_genomes:
+        extract_LOH(coverage_histograms, ref_lengths, control_genomes, target_genomes, loh_out)
         
 
 def add_read_qual(segments_by_read, ref_lengths, bg_mm, mismatch_histograms,read_qual,read_qual_len, args):
@@ -480,26 +658,27 @@ def add_read_qual(segments_by_read, ref_lengths, bg_mm, mismatch_histograms,read
     write_segdups_out = args.write_segdups_out
     
     mm_hist_high = background_mm_hist(segments_by_read, mismatch_histograms, bg_mm, ref_lengths)
+    mm_hist_cumsum = mm_hist_prefix_sum(mm_hist_high)
 
     if write_segdups_out:
         extract_segdups(mm_hist_high, write_segdups_out) ###
     for alignments in segments_by_read:
         if not alignments:
             continue
-        label_reads(alignments, min_mapq, bg_mm, mm_hist_high, min_aligned_length, args.multisample)
+        label_reads(alignments, min_mapq, bg_mm, mm_hist_cumsum, min_aligned_length, args.multisample)
 
     write_readqual(segments_by_read, args.outpath_readqual,read_qual,read_qual_len)
 
 
-def label_reads(read, min_mapq, bg_mm, mm_hist_high, min_aligned_length, multisample):
+def label_reads(read, min_mapq, bg_mm, mm_hist_cumsum, min_aligned_length, multisample):
     MIN_ALIGNED_RATE = 0.5
     MIN_ALIGNED_LEN = min_aligned_length if multisample else 2000
 
     for seg in read:
         if seg.mapq < min_mapq:
-            seg.is_pass += '_LOW_MAPQ'
-        if high_mm_check(mm_hist_high, bg_mm, seg):
-            seg.is_pass += '_HIGH_MM_rate'
+            seg.is_pass |= SEG_LOW_MAPQ
+        if high_mm_check(mm_hist_cumsum, bg_mm, seg):
+            seg.is_pass |= SEG_HIGH_MM_RATE
 
     seg_ins = [1 for seg in read if not seg.is_insertion and not seg.is_clipped]
     aligned_len = sum([seg.read_end - seg.read_start for seg in read if not seg.is_clipped]) if seg_ins else read[0].align_len
@@ -507,19 +686,23 @@ def label_reads(read, min_mapq, bg_mm, mm_hist_high, min_aligned_length, multisa
 
     if aligned_ratio < MIN_ALIGNED_RATE or aligned_len < MIN_ALIGNED_LEN:
         for seg in read:
-            seg.is_pass += '_LOW_ALIGNED_LEN'#
+            seg.is_pass |= SEG_LOW_ALIGNED_LEN
 
     for seg in read:
-        if not seg.is_pass:
-            seg.is_pass = 'PASS'
+        seg.is_pass &= ~SEG_UNLABELED
 
 def write_readqual(segments_by_read, outpath, read_qual, read_qual_len):
+    flags_count = defaultdict(int)
+    flags_len = defaultdict(int)
     for read in segments_by_read:
         for seg in read:
-            if seg.is_clipped or seg.is_insertion or 'vntr_only' in seg.is_pass:
+            if seg.is_clipped or seg.is_insertion or seg.is_pass & SEG_VNTR_ONLY:
                 continue
-            read_qual[seg.is_pass] += 1
-            read_qual_len[seg.is_pass] += seg.ref_end - seg.ref_start
+            flags_count[seg.is_pass] += 1
+            flags_len[seg.is_pass] += seg.ref_end - seg.ref_start
+    for flags, count in flags_count.items():
+        read_qual[seg_filter_name(flags)] += count
+        read_qual_len[seg_filter_name(flags)] += flags_len[flags]
 
     f = open(outpath, "w")
     f.write('Number of segments:')
@@ -571,7 +754,7 @@ def background_mm_hist(segments_by_read, mismatch_histograms, bg_mm, ref_lengths
     mm_hist_high = {}
 
     for chr_id, chr_len in ref_lengths.items():
-        mm_hist_high[chr_id] = [0 for _ in range(chr_len // COV_WINDOW_MM + 2)]
+        mm_hist_high[chr_id] = np.zeros(chr_len // COV_WINDOW_MM + 2, dtype = bool)
     
     for read in segments_by_read:
         for seg in read:
@@ -585,7 +768,7 @@ def background_mm_hist(segments_by_read, mismatch_histograms, bg_mm, ref_lengths
     for chr_id, mm_rate in mismatch_histograms.items():
         for i, mm_list in enumerate(mm_rate):
             if not mm_list or len(mm_list) < MIN_READ:
-                mm_hist_high[chr_id][i] = 0
+                mm_hist_high[chr_id][i] = False
                 continue
             mm_list.sort()
             if mm_list[-4] < bg_mm:
@@ -594,68 +777,74 @@ def background_mm_hist(segments_by_read, mismatch_histograms, bg_mm, ref_lengths
             if mm_list[med_thr - 1] < bg_mm:
                 for k, mm in enumerate(mm_list):
                         if mm > bg_mm:
-                            mm_hist_high[chr_id][i] = 1
+                            mm_hist_high[chr_id][i] = True
                             break
     return mm_hist_high
 
 
+def mm_hist_prefix_sum(mm_hist_high):
+    """
+    Prefix sums of the high mismatch windows, so that the number of
+    high mismatch windows in [i, j] is cumsum[j + 1] - cumsum[i]
+    """
+    mm_hist_cumsum = {}
+    for chr_id, mm_high_chrom in mm_hist_high.items():
+        mm_hist_cumsum[chr_id] = np.concatenate(([0], np.cumsum(mm_high_chrom, dtype = np.int64)))
+    return mm_hist_cumsum
+
+
+def _loh_runs(loh_mask, min_diff, min_loh):
+    """
+    Run-length encodes LOH windows, merging runs separated by at most min_diff bp
+    """
+    ind = np.flatnonzero(loh_mask)
+    if not len(ind):
+        return []
+    gaps = np.flatnonzero((np.diff(ind) - 1) * COV_WINDOW > min_diff)
+    starts = ind[np.concatenate(([0], gaps + 1))] * COV_WINDOW
+    ends = (ind[np.concatenate((gaps, [len(ind) - 1]))] + 1) * COV_WINDOW
+    keep = ends - starts >= min_loh
+    return list(zip(starts[keep].tolist(), ends[keep].tolist()))
+
+
 def extract_LOH(coverage_histograms, ref_lengths, control_genomes, target_genomes, write_loh_out):
     MIN_COV = 3
     MIN_DIFF = 2000
     MIN_LOH = 10000
-    LOH_dict = defaultdict(list)
     control_genome = list(control_genomes)[0]
+    write_loh_out.write("#chr_id\tstart\tend\tgenome_ids\thaplotype\t\n")
     for ref_id in ref_lengths.keys():
+        control_hp1 = np.asarray(coverage_histograms[(control_genome, 1, ref_id)])
+        control_hp2 = np.asarray(coverage_histograms[(control_genome, 2, ref_id)])
+        control_mask = ~((control_hp1 <= MIN_COV) & (control_hp2 > MIN_COV))
         for target_genome in list(target_genomes):
-            for i, (hp1, hp2) in enumerate(zip(coverage_histograms[(target_genome, 1, ref_id)], coverage_histograms[(target_genome, 2, ref_id)])):
-                if not coverage_histograms[(control_genome, 1, ref_id)][i] > MIN_COV and coverage_histograms[(control_genome, 2, ref_id)][i] > MIN_COV:
-                    continue
-                if (hp1 <= MIN_COV and hp2 > MIN_COV):
-                    LOH_dict[(target_genome, 1, ref_id)].append(i)
-                elif (hp1 > MIN_COV and hp2 <= MIN_COV) :
-                    LOH_dict[(target_genome, 2, ref_id)].append(i)
-    LOH_region = defaultdict(list)
-    for key, loh_reg in LOH_dict.items():
-        for ind in loh_reg:
-            if not LOH_region[key]:
-                LOH_region[key].append([ind * COV_WINDOW])
-                LOH_region[key].append([(ind + 1) * COV_WINDOW])
-            elif ind * COV_WINDOW - LOH_region[key][1][-1] <= MIN_DIFF:
-                LOH_region[key][1][-1]=(ind + 1) * COV_WINDOW
-            else:
-                LOH_region[key][0].append(ind * COV_WINDOW)
-                LOH_region[key][1].append((ind + 1) * COV_WINDOW)
-    
-    write_loh_out.write("#chr_id\tstart\tend\tgenome_ids\thaplotype\t\n")  
-    for key, loh_reg in LOH_region.items():
-        for (st,end) in zip(loh_reg[0], loh_reg[1]):
-            if end - st >= MIN_LOH:
-                write_loh_out.write('\t'.join([key[2], str(st), str(end), key[0], str(key[1])]) + '\n')
+            hp1 = np.asarray(coverage_histograms[(target_genome, 1, ref_id)]) > MIN_COV
+            hp2 = np.asarray(coverage_histograms[(target_genome, 2, ref_id)]) > MIN_COV
+            loh_masks = [(1, control_mask & ~hp1 & hp2), (2, control_mask & hp1 & ~hp2)]
+            loh_masks = [(hp, mask) for hp, mask in loh_masks if mask.any()]
+            loh_masks.sort(key=lambda m: m[1].argmax())
+            for hp, loh_mask in loh_masks:
+                for (st, end) in _loh_runs(loh_mask, MIN_DIFF, MIN_LOH):
+                    write_loh_out.write('\t'.join([ref_id, str(st), str(end), target_genome, str(hp)]) + '\n')
             
  
 def extract_segdups(mm_hist_high, write_segdups_out):
-    high_mm_region = defaultdict(list)
-    for key, mm_high_chrom in mm_hist_high.items():
-        for ind, a in enumerate(mm_high_chrom):
-            if a == 0:
-                continue
-            if not high_mm_region[key]:
-                high_mm_region[key].append([ind * COV_WINDOW_MM])
-                high_mm_region[key].append([(ind + 1) * COV_WINDOW_MM])
-            elif ind * COV_WINDOW_MM == high_mm_region[key][1][-1]:
-                high_mm_region[key][1][-1]=(ind + 1) * COV_WINDOW_MM
-            else:
-                high_mm_region[key][0].append(ind * COV_WINDOW_MM)
-                high_mm_region[key][1].append((ind + 1) * COV_WINDOW_MM)
-
-    for chr_id, values in high_mm_region.items():
-        for (st, end) in zip(values[0], values[1]):
+    for chr_id, mm_high_chrom in mm_hist_high.items():
+        if not mm_high_chrom.any():
+            continue
+        edges = np.diff(np.concatenate(([0], mm_high_chrom.view(np.int8), [0])))
+        starts = np.flatnonzero(edges == 1) * COV_WINDOW_MM
+        ends = np.flatnonzero(edges == -1) * COV_WINDOW_MM
+        for st, end in zip(starts.tolist(), ends.tolist()):
             write_segdups_out.write('\t'.join([chr_id, str(st), str(end)]) + '\n')
 
-def high_mm_check(mm_hist_high, bg_mm, seg):
+def high_mm_check(mm_hist_cumsum, bg_mm, seg):
+    if seg.mismatch_rate < bg_mm:
+        return False
+    cumsum = mm_hist_cumsum[seg.ref_id]
     strt = seg.ref_start_ori // COV_WINDOW_MM
-    end = min([seg.ref_end_ori // COV_WINDOW_MM , len(mm_hist_high[seg.ref_id])-1])
-    if any(mm_hist_high[seg.ref_id][strt:end+1]) and seg.mismatch_rate >= bg_mm:
+    end = min([seg.ref_end_ori // COV_WINDOW_MM , len(cumsum) - 2])
+    if strt <= end and cumsum[end + 1] > cumsum[strt]:
         return True
 
 def _calc_nx(lengths, norm_len, rate):
@@ -12,12 +12,18 @@ import pysam
 import os
 import bisect
 import logging
-import networkx as nx
 import copy
 import gzip
+import json
 
-from severus.bam_processing import _calc_nx, extract_clipped_end, get_coverage_parallel
+from severus.bam_processing import _calc_nx, extract_clipped_end, get_coverage_parallel, range_median
 from severus.resolve_vntr import read_vntr_file
+from severus.profiling import profile_stage, pool_starmap, pool_imap
+from severus.parquet_output import write_candidates_parquet
+from severus.filters import (SEG_PASS, SEG_VNTR_ONLY, SEG_UNLABELED, BP_PASS, BP_FAIL, BP_FAIL_CONN_CONS, BP_FAIL_MAP_CONS,
+                             BP_FAIL_SEC_CONS, BP_FAIL_IMPRECISE_MULTISAMPLE, BP_FAIL_IMPREC_DEL, BP_FAIL_MULTISAMPLE,
+                             BP_FAIL_LOWCOV_NORMAL, BP_FAIL_LOWCOV_OTHER, BP_FAIL_MERGED, BP_FAIL_MERGED_HP, BP_FAIL_LONG,
+                             BP_FAIL_VNTR, BP_FAIL_COMPLEX_VNTR, bp_filter_name)
 
 logger = logging.getLogger()
 
@@ -84,7 +90,7 @@ class DoubleBreak(object):
         self.supp_read_ids = supp_read_ids
         self.length = length
         self.genotype = ''
-        self.is_pass = 'PASS'
+        self.is_pass = BP_PASS
         self.ins_seq = None
         self.is_dup = None
         self.mut_type = None
@@ -211,7 +217,7 @@ def get_breakpoints(split_reads, ref_lengths, args):
         
     for read_segments in split_reads:
         read_segments.sort(key=lambda x:(x.align_start, x.read_start))
-        read_segments = [r for r in read_segments if r.is_pass == 'PASS' or r.segment_length >= args.max_segment_dist]
+        read_segments = [r for r in read_segments if r.is_pass == SEG_PASS or r.segment_length >= args.max_segment_dist]
         for s1, s2 in zip(read_segments[:-1], read_segments[1:]):
             if s2.read_start - s1.read_end < args.max_segment_dist:
                 _add_double(s1, s2)
@@ -308,7 +314,7 @@ def cluster_bp(seq, bp_pos, clust_len, min_ref_flank, ref_lengths, min_reads, bp
             unique_reads.add((x.read_id, (x.genome_id,x.haplotype)))
             read_ids.append(x.read_id)
             connections.append(rc)
-            if x.is_pass == 'PASS':
+            if x.is_pass == SEG_PASS:
                 position_arr.append(get_pos(rc, bp_dir)[1])
                 qual_arr.append(x.mapq)
             
@@ -366,14 +372,14 @@ def get_double_breaks(bp_1, bp_2, cl, sv_size, min_reads, bp_ls, multisample):
     
     conn_valid_1 = Counter(bp_ls[bp_1])
     conn_valid_2= Counter(bp_ls[bp_2])
-    conn_pass_1 = len([cn for cn in cl if cn[0].is_pass == 'PASS'])
-    conn_pass_2 = len([cn for cn in cl if cn[1].is_pass == 'PASS'])
+    conn_pass_1 = len([cn for cn in cl if cn[0].is_pass == SEG_PASS])
+    conn_pass_2 = len([cn for cn in cl if cn[1].is_pass == SEG_PASS])
     
     for x,y in cl:
         unique_reads[(x.genome_id,x.haplotype,y.haplotype)].add(x.read_id)
         if get_pos((x,y), 0)[2]== -1 and get_pos((x,y), 1)[2] == 1 and x.ref_id == y.ref_id and x.ref_start <= x.ref_start <= y.ref_end <= x.ref_end:
             is_dup = True
-        if x.is_pass == 'PASS' and y.is_pass == 'PASS':
+        if x.is_pass == SEG_PASS and y.is_pass == SEG_PASS:
             unique_reads_pass[(x.genome_id,x.haplotype,y.haplotype)].add(x.read_id)
     
     if len(cl) <= MAX_SUPP:
@@ -395,19 +401,19 @@ def get_double_breaks(bp_1, bp_2, cl, sv_size, min_reads, bp_ls, multisample):
         by_genome_id_pass[key[0]] += len(unique_reads_pass[key])
             
     if by_genome_id_pass.values():
-        is_pass = 'PASS'
+        is_pass = BP_PASS
         if max(by_genome_id_pass.values()) < min_reads:
-            is_pass = 'FAIL'
+            is_pass = BP_FAIL
             
         if conn_valid_1[2] < conn_pass_1 * CONN_2_PASS and conn_valid_2[2] < conn_pass_2 * CONN_2_PASS:
-            is_pass = 'FAIL_CONN_CONS'
+            is_pass = BP_FAIL_CONN_CONS
         
         prec = 1
         if bp_1.prec >= PREC_THR or bp_2.prec >= PREC_THR:
             prec = 0
             
         if prec == 0 and length_bp > 0 and multisample and min([len(ur) for ur in unique_reads.values()]) <= 1:
-            is_pass = 'FAIL_IMPRECISE_MULTISAMPLE'
+            is_pass = BP_FAIL_IMPRECISE_MULTISAMPLE
       
         for keys in unique_reads.keys():
             genome_id = keys[0]
@@ -470,7 +476,7 @@ def match_del(double_breaks, resolve_overlaps):
                     db0 = cl0[(db.genome_id, db.haplotype_1)]
                     db0.supp_read_ids += db.supp_read_ids
                     db0.supp = len(set(db0.supp_read_ids))
-                    db.is_pass = 'FAIL_IMPREC_DEL'
+                    db.is_pass = BP_FAIL_IMPREC_DEL
                     db0.prec = 0
                 else:
                     db.bp_1 = copy.copy(db.bp_1)
@@ -487,7 +493,7 @@ def match_del(double_breaks, resolve_overlaps):
     
     match_breakends(double_breaks)
     for cl in clusters.values():
-        if 'PASS' in [db.is_pass for db in cl]:
+        if any(db.is_pass == BP_PASS for db in cl):
             db_ls += cl
     return db_ls
  
@@ -547,10 +553,9 @@ def check_db(cl, conn_1, ind):
     db = cl[0]
     
     if db.bp_1.ref_id == db.bp_2.ref_id and db.bp_1.position > db.bp_2.position:
-        return 'FAIL_MAP_CONS'
+        return BP_FAIL_MAP_CONS
     genome_ids = list(set([db.genome_id for db in cl]))
-    conn_pass_1 =[cn for cn in conn_1 if cn[ind].is_pass == 'PASS']
-    conn_count_1 = Counter([cn[ind].is_pass for cn in conn_1])
+    conn_pass_1 =[cn for cn in conn_1 if cn[ind].is_pass == SEG_PASS]
     supp_read = sum([db.supp for db in cl])
     ind2 = db.direction_1 if ind == 0 else db.direction_2
     ind2  = 4 if ind2 == -1 else 3
@@ -559,10 +564,10 @@ def check_db(cl, conn_1, ind):
     #pr = sum([sum(db.bp_1.spanning_reads[genome_id][0:2]) if ind == 0 else sum(db.bp_2.spanning_reads[genome_id][0:2]) for genome_id in genome_ids])
     
     if max(supp_read * SEC_TO_PR,2) <= sum(sec):
-        return 'FAIL_SEC_CONS' 
+        return BP_FAIL_SEC_CONS
         
-    if conn_count_1['PASS'] < len(conn_1) * PASS_2_FAIL_RAT:
-        return 'FAIL_MAP_CONS'
+    if len(conn_pass_1) < len(conn_1) * PASS_2_FAIL_RAT:
+        return BP_FAIL_MAP_CONS
     qual_list = []
     for db in cl:
         qual_list += [db.bp_1.qual, db.bp_2.qual]
@@ -572,13 +577,13 @@ def check_db(cl, conn_1, ind):
     
     # or (sum(sec_2) >= (pr + supp_read) * SEC_TO_PR2 and vcf_qual < MIN_MAPQ2)
     if vcf_qual < MIN_MAPQ:
-        return 'FAIL_MAP_CONS'
+        return BP_FAIL_MAP_CONS
     
-    if supp_read < conn_count_1['PASS'] * CONN_2_SUPP_RAT:
-        return 'FAIL_CONN_CONS'
+    if supp_read < len(conn_pass_1) * CONN_2_SUPP_RAT:
+        return BP_FAIL_CONN_CONS
     conn_ref_1 = Counter([cn[ind].ref_id for cn in conn_pass_1])
     if len(conn_ref_1) > CHR_CONN:
-        return 'FAIL_CONN_CONS'
+        return BP_FAIL_CONN_CONS
     
 def add_single_bp(cl, dir_1,single_bps):
     db = cl[0]
@@ -600,12 +605,12 @@ def multisample_filter(clusters):
     MIN_MULT=2
     supp = []
     for cl in clusters.values():
-        if not 'PASS' in [db.is_pass for db in cl]:
+        if not any(db.is_pass == BP_PASS for db in cl):
             continue        
         supp = [1 for db in cl if db.supp < MIN_MULT]
         if supp:
             for db in cl:
-                db.is_pass = 'FAIL_MULTISAMPLE'          
+                db.is_pass = BP_FAIL_MULTISAMPLE          
                 
 def double_breaks_filter(double_breaks, single_bps, min_reads, control_id, resolve_overlaps, sv_size, multisample):
 
@@ -620,7 +625,7 @@ def double_breaks_filter(double_breaks, single_bps, min_reads, control_id, resol
             
     for cl in clusters.values():
         db = cl[0]
-        if not 'PASS' in [db.is_pass for db in cl]:
+        if not any(db.is_pass == BP_PASS for db in cl):
             continue
         
         conn_1 = db.bp_1.connections
@@ -635,10 +640,10 @@ def double_breaks_filter(double_breaks, single_bps, min_reads, control_id, resol
             add_single_bp(cl, 1, single_bps)
             
         elif fail1 and fail2:
-            if fail1 == 'FAIL_CONN_CONS' and db.bp_1.qual >= MIN_QUAL:
+            if fail1 == BP_FAIL_CONN_CONS and db.bp_1.qual >= MIN_QUAL:
                 add_single_bp(cl, 0, single_bps)
                 
-            if fail2 == 'FAIL_CONN_CONS' and db.bp_2.qual >= MIN_QUAL:
+            if fail2 == BP_FAIL_CONN_CONS and db.bp_2.qual >= MIN_QUAL:
                 add_single_bp(cl, 1, single_bps)
                 
             else:
@@ -646,7 +651,7 @@ def double_breaks_filter(double_breaks, single_bps, min_reads, control_id, resol
                     db1.is_pass = fail1
                 
         if not fail1 and not fail2:
-            conn_ins = [cn for cn in conn_1 if cn in conn_2 and cn[0].is_pass == 'PASS' and cn[1].is_pass == 'PASS']
+            conn_ins = [cn for cn in conn_1 if cn in conn_2 and cn[0].is_pass == SEG_PASS and cn[1].is_pass == SEG_PASS]
             has_ins = []
             for c in conn_ins:
                 s1,s2 = sorted(c, key=lambda x:(x.align_start, x.read_start))
@@ -676,7 +681,7 @@ def double_breaks_filter(double_breaks, single_bps, min_reads, control_id, resol
                     span_bp2 += cl[0].bp_2.spanning_reads[control_id][i]
                 if span_bp1 <= COV_THR and span_bp2 <= COV_THR:
                     for db1 in cl:
-                        db1.is_pass = 'FAIL_LOWCOV_NORMAL'
+                        db1.is_pass = BP_FAIL_LOWCOV_NORMAL
     if multisample:
         multisample_filter(clusters)
         
@@ -690,7 +695,7 @@ def resolve_ovlp(clusters):
     MIN_SIZE = 50
     for cl in clusters.values():
         db = cl[0]
-        if not db.is_pass == 'PASS' or db.is_single:
+        if not db.is_pass == BP_PASS or db.is_single:
             continue
         conn_1 = [c for c in db.bp_1.connections if c in db.bp_2.connections]
         overlap = []
@@ -720,8 +725,8 @@ def check_insseq(conn):
     LEN_TOL = 50
     
     cl = [c for c in conn if c.ins_seq]
-    pos = np.median([c.ref_end_ori for c in cl if c.is_pass == 'PASS'])
-    seg_len = np.median([c.segment_length for c in cl if c.is_pass == 'PASS'])
+    pos = np.median([c.ref_end_ori for c in cl if c.is_pass == SEG_PASS])
+    seg_len = np.median([c.segment_length for c in cl if c.is_pass == SEG_PASS])
     score = 0
     ins_seq_pos = 0
     
@@ -806,7 +811,7 @@ def extract_insertions(ins_list, clipped_clusters,ref_lengths, args):
             for x in cl:
                 unique_reads[(x.genome_id, x.haplotype)].add(x)
                 unique_reads_read[(x.genome_id, x.haplotype)].add(x.read_id)
-                if x.is_pass == 'PASS':
+                if x.is_pass == SEG_PASS:
                     unique_reads_pass[(x.genome_id, x.haplotype)].add(x)#
             by_genome_id_pass = defaultdict(int)
             for key, values in unique_reads.items():
@@ -828,12 +833,12 @@ def extract_insertions(ins_list, clipped_clusters,ref_lengths, args):
             elif np.std(s_len) / np.mean(s_len) > CV_THR:
                 prec = 0
                 
-            is_pass = 'PASS'
+            is_pass = BP_PASS
             if prec == 0 and args.multisample and min([len(ur) for ur in unique_reads.values()]) <= 2:
-                is_pass = 'FAIL_IMPRECISE_MULTISAMPLE'
+                is_pass = BP_FAIL_IMPRECISE_MULTISAMPLE
                     
             position = int(np.median(pos_list))
-            mapq = int(np.median([x.mapq for x in cl if x.is_pass == 'PASS']))
+            mapq = int(np.median([x.mapq for x in cl if x.is_pass == SEG_PASS]))
             
             if position > min_ref_flank and position < ref_lengths[seq] - min_ref_flank:
                 cl2 = add_clipped_end(ins_length, position, clipped_clusters_pos, clipped_clusters_seq, by_genome_id_pass,unique_reads_pass, unique_reads)
@@ -876,10 +881,10 @@ def insertion_filter(ins_list, min_reads, control_id):
         clusters[br.to_string()].append(br)
     
     for cl in clusters.values():
-        if not cl[0].is_pass == 'PASS':
+        if not cl[0].is_pass == BP_PASS:
             continue
         conn_1 = [cn for ins in cl for cn in ins.bp_1.connections]
-        conn_count_1 = Counter([cn.is_pass for cn in conn_1])
+        conn_pass_1 = sum(1 for cn in conn_1 if cn.is_pass == SEG_PASS)
         genome_ids = list(set([db.genome_id for db in cl]))
         db = cl[0]
         supp = sum([db.supp for db in cl])
@@ -887,17 +892,17 @@ def insertion_filter(ins_list, min_reads, control_id):
         pr = [sum(db.bp_1.spanning_reads[genome_id][0:2]) for genome_id in genome_ids]
         if sum(sec) >= (sum(pr)+supp) * SEC_TO_PR:
             for ins1 in cl:
-                ins1.is_pass = 'FAIL_SEC_CONS'
+                ins1.is_pass = BP_FAIL_SEC_CONS
             continue
               
-        if not conn_count_1['PASS']:
+        if not conn_pass_1:
             for ins1 in cl:
-                ins1.is_pass = 'FAIL_MAP_CONS'
+                ins1.is_pass = BP_FAIL_MAP_CONS
             continue
         
-        if conn_count_1['PASS'] < len(conn_1) * PASS_2_FAIL_RAT:
+        if conn_pass_1 < len(conn_1) * PASS_2_FAIL_RAT:
             for ins1 in cl:
-                ins1.is_pass = 'FAIL_MAP_CONS'
+                ins1.is_pass = BP_FAIL_MAP_CONS
             continue
         
         qual_list = []
@@ -907,7 +912,7 @@ def insertion_filter(ins_list, min_reads, control_id):
         
         if vcf_qual < MIN_MAPQ:
             for db in cl:
-                db.is_pass = 'FAIL_MAP_CONS'
+                db.is_pass = BP_FAIL_MAP_CONS
         for db in cl:
             db.vcf_qual = vcf_qual
 
@@ -921,7 +926,7 @@ def insertion_filter(ins_list, min_reads, control_id):
                     span_bp1 += cl[0].bp_1.spanning_reads[control_id][i]
                 if span_bp1 <= COV_THR:
                     for ins1 in cl:
-                        ins1.is_pass = 'FAIL_LOWCOV_NORMAL'
+                        ins1.is_pass = BP_FAIL_LOWCOV_NORMAL
     
     match_haplotypes(ins_list)
     match_small_ins(ins_list, control_id)
@@ -952,13 +957,13 @@ def match_small_ins(ins_clusters, control_id):
                 if len(kmers1.intersection(kmers2)) >= min_score:
                     to_fail = ins1 if len(ins_seq1) <= len(ins_seq2) else ins2
                     for ins in to_fail:
-                        ins.is_pass = 'FAIL_MERGED'
+                        ins.is_pass = BP_FAIL_MERGED
                     
 def get_clipped_reads(segments_by_read):
     clipped_reads = defaultdict(list)
     for read in segments_by_read:
         for seg in read:
-            if seg.is_clipped and seg.is_pass == 'PASS' or not seg.is_pass:
+            if seg.is_clipped and seg.is_pass == SEG_PASS or seg.is_pass == SEG_UNLABELED:
                 clipped_reads[seg.ref_id].append(seg)
     return clipped_reads
     
@@ -1026,8 +1031,7 @@ def get_single_bp(single_bp, clipped_clusters, double_breaks, bp_min_support, co
             if abs(posls[ind] - s_bp.position) < MIN_DIST or abs(posls[ind-1] - s_bp.position) < MIN_DIST:
                 continue
             conn = [c[0].is_pass for c in s_bp.connections] + [c[1].is_pass for c in s_bp.connections if not c[0] == c[1]]
-            conn_count = Counter(conn)
-            if conn_count['PASS'] < max([len(conn) * PASS_2_FAIL, bp_min_support]):
+            if conn.count(SEG_PASS) < max([len(conn) * PASS_2_FAIL, bp_min_support]):
                 continue
             cl = s_bp.connections
             unique_reads = defaultdict(set)
@@ -1035,9 +1039,9 @@ def get_single_bp(single_bp, clipped_clusters, double_breaks, bp_min_support, co
             if len(cl) < bp_min_support:
                 continue
             for x in cl:
-                hp = x[0].haplotype if x[0].is_pass == 'PASS' else x[1].haplotype
+                hp = x[0].haplotype if x[0].is_pass == SEG_PASS else x[1].haplotype
                 unique_reads[(x[0].genome_id,hp)].add(x[0].read_id)
-                if x[0].is_pass == 'PASS' or x[1].is_pass == 'PASS':
+                if x[0].is_pass == SEG_PASS or x[1].is_pass == SEG_PASS:
                     unique_reads_pass[(x[0].genome_id,hp)].add(x[0].read_id)
             by_genome_id_pass = defaultdict(int)
             unique_read_keys = sorted(unique_reads, key=lambda k: len(unique_reads[k]), reverse=True)
@@ -1059,7 +1063,7 @@ def get_single_bp(single_bp, clipped_clusters, double_breaks, bp_min_support, co
                         prec = 0
                     filtered_sbp.append(DoubleBreak(s_bp, s_bp.dir_1, s_bp, s_bp.dir_1,genome_id, haplotype_1, haplotype_1, supp, support_reads, length_bp))
                     filtered_sbp[-1].prec = prec
-                    filtered_sbp[-1].is_pass = 'PASS'
+                    filtered_sbp[-1].is_pass = BP_PASS
                     filtered_sbp[-1].vcf_sv_type = 'BND'
                     filtered_sbp[-1].is_single = True
                     filtered_sbp[-1].vcf_qual = s_bp.qual
@@ -1086,7 +1090,7 @@ def check_normal_cov(single_bps, control_id):
                 span_bp2 += cl[0].bp_2.spanning_reads[control_id][i]
             if span_bp1 <= COV_THR and span_bp2 <= COV_THR:
                 for db1 in cl:
-                    db1.is_pass = 'FAIL_LOWCOV_NORMAL'
+                    db1.is_pass = BP_FAIL_LOWCOV_NORMAL
 
 def filter_single_bp(single_bps, cont_id, control_vaf, vaf_thr, min_supp):
     sbp_list = []
@@ -1097,7 +1101,7 @@ def filter_single_bp(single_bps, cont_id, control_vaf, vaf_thr, min_supp):
     if cont_id:
         check_normal_cov(single_bps, cont_id)
     for sbp in single_bps:
-        if sbp.vaf_pass == 'PASS' and sbp.vcf_qual > QUAL_THR and sbp.is_pass == 'PASS':
+        if sbp.vaf_pass == 'PASS' and sbp.vcf_qual > QUAL_THR and sbp.is_pass == BP_PASS:
             sbp_list.append(sbp)
                         
     clusters = defaultdict(list) 
@@ -1127,7 +1131,7 @@ def add_clipped_end(ins_length,position, clipped_clusters_pos, clipped_clusters_
         cl.pos2.append(position)
         for x in cl.connections:
             unique_reads[(x.genome_id,x.haplotype)].add(x)
-            if x.is_pass == 'PASS':
+            if x.is_pass == SEG_PASS:
                 unique_reads_pass[(x.genome_id,x.haplotype)].add(x)
                 
                 
@@ -1192,7 +1196,7 @@ def ins_to_tra (ins_list_pos, ins_list, bp1, bp2, dir_bp, dbs, ins_clusters, dou
             db.sv_type = svtype
             
         for ins in ins_cl:
-            ins.is_pass = 'FAIL_LONG'
+            ins.is_pass = BP_FAIL_LONG
             if gen_id_1[(ins.genome_id, ins.haplotype_1)]:
                 db = gen_id_1[(ins.genome_id, ins.haplotype_1)][0]
                 n_sup = list(set(ins.supp_read_ids) - set(db.supp_read_ids))
@@ -1268,7 +1272,7 @@ def tra_to_ins(ins_list_pos, ins_list, bp1, bp2, dir_bp, dbs, ins_clusters, doub
                 
         if total_supp > total_supp_thr:
             for db in dbs:
-                db.is_pass = 'FAIL_LONG'
+                db.is_pass = BP_FAIL_LONG
             
     return flag                   
 
@@ -1311,7 +1315,7 @@ def dup_to_ins(ins_list_pos, ins_list, dbs, min_sv_size, ins_clusters, double_br
             hp_list[db.genome_id].append(db.haplotype_1)
             
         for ins in ins_cl:
-            ins.is_pass = 'FAIL_LONG'
+            ins.is_pass = BP_FAIL_LONG
             if gen_id_1[(ins.genome_id, ins.haplotype_1)]:
                 db = gen_id_1[(ins.genome_id, ins.haplotype_1)][0]
                 n_sup = list(set(ins.supp_read_ids) - set(db.supp_read_ids))
@@ -1368,9 +1372,7 @@ def add_insseq(double_breaks2, segments_by_read, bam_files, thread_pool):
                     pos_ls[(s.ref_id,s.ref_start//CHUNK_SIZE, s.genome_id)].append((s.read_id, dbls[s.read_id][2], dbls[s.read_id][1]))
                     break
     tasks = [(bam_files[key[2]], key[0], key[1], val) for key, val in pos_ls.items()]
-    parsing_results = None
-    parsing_results = thread_pool.starmap(get_insseq, tasks)
-    for res in parsing_results:
+    for res in pool_imap(thread_pool, get_insseq, tasks, ordered=False, unit='regions', count=len, item_unit='reads'):
         for read_id, ins_seq in res:
             cl = dbls[read_id][0]
             for db in cl:
@@ -1396,7 +1398,7 @@ def calc_vaf(db_list):
         DV = 0
         DR = int(np.mean([span_bp1, span_bp2])) if not db.bp_2.is_insertion else span_bp1
         for db in db1:
-            if db.is_pass == 'FAIL_MERGED_HP':
+            if db.is_pass == BP_FAIL_MERGED_HP:
                 continue
             DR1 = int(np.median([db.bp_1.spanning_reads[db.genome_id][db.haplotype_1], db.bp_2.spanning_reads[db.genome_id][db.haplotype_2]])) if not db.bp_2.is_insertion else db.bp_1.spanning_reads[db.genome_id][db.haplotype_1]
             DV1 = db.supp
@@ -1423,7 +1425,7 @@ def add_mut_type(db_list, control_id, control_vaf):
                 db.mut_type = 'germline'
         else:
             pass_list = [db.is_pass for db in db1]
-            if 'FAIL_LOWCOV_OTHER' in pass_list and not 'PASS' in pass_list:
+            if BP_FAIL_LOWCOV_OTHER in pass_list and not BP_PASS in pass_list:
                 mut_type = 'germline'
             for db in db1:
                 db.mut_type = mut_type
@@ -1431,8 +1433,8 @@ def add_mut_type(db_list, control_id, control_vaf):
 
 def calc_gentype(db_list):
     for dbb in db_list.values():
-        hp1 = [db.haplotype_1 for db in dbb if db.is_pass == 'PASS']
-        hp2 = [db.haplotype_2 for db in dbb if db.is_pass == 'PASS']
+        hp1 = [db.haplotype_1 for db in dbb if db.is_pass == BP_PASS]
+        hp2 = [db.haplotype_2 for db in dbb if db.is_pass == BP_PASS]
         if hp1 and hp2:
             gentype1 = 'hom' if (sum(hp1) == 3 or sum(hp1) == 0) and (sum(hp2) == 3 or sum(hp2) == 0) else 'het'
             
@@ -1522,7 +1524,7 @@ def filter_fail_double_db(double_breaks, single_bps, coverage_histograms, segmen
     
     db_list = []
     for db in double_breaks:
-        if db.is_pass == 'PASS' and db.vaf_pass == 'PASS' and db.vcf_qual:
+        if db.is_pass == BP_PASS and db.vaf_pass == 'PASS' and db.vcf_qual:
             db_list.append(db)
         
     cluster_db(db_list, coverage_histograms, min_sv_size)
@@ -1563,21 +1565,21 @@ def add_vntr_annot(double_breaks, args):
             for db in cl:
                 db.vntr = vntr
             if cl[0].vcf_sv_type == 'BND':
-                pass_conn = [1 for (a,b) in cl[0].bp_1.connections if not a.is_pass == b.is_pass == 'vntr_only']
+                pass_conn = [1 for (a,b) in cl[0].bp_1.connections if not a.is_pass == b.is_pass == SEG_VNTR_ONLY]
                 if len(pass_conn) < 2:
                     for db in cl:
-                        db.is_pass = 'FAIL_VNTR'
+                        db.is_pass = BP_FAIL_VNTR
             else:
-                pass_conn = [1 for a in cl[0].bp_1.connections if not a.is_pass == 'vntr_only']
+                pass_conn = [1 for a in cl[0].bp_1.connections if not a.is_pass == SEG_VNTR_ONLY]
                 if len(pass_conn) < 2:
                     for db in cl:
-                        db.is_pass = 'FAIL_VNTR'
+                        db.is_pass = BP_FAIL_VNTR
     
     for vntr_cls in vntr_clusters.values():
         if len(vntr_cls) > 3:
             for cl in vntr_cls:
                 for db in cl:
-                    db.is_pass = 'FAIL_COMPLEX_VNTR'
+                    db.is_pass = BP_FAIL_COMPLEX_VNTR
         elif len(vntr_cls) > 1:
             dbs_type = defaultdict(list)
             for cl in vntr_cls:
@@ -1618,24 +1620,89 @@ def add_vntr_annot(double_breaks, args):
                                     read_ids += db.supp_read_ids
                                 dbs[0].supp_read_ids = list(set(read_ids))
                                 for db in dbs[1:]:
-                                    db.is_pass = 'FAIL_VNTR'
+                                    db.is_pass = BP_FAIL_VNTR
     
-def get_phasingblocks(hb_vcf):
+def _contig_phasingblocks(hb_vcf, contig):
+    """
+    Phase block extents (chr, PS, first pos, last pos) of a single contig, or of the whole vcf if contig is None
+    """
+    vcf = pysam.VariantFile(hb_vcf)
+    records = vcf.fetch(contig) if contig else vcf
+    haplotype_blocks = {}
+
+    for var in records:
+        sample = var.samples.items()[0][1]
+        if 'PS' in sample.items()[-1] and sample['PS']:
+            key = (var.chrom, sample['PS'])
+            if key in haplotype_blocks:
+                haplotype_blocks[key][1] = max(haplotype_blocks[key][1], var.pos)
+            else:
+                haplotype_blocks[key] = [var.pos, var.pos]
+
+    return [(chr_id, block_name, start, end) for (chr_id, block_name), (start, end) in haplotype_blocks.items()]
+
+
+def _phasing_cache_key(hb_vcf):
+    stat = os.stat(hb_vcf)
+    return [os.path.realpath(hb_vcf), stat.st_size, stat.st_mtime]
+
+
+def _read_phasing_cache(cache_file, cache_key):
+    """
+    Cached phase blocks, None if the cache is missing, unreadable or written for another vcf
+    """
+    if not os.path.isfile(cache_file):
+        return None
+    try:
+        with open(cache_file) as f:
+            cache = json.load(f)
+        if cache['vcf'] != cache_key:
+            return None
+        return [tuple(block) for block in cache['blocks']]
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        logger.warning(f"Phase block cache could not be read: {e}")
+        return None
+
+
+def load_phasingblocks(hb_vcf, thread_pool, cache_file=None):
+    """
+    Phase block extents of the phasing vcf, extracted per contig in parallel
+    when the vcf is indexed. Blocks are reused from cache_file if it was written
+    for the same vcf.
+    """
+    cache_key = _phasing_cache_key(hb_vcf)
+    if cache_file:
+        blocks = _read_phasing_cache(cache_file, cache_key)
+        if blocks is not None:
+            return blocks
+
+    vcf = pysam.VariantFile(hb_vcf)
+    if vcf.index is not None:
+        tasks = [(hb_vcf, contig) for contig in vcf.index]
+        blocks = [block for contig_blocks in pool_starmap(thread_pool, _contig_phasingblocks, tasks) for block in contig_blocks]
+    else:
+        blocks = _contig_phasingblocks(hb_vcf, None)
+    vcf.close()
+
+    if cache_file:
+        #replaced only once fully written, a run killed while writing leaves the previous cache
+        tmp_file = cache_file + ".tmp"
+        with open(tmp_file, "w") as f:
+            json.dump({'vcf': cache_key, 'blocks': blocks}, f)
+        os.replace(tmp_file, cache_file)
+    return blocks
+
+
+def get_phasingblocks(hb_vcf, thread_pool, cache_file=None):
 #    MIN_BLOCK_LEN = 10000
 #    MIN_SNP = 10
     
-    vcf = pysam.VariantFile(hb_vcf)
-    haplotype_blocks = defaultdict(list)
     id_list = defaultdict(list)
 
-    for var in vcf:
-        if 'PS' in var.samples.items()[0][1].items()[-1] and var.samples.items()[0][1]['PS']:
-            haplotype_blocks[(var.chrom, var.samples.items()[0][1]['PS'])].append(var.pos)
-
     phased_lengths = []
-    for (chr_id, block_name), coords in haplotype_blocks.items():
-        #if max(coords) - min(coords) > MIN_BLOCK_LEN and len(coords) >= MIN_SNP:
-        phased_lengths.append(max(coords) - min(coords))
+    for (chr_id, block_name, start, end) in load_phasingblocks(hb_vcf, thread_pool, cache_file):
+        #if end - start > MIN_BLOCK_LEN and len(coords) >= MIN_SNP:
+        phased_lengths.append(end - start)
         id_list[chr_id].append(block_name)
 
     total_phased = sum(phased_lengths)
@@ -1657,11 +1724,7 @@ def add_phaseset_id(double_breaks, id_list):
 def segment_coverage(histograms, genome_id, ref_id, ref_start, ref_end, haplotype):
     hist_start = ref_start // COV_WINDOW
     hist_end = ref_end // COV_WINDOW
-    cov = [0,0,0]
-    for i in [0,1,2]:
-        cov_list = histograms[(genome_id, i, ref_id)][hist_start : hist_end + 1]
-        if cov_list:
-            cov[i] = int(np.median(cov_list))
+    cov = [range_median(histograms[(genome_id, i, ref_id)], hist_start, hist_end + 1) for i in [0,1,2]]
     return (cov[haplotype],sum(cov))
 
 def get_segments_coverage(db_segments, coverage_histograms, max_genomic_length):
@@ -1705,17 +1768,19 @@ def get_ref_adj(genomic_segments, ref_adj):
     return adj_segments
 
 
-def get_genomic_segments(double_breaks, coverage_histograms, hb_vcf, key_type, ref_lengths, min_ref_flank, max_genomic_length, min_sv_size):
-    hb_points = []
-    
-    if hb_vcf:
-        hb_points = get_phasingblocks(hb_vcf)
-    
+def annotate_svs(double_breaks, coverage_histograms, hb_points, min_sv_size):
+    """
+    Phase sets, inversion clusters, SV types and ids of all SVs, before any of the graphs is built
+    """
+    if hb_points:
+        add_phaseset_id(double_breaks, hb_points)
+    cluster_inversions(double_breaks, coverage_histograms, min_sv_size)
+    add_sv_type(double_breaks)
+
+
+def get_genomic_segments(double_breaks, coverage_histograms, hb_points, key_type, ref_lengths, min_ref_flank, max_genomic_length, min_sv_size):
     if key_type == 'germline':
-        if hb_points:
-            add_phaseset_id(double_breaks, hb_points)
-        cluster_inversions(double_breaks, coverage_histograms, min_sv_size)
-        add_sv_type(double_breaks)
+        annotate_svs(double_breaks, coverage_histograms, hb_points, min_sv_size)
         
     clusters = defaultdict(list)
     for br in double_breaks:
@@ -2070,7 +2135,7 @@ def match_haplotypes(double_breaks):
     
     clusters = defaultdict(list)
     for br in double_breaks:
-        if br.is_pass == 'PASS':
+        if br.is_pass == BP_PASS:
             clusters[br.to_string()].append(br)
             
     for cl in clusters.values():
@@ -2136,13 +2201,13 @@ def match_haplotypes(double_breaks):
                     db.haplotype_2 = hp2
                     db.haplotypes = [hp1_list, hp2_list]
                     for db in dbs[1:]:
-                        db.is_pass = 'FAIL_MERGED_HP'
+                        db.is_pass = BP_FAIL_MERGED_HP
                         
 def cluster_db(db_list, coverage_histograms, min_sv_size):
     clusters = defaultdict(list)
     for br in db_list:
         br.subgraph_id = []
-        if br.bp_1.is_insertion or not br.is_pass == 'PASS':
+        if br.bp_1.is_insertion or not br.is_pass == BP_PASS:
             continue
         clusters[br.to_string()].append(br)
     
@@ -2211,6 +2276,7 @@ def reciprocal_inv(clusters):
     
     
 def complex_inv(double_breaks, coverage_histograms, min_sv_size, ind_id):
+    import networkx as nx
 
     THR_MIN = 4
     THR_MAX = 10
@@ -2393,9 +2459,10 @@ def foldback_inv(clusters, coverage_histograms, ind_id):
                 if abs(sum(supp_pos)- sum(supp_neg)) <= min(supp_pos + supp_neg):
                     pos1 = neg_ls[0].bp_1.position// COV_WINDOW
                     pos2 = pos_ls[-1].bp_2.position//COV_WINDOW
-                    seg_cov = int(np.median([sum([coverage_histograms[(db.genome_id, db.haplotype_1, db.bp_1.ref_id)][pos] for hp in HP]) for pos in range(pos1,pos2)]))
-                    seg2 = int(np.median([sum([coverage_histograms[(db.genome_id, db.haplotype_1, db.bp_1.ref_id)][pos] for hp in HP]) for pos in range(pos2,pos2+5)]))
-                    seg1 = int(np.median([sum([coverage_histograms[(db.genome_id, db.haplotype_1, db.bp_1.ref_id)][pos] for hp in HP]) for pos in range(pos1-5,pos1)]))
+                    hist = coverage_histograms[(db.genome_id, db.haplotype_1, db.bp_1.ref_id)]
+                    seg_cov = int(len(HP) * np.median(hist[np.arange(pos1,pos2)]))
+                    seg2 = int(len(HP) * np.median(hist[np.arange(pos2,pos2+5)]))
+                    seg1 = int(len(HP) * np.median(hist[np.arange(pos1-5,pos1)]))
                     if seg_cov > max(seg1,seg2) * 1.5 and abs(seg1 - seg2) >= min(seg1,seg2)*0.75:
                         t+=1
                         for db in all_ls:
@@ -2448,6 +2515,19 @@ def indel_clust(db_list):
             components_list.append((sv_type, junction_type,'indel', 1, cl, cl[0].genome_id))
     return components_list
             
+def flank_inner_coverage(coverage_histograms, db):
+    """
+    Median coverage of the 5 windows flanking an intra-chromosomal junction and of the span between its breakpoints
+    """
+    pos1 = db.bp_1.position // COV_WINDOW
+    pos2 = db.bp_2.position // COV_WINDOW
+    hist_1 = coverage_histograms[(db.genome_id, db.haplotype_1, db.bp_1.ref_id)]
+    hist_2 = coverage_histograms[(db.genome_id, db.haplotype_2, db.bp_2.ref_id)]
+    max_pos = len(hist_2)
+    cov1 = int(np.median(np.concatenate((hist_1[max(pos1-5,0):pos1], hist_2[pos2:min(pos2+5,max_pos)]))))
+    cov3 = int(np.median(hist_1[pos1:min(pos2+1, max_pos)]))
+    return (cov1, cov3)
+
 def conn_duplications(clusters, coverage_histograms):
     
     DUP_COV_THR = 0.5
@@ -2460,13 +2540,7 @@ def conn_duplications(clusters, coverage_histograms):
             db.sv_type = 'tandem_duplication'
             continue
         if db.direction_1 == -1 and db.direction_2 == 1:
-            pos1 = db.bp_1.position // COV_WINDOW
-            pos2 = db.bp_2.position // COV_WINDOW
-            max_pos = len(coverage_histograms[(db.genome_id, db.haplotype_2, db.bp_2.ref_id)])
-            cov1 = coverage_histograms[(db.genome_id, db.haplotype_1, db.bp_1.ref_id)][max(pos1-5,0):pos1]
-            cov1 += coverage_histograms[(db.genome_id, db.haplotype_2, db.bp_2.ref_id)][pos2:min(pos2+5,max_pos)]
-            cov1 = int(np.median(cov1))
-            cov3 = int(np.median(coverage_histograms[(db.genome_id, db.haplotype_1, db.bp_1.ref_id)][pos1:min(pos2+1, max_pos)]))
+            (cov1, cov3) = flank_inner_coverage(coverage_histograms, db)
             if cov3 > cov1 + db.supp * DUP_COV_THR:
                 is_dup = True
             svtype = 'tandem_duplication' if is_dup else 'Templated_ins'
@@ -2486,13 +2560,7 @@ def conn_del(clusters, coverage_histograms):
                 for db in cl:
                     db.sv_type = 'DEL'
             else:
-                pos1 = db.bp_1.position // COV_WINDOW
-                pos2 = db.bp_2.position // COV_WINDOW
-                max_pos = len(coverage_histograms[(db.genome_id, db.haplotype_2, db.bp_2.ref_id)])
-                cov1 = coverage_histograms[(db.genome_id, db.haplotype_1, db.bp_1.ref_id)][max(pos1-5,0):pos1]
-                cov1 += coverage_histograms[(db.genome_id, db.haplotype_2, db.bp_2.ref_id)][pos2:min(pos2+5,max_pos)]
-                cov1 = int(np.median(cov1))
-                cov3 = int(np.median(coverage_histograms[(db.genome_id, db.haplotype_1, db.bp_1.ref_id)][pos1:min(pos2+1, max_pos)]))
+                (cov1, cov3) = flank_inner_coverage(coverage_histograms, db)
                 if cov3 < cov1 - db.supp * DEL_COV_THR:
                     for db in cl:
                         db.sv_type = 'DEL'
@@ -2611,10 +2679,10 @@ def output_breaks(double_breaks, genome_tags, phasing, out_stream):
         if not summary_csv[br.to_string()]:
             summary_csv[br.to_string()] = def_array[:]
             idd=(br.genome_id, br.haplotype_1)
-            summary_csv[br.to_string()][loc[idd]] = (br.is_pass, br.supp, br.bp_1.spanning_reads[br.genome_id][br.haplotype_1], br.bp_2.spanning_reads[br.genome_id][br.haplotype_2])            
+            summary_csv[br.to_string()][loc[idd]] = (bp_filter_name(br.is_pass), br.supp, br.bp_1.spanning_reads[br.genome_id][br.haplotype_1], br.bp_2.spanning_reads[br.genome_id][br.haplotype_2])            
         else:
             idd=(br.genome_id, br.haplotype_1)
-            summary_csv[br.to_string()][loc[idd]] = (br.is_pass, br.supp, br.bp_1.spanning_reads[br.genome_id][br.haplotype_1], br.bp_2.spanning_reads[br.genome_id][br.haplotype_2])
+            summary_csv[br.to_string()][loc[idd]] = (bp_filter_name(br.is_pass), br.supp, br.bp_1.spanning_reads[br.genome_id][br.haplotype_1], br.bp_2.spanning_reads[br.genome_id][br.haplotype_2])
             
     out_stream.write(header + "\n")
     for key,values in summary_csv.items():
@@ -2653,55 +2721,79 @@ def output_readids(double_breaks, genome_ids, out_stream):
         out_stream.write(line)
         out_stream.write("\n")
                             
-def call_breakpoints(segments_by_read, ref_lengths, coverage_histograms, bam_files, genome_ids, control_id, thread_pool, args):
-    
+def find_breakpoints(segments_by_read, ref_lengths, bam_files, genome_ids, control_id, thread_pool, args):
+    """
+    Detects double breakpoints, insertions and single breakpoints and computes their coverage
+    """
     if args.write_alignments:
         outpath_alignments = os.path.join(args.out_dir, "read_alignments")
         write_alignments(segments_by_read, outpath_alignments)
         
     logger.info('Extracting split alignments')
-    split_reads = get_splitreads(segments_by_read)
-    ins_list_all = get_insertionreads(segments_by_read)
+    with profile_stage('split_alignments'):
+        split_reads = get_splitreads(segments_by_read)
+        ins_list_all = get_insertionreads(segments_by_read)
     cont_id  = list(control_id)[0] if control_id else '' 
     
     logger.info('Extracting clipped reads')
-    clipped_clusters = []
-    extract_clipped_end(segments_by_read)
-    clipped_reads = get_clipped_reads(segments_by_read)
-    clipped_clusters = cluster_clipped_ends(clipped_reads, args.bp_cluster_size,args.min_ref_flank, ref_lengths)
+    with profile_stage('clipped_reads'):
+        clipped_clusters = []
+        extract_clipped_end(segments_by_read)
+        clipped_reads = get_clipped_reads(segments_by_read)
+        clipped_clusters = cluster_clipped_ends(clipped_reads, args.bp_cluster_size,args.min_ref_flank, ref_lengths)
     
     logger.info('Starting breakpoint detection')
-    double_breaks, single_bps = get_breakpoints(split_reads, ref_lengths, args)
+    with profile_stage('get_breakpoints'):
+        double_breaks, single_bps = get_breakpoints(split_reads, ref_lengths, args)
     logger.info('Clustering unmapped insertions')
-    ins_clusters = extract_insertions(ins_list_all, clipped_clusters, ref_lengths, args)
-
-    match_long_ins(ins_clusters, double_breaks, args.min_sv_size, args.tra_to_ins)
+    with profile_stage('extract_insertions'):
+        ins_clusters = extract_insertions(ins_list_all, clipped_clusters, ref_lengths, args)
+        match_long_ins(ins_clusters, double_breaks, args.min_sv_size, args.tra_to_ins)
     
     if args.single_bp:
         logger.info('Starting single breakpoint detection')
-        single_bps = get_single_bp(single_bps, clipped_clusters, double_breaks+ins_clusters, args.bp_min_support, cont_id,args.min_ref_flank, ref_lengths)
+        with profile_stage('single_bp'):
+            single_bps = get_single_bp(single_bps, clipped_clusters, double_breaks+ins_clusters, args.bp_min_support, cont_id,args.min_ref_flank, ref_lengths)
     else:
         single_bps = []
     
     logger.info('Starting compute_bp_coverage')
-    if args.vntr_file:
-        add_vntr_annot(double_breaks + ins_clusters, args)
-    get_coverage_parallel(bam_files, genome_ids, thread_pool, args.min_mapping_quality, double_breaks + ins_clusters + single_bps)
+    with profile_stage('bp_coverage'):
+        if args.vntr_file:
+            add_vntr_annot(double_breaks + ins_clusters, args)
+        get_coverage_parallel(bam_files, genome_ids, thread_pool, args.min_mapping_quality, double_breaks + ins_clusters + single_bps)
+    return double_breaks, ins_clusters, single_bps
 
-        
+
+def filter_breakpoints(double_breaks, ins_clusters, single_bps, segments_by_read, ref_lengths, coverage_histograms, bam_files, genome_ids, control_id, thread_pool, args):
+    """
+    Filters and annotates the detected breakpoints and writes breakpoints_double.csv
+    """
+    cont_id  = list(control_id)[0] if control_id else '' 
     logger.info('Filtering breakpoints')
-    double_breaks = double_breaks_filter(double_breaks, single_bps, args.bp_min_support, cont_id, args.resolve_overlaps, args.sv_size, args.multisample)
-    double_breaks.sort(key=lambda b:(b.bp_1.ref_id, b.bp_1.position, b.direction_1))
-    if args.single_bp and single_bps:
-        single_bps = filter_single_bp(single_bps, cont_id, args.control_vaf, args.vaf_thr, args.bp_min_support)
-    insertion_filter(ins_clusters, args.bp_min_support, cont_id)
-    ins_clusters.sort(key=lambda b:(b.bp_1.ref_id, b.bp_1.position))
-   
-    double_breaks +=  ins_clusters
-    annotate_mut_type(double_breaks, cont_id, args.control_vaf, args.vaf_thr, args.bp_min_support, args.pon_file, ref_lengths)
+    with profile_stage('filter_breakpoints'):
+        double_breaks = double_breaks_filter(double_breaks, single_bps, args.bp_min_support, cont_id, args.resolve_overlaps, args.sv_size, args.multisample)
+        double_breaks.sort(key=lambda b:(b.bp_1.ref_id, b.bp_1.position, b.direction_1))
+        if args.single_bp and single_bps:
+            single_bps = filter_single_bp(single_bps, cont_id, args.control_vaf, args.vaf_thr, args.bp_min_support)
+        insertion_filter(ins_clusters, args.bp_min_support, cont_id)
+        ins_clusters.sort(key=lambda b:(b.bp_1.ref_id, b.bp_1.position))
+       
+        double_breaks +=  ins_clusters
+        annotate_mut_type(double_breaks, cont_id, args.control_vaf, args.vaf_thr, args.bp_min_support, args.pon_file, ref_lengths)
 
     logger.info('Writing breakpoints')
-    output_breaks(double_breaks, genome_ids, args.phase_vcf, open(os.path.join(args.out_dir,"breakpoints_double.csv"), "w"))
+    with profile_stage('write_breakpoints'):
+        output_breaks(double_breaks, genome_ids, args.phase_vcf, open(os.path.join(args.out_dir,"breakpoints_double.csv"), "w"))
+        if args.parquet:
+            write_candidates_parquet(double_breaks, args.out_dir)
     
-    double_breaks = filter_fail_double_db(double_breaks, single_bps, coverage_histograms, segments_by_read, bam_files, thread_pool, args)
-    return double_breaks
\ No newline at end of file
+    with profile_stage('filter_fail_double_db'):
+        double_breaks = filter_fail_double_db(double_breaks, single_bps, coverage_histograms, segments_by_read, bam_files, thread_pool, args)
+    return double_breaks
+
+
+def call_breakpoints(segments_by_read, ref_lengths, coverage_histograms, bam_files, genome_ids, control_id, thread_pool, args):
+    double_breaks, ins_clusters, single_bps = find_breakpoints(segments_by_read, ref_lengths, bam_files, genome_ids, control_id, thread_pool, args)
+    return filter_breakpoints(double_breaks, ins_clusters, single_bps, segments_by_read, ref_lengths, coverage_histograms,
+                              bam_files, genome_ids, control_id, thread_pool, args)
@@ -1,15 +1,14 @@
 #!/usr/bin/env python3
 
 import os
-import networkx as nx
 from collections import defaultdict
 import logging
 import numpy as np
-import plotly
-import plotly.graph_objects as go
 
-from severus.breakpoint_finder import get_genomic_segments, cluster_indels, output_readids
+from severus.breakpoint_finder import get_genomic_segments, get_phasingblocks, cluster_indels, output_readids, annotate_svs
 from severus.vcf_output import write_to_vcf
+from severus.profiling import profile_stage, pool_imap
+from severus.parquet_output import write_calls_parquet
 
 logger = logging.getLogger()
 
@@ -17,11 +16,127 @@ logger = logging.getLogger()
 #COLORS = ["yellowgreen", "thistle", "peachpuff", "yellow", "khaki", "steelblue", "hotpink", "preu"]
 COLORS = ["#189BA0", "#830042", "#B2C971", "#8470FF", "#1B80B3", "#FF7A33", "#B35900", "#006400"]
 SEQUENCE_KEY = "__genomic"
+PLOT_COLORS = {'11':"#256676",'-1-1': "#a20655",'-11': "#4ea6dc",'1-1': "#f19724", '0-0':'#cdcc50'}
+
+
+
+class BreakpointGraph(object):
+    """
+    Compact undirected multigraph of genomic segments. Nodes are integer ids
+    allocated sequentially from 1 with attributes stored column-wise; edges are
+    kept in a list indexed by (node, node, genome_id).
+    """
+    __slots__ = ('coordinate', 'coordinate_tuple', 'insertion', 'coverage', 'hcoverage', 'haplotype', 'length',
+                 'phase_switch', 'terminal', 'loose_end', 'edge_index', 'edge_u', 'edge_v', 'edge_key', 'edge_support',
+                 'edge_type', 'edge_genotype', 'edge_dir')
+
+    def __init__(self):
+        #index 0 is a placeholder so that node ids index the columns directly
+        self.coordinate = [None]
+        self.coordinate_tuple = [None]
+        self.insertion = [None]
+        self.coverage = [None]
+        self.hcoverage = [None]
+        self.haplotype = [None]
+        self.length = [None]
+        self.phase_switch = [None]
+        self.terminal = [None]
+        self.loose_end = [None]
+        self.edge_index = {}
+        self.edge_u = []
+        self.edge_v = []
+        self.edge_key = []
+        self.edge_support = []
+        self.edge_type = []
+        self.edge_genotype = []
+        self.edge_dir = []
+
+    def nodes(self):
+        return range(1, len(self.coordinate))
+
+    def has_node(self, node):
+        return 0 < node < len(self.coordinate)
+
+    def add_node(self, node, coordinate, coordinate_tuple, insertion, coverage, hcoverage, haplotype, length):
+        if node != len(self.coordinate):
+            raise ValueError(f"Node ids must be added in order: expected {len(self.coordinate)}, got {node}")
+        self.coordinate.append(coordinate)
+        self.coordinate_tuple.append(coordinate_tuple)
+        self.insertion.append(insertion)
+        self.coverage.append(coverage)
+        self.hcoverage.append(hcoverage)
+        self.haplotype.append(haplotype)
+        self.length.append(length)
+        self.phase_switch.append(False)
+        self.terminal.append(False)
+        self.loose_end.append(False)
+
+    @staticmethod
+    def _edge_id(u, v, key):
+        return (u, v, key) if u <= v else (v, u, key)
+
+    def has_edge(self, u, v, key):
+        return self._edge_id(u, v, key) in self.edge_index
+
+    def add_edge(self, u, v, key, support, edge_type, genotype, direction):
+        self.edge_index[self._edge_id(u, v, key)] = len(self.edge_u)
+        self.edge_u.append(u)
+        self.edge_v.append(v)
+        self.edge_key.append(key)
+        self.edge_support.append(support)
+        self.edge_type.append(edge_type)
+        self.edge_genotype.append(genotype)
+        self.edge_dir.append(direction)
+
+    def add_support(self, u, v, key, support):
+        self.edge_support[self.edge_index[self._edge_id(u, v, key)]] += support
+
+    def connected_components(self):
+        """
+        Node sets of connected components (union-find over the edge list),
+        ordered by their lowest node id
+        """
+        parent = list(range(len(self.coordinate)))
+
+        def find(n):
+            while parent[n] != n:
+                parent[n] = parent[parent[n]]
+                n = parent[n]
+            return n
+
+        for u, v in zip(self.edge_u, self.edge_v):
+            root_u, root_v = find(u), find(v)
+            if root_u != root_v:
+                if root_u < root_v:
+                    parent[root_v] = root_u
+                else:
+                    parent[root_u] = root_v
+
+        components = defaultdict(list)
+        for n in self.nodes():
+            components[find(n)].append(n)
+        return [set(cc) for cc in components.values()]
+
+    def to_networkx(self):
+        """
+        networkx.MultiGraph copy with the original node and edge attribute names, e.g. for DOT export
+        """
+        import networkx as nx
+
+        g = nx.MultiGraph()
+        for n in self.nodes():
+            g.add_node(n, _coordinate=self.coordinate[n], _coordinate_tuple=self.coordinate_tuple[n], _loose_end=self.loose_end[n],
+                       _terminal=self.terminal[n], _insertion=self.insertion[n], _phase_switch=self.phase_switch[n],
+                       _coverage=self.coverage[n], _hcoverage=self.hcoverage[n], _haplotype=self.haplotype[n], _length=self.length[n])
+        for i in range(len(self.edge_u)):
+            g.add_edge(self.edge_u[i], self.edge_v[i], key=self.edge_key[i], _support=self.edge_support[i],
+                       _type=self.edge_type[i], _genotype=self.edge_genotype[i], _dir=self.edge_dir[i])
+        return g
 
                     
 def build_graph(genomic_segments,  adj_segments):
 
-    g = nx.MultiGraph()
+    g = BreakpointGraph()
     node_ids = {}
     id_to_kmers = {}
     db_to_cl = defaultdict(list)
@@ -43,40 +158,46 @@ def build_graph(genomic_segments,  adj_segments):
                 left_kmer = node_to_id(r_node.full_name(),db)
                 right_kmer = node_to_id(l_node.full_name(),db)
                 if not g.has_node(left_kmer):
-                    g.add_node(left_kmer, _coordinate=r_node.full_name(), _coordinate_tuple = (r_node.ref_id, r_node.pos1, r_node.pos2), _loose_end = False, _terminal=False, _insertion=db.bp_1.insertion_size,
-                               _phase_switch = False, _coverage = r_node.total_coverage, _hcoverage = r_node.coverage, _haplotype = [r_node.haplotype], _length = r_node.length_bp)
+                    g.add_node(left_kmer, r_node.full_name(), (r_node.ref_id, r_node.pos1, r_node.pos2), db.bp_1.insertion_size,
+                               r_node.total_coverage, r_node.coverage, [r_node.haplotype], r_node.length_bp)
                 else:
-                    g.nodes[left_kmer]['_haplotype'].append(r_node.haplotype)
+                    g.haplotype[left_kmer].append(r_node.haplotype)
                     
                 if not g.has_node(right_kmer):
-                    g.add_node(right_kmer, _coordinate=l_node.full_name(), _coordinate_tuple = (l_node.ref_id, l_node.pos1, l_node.pos2), _loose_end = False, _terminal=False, _insertion=db.bp_2.insertion_size,
-                               _phase_switch = False, _coverage = l_node.total_coverage,_hcoverage = l_node.coverage, _haplotype = [l_node.haplotype] , _length = l_node.length_bp)
+                    g.add_node(right_kmer, l_node.full_name(), (l_node.ref_id, l_node.pos1, l_node.pos2), db.bp_2.insertion_size,
+                               l_node.total_coverage, l_node.coverage, [l_node.haplotype], l_node.length_bp)
                 else:
-                    g.nodes[right_kmer]['_haplotype'].append(l_node.haplotype)
-                if not g.has_edge(left_kmer, right_kmer, key=db.genome_id):
+                    g.haplotype[right_kmer].append(l_node.haplotype)
+                if not g.has_edge(left_kmer, right_kmer, db.genome_id):
                     st1 = 'w' if db.bp_1.position in [r_node.pos1, l_node.pos1] else 'e'
                     st2 = 'w' if db.bp_2.position in [r_node.pos1, l_node.pos1] else 'e'
-                    g.add_edge(left_kmer, right_kmer, key=db.genome_id, _support=db.supp,
-                               _type="adjacency", _genotype=db.genotype, _dir = (st1, st2))
+                    g.add_edge(left_kmer, right_kmer, db.genome_id, db.supp, "adjacency", db.genotype, (st1, st2))
                 else:                                      
-                    g[left_kmer][right_kmer][db.genome_id]["_support"] += db.supp
+                    g.add_support(left_kmer, right_kmer, db.genome_id, db.supp)
                 
+    add_ref_adjacencies(g, node_ids, adj_segments)
+           
+    return g, db_to_cl, node_ids
+
+
+def add_ref_adjacencies(g, node_ids, adj_segments):
+    """
+    Adds reference adjacencies between existing segment nodes of the graph
+    """
     for (gs1,gs2) in adj_segments:
-        left_kmer = node_to_id(gs1.full_name(), '')
-        right_kmer = node_to_id(gs2.full_name(), '')
-        if g.has_node(left_kmer) and g.has_node(right_kmer):
-            if not g.has_edge(left_kmer, right_kmer, key=gs1.genome_id):
+        left_kmer = node_ids.get(gs1.full_name())
+        right_kmer = node_ids.get(gs2.full_name())
+        if left_kmer and right_kmer:
+            if not g.has_edge(left_kmer, right_kmer, gs1.genome_id):
                 st1 = ('e', 'w')
-                g.add_edge(left_kmer, right_kmer, key=gs1.genome_id, _support=0,
-                           _type="ref_adj", _genotype= '', _dir = st1)
-           
-    return g, db_to_cl
+                g.add_edge(left_kmer, right_kmer, gs1.genome_id, 0, "ref_adj", '', st1)
 
 
-def conn_shared_segments(graph, db_to_cl,genomic_segments, adj_segments):
+def conn_shared_segments(graph, db_to_cl,genomic_segments):
+    shared_adj = []
     seg_pos = defaultdict(list)
-    for n in graph.nodes:
-        pos = graph.nodes[n]['_coordinate_tuple']
+    for n in graph.nodes():
+        pos = graph.coordinate_tuple[n]
         seg_pos[(pos[0],pos[1], -1)].append(n)
         seg_pos[(pos[0],pos[2],1)].append(n)
     
@@ -109,7 +230,8 @@ def conn_shared_segments(graph, db_to_cl,genomic_segments, adj_segments):
             for db in set(pos_ls + pos_ls2):
                 gslist += [gs for gs in genomic_segments[db] if pos[1] in (gs.pos1, gs.pos2)]
             for (a,b) in zip(gslist[:-1], gslist[1:]):
-                adj_segments.append((a,b))
+                shared_adj.append((a,b))
+    return shared_adj
  
 
 def _node_to_str(node_dict):
@@ -146,6 +268,7 @@ def _coord_cmp(node_data_1, node_data_2):
     return node_data_1['_coordinate_tuple'][1] < node_data_2['_coordinate_tuple'][1]
     
 def output_clusters_graphvis(graph, connected_components, out_file):
+    graph = graph.to_networkx()
     
     def _add_legend(key_to_color, fout):
         out_stream.write("digraph cluster_01 {\n")
@@ -241,7 +364,10 @@ def output_clusters_graphvis(graph, connected_components, out_file):
         _add_legend(key_to_color, out_stream)
         _draw_components(graph, connected_components, out_stream)
 
-def output_clusters_csv(db_to_cl, connected_components, out_file):
+def assign_cluster_ids(db_to_cl, connected_components):
+    """
+    Sets the cluster ids of breakpoints outside of simple clusters and returns them by cluster
+    """
     db_list = defaultdict(list) 
     for subgr_num, (_,_,_type,_,cc,_) in enumerate(connected_components):
         if _type == 'simple':
@@ -255,7 +381,10 @@ def output_clusters_csv(db_to_cl, connected_components, out_file):
                 for db in db_to_cl[node_id]:
                     db.cluster_id = "severus_" + str(subgr_num)
                     db_list[subgr_num].append(db)
-                
+    return db_list
+
+
+def output_clusters_csv(db_list, out_file):
     with open(out_file, "w") as fout:
         fout.write("#cluster_id\tadj_1-tadj_2\tread_support\tvaf\tgenotype\tsv_type\tdet_sv_type\tdirection\tbnd\tphaseblock\tgenome_ids\n")            
         
@@ -319,19 +448,18 @@ def cluster_adjacencies(graph, db_to_cl, components_list, target_genomes, contro
     for cl in connected.values():
         for (a,b) in zip(cl[:-1],cl[1:]):
             db = db_to_cl[a][0]
-            if not graph.has_edge(a,b, key=db.genome_id):
-                graph.add_edge(a,b, key=db.genome_id, _support=0,
-                           _type="cluster_conn", _genotype=db.genotype, _dir = ('e','w'))
+            if not graph.has_edge(a,b, db.genome_id):
+                graph.add_edge(a,b, db.genome_id, 0, "cluster_conn", db.genotype, ('e','w'))
     
     rank_ls = defaultdict(int)
-    for i,cc in enumerate(nx.connected_components(graph)):
+    for i,cc in enumerate(graph.connected_components()):
         sv_type = defaultdict(int)
         chr_list = defaultdict(list)
         sv_len = defaultdict(list)
         junction_type = defaultdict(int)
         db_ls = defaultdict(list)
         for node in cc:
-            if graph.nodes[node]['_phase_switch']:
+            if graph.phase_switch[node]:
                 continue
             db_ls[db_to_cl[node][0]].append(node)
         db_ls = list(db_ls.keys())
@@ -383,113 +511,98 @@ def cluster_adjacencies(graph, db_to_cl, components_list, target_genomes, contro
     
     return components_list
 
-def html_plot(graph, adj_clusters, db_to_cl, out_dir):
-    db_keys = list(db_to_cl.keys())
+def html_plot(graph, adj_clusters, db_to_cl, out_dir, thread_pool, plots):
+    """
+    Renders one html plot per cluster on the worker pool, so the workers import
+    plotly with the first plot. Plots reference a single plotly.min.js written
+    once to the plots directory.
+    """
+    if plots == 'none':
+        return
+    from severus.plots import render_cluster_plot, plotly_js as plotly_js_source
+    plot_types = ['complex'] if plots == 'complex' else ['complex', 'simple']
+    
+    plots_dir = os.path.join(out_dir, 'plots')
+    if not os.path.isdir(plots_dir):
+        os.mkdir(plots_dir)
+    plotly_js = os.path.join(plots_dir, 'plotly.min.js')
+    if not os.path.isfile(plotly_js):
+        with open(plotly_js, "w") as fout:
+            fout.write(plotly_js_source())
+    
+    tasks = []
+    for subgr_num, (_,_,_type,_,cc,_) in enumerate(adj_clusters):
+        if not _type in plot_types:
+            continue
+        plot_data = cluster_plot_data(graph, cc, db_to_cl)
+        tasks.append((plot_data, subgr_num, os.path.join(plots_dir, 'severus_' + str(subgr_num) + ".html")))
+        
+    if tasks:
+        for _ in pool_imap(thread_pool, render_cluster_plot, tasks, ordered=False, unit='plots'):
+            pass
+
+def cluster_plot_data(graph, cc, db_to_cl):
     DODGE = 0.05
     AXIS_OFF = 500000
     k_THR = 2000
     #cov_list = [graph.nodes[n]['_coverage'] for n in graph.nodes if graph.nodes[n]['_coverage']]
     #col_segments = ['#bfd4b8', '#7fa970', '#405538']
-    for subgr_num, (_,_,_type,_,cc,_) in enumerate(adj_clusters):
-        if not _type == 'complex':
-            continue
-        
-        db_list = defaultdict(list)
-        segment_list = defaultdict(list)
-        for c in cc:
-            if c in db_keys:
-                for db in db_to_cl[c]:
-                    db_list[db].append(c)
-            if not graph.nodes[c]['_phase_switch']:
-                pos = graph.nodes[c]['_coordinate_tuple']
-                segment_list[pos[0]].append([pos[1], pos[2], c, graph.nodes[c]['_haplotype']]) 
-                
-        segment_list = dict(sorted(segment_list.items()))
-        x = []
-        y = []
-        lab_list = []
-        y_pos = defaultdict(list)
-        cols = []
-        for i,(seq, pos_list) in enumerate(segment_list.items()):
-            pos_list.sort(key=lambda b:b[1])
-            x1 = []
-            y1 = []
-            for seg in pos_list:
-                if not x1 or seg[0] > x1[-2]:
-                    y1 += [i,i,i, None]
-                else:
-                    y1 += [y1[-2] + DODGE, y1[-2] + DODGE, y1[-2] + DODGE, None]
-                for db in db_to_cl[seg[2]]:
-                    y_pos[db].append(((seg[0], seg[1]), y1[-2]))
-                x1 += [seg[0], np.mean([seg[0],seg[1]]), seg[1], None]
-                len_g = graph.nodes[seg[2]]['_length']
-                if len_g > k_THR:
-                    length_1k = len_g / 1000
-                    len_label = f"{length_1k:.1f}kb"
-                else:
-                    len_label = f"L:{len_g}bp" 
-                cov = graph.nodes[seg[2]]['_coverage']
-                
-                
-                hp = ','.join(list(set(['|'.join([str(s1[0]), str(s1[1])]) for s1 in seg[3]])))
-                lab = graph.nodes[seg[2]]['_coordinate'] + '<br>Coverage:' + str(cov) + '<br>Length:' + len_label + '<br>Haplotype:' + hp
-                lab_list += [lab, lab, lab, None]
-                
-            x += x1
-            y += y1
+    db_list = defaultdict(list)
+    segment_list = defaultdict(list)
+    for c in cc:
+        if c in db_to_cl:
+            for db in db_to_cl[c]:
+                db_list[db].append(c)
+        if not graph.phase_switch[c]:
+            pos = graph.coordinate_tuple[c]
+            segment_list[pos[0]].append([pos[1], pos[2], c, graph.haplotype[c]]) 
+            
+    segment_list = dict(sorted(segment_list.items()))
+    x = []
+    y = []
+    lab_list = []
+    y_pos = defaultdict(list)
+    for i,(seq, pos_list) in enumerate(segment_list.items()):
+        pos_list.sort(key=lambda b:b[1])
+        x1 = []
+        y1 = []
+        for seg in pos_list:
+            if not x1 or seg[0] > x1[-2]:
+                y1 += [i,i,i, None]
+            else:
+                y1 += [y1[-2] + DODGE, y1[-2] + DODGE, y1[-2] + DODGE, None]
+            for db in db_to_cl[seg[2]]:
+                y_pos[db].append(((seg[0], seg[1]), y1[-2]))
+            x1 += [seg[0], np.mean([seg[0],seg[1]]), seg[1], None]
+            len_g = graph.length[seg[2]]
+            if len_g > k_THR:
+                length_1k = len_g / 1000
+                len_label = f"{length_1k:.1f}kb"
+            else:
+                len_label = f"L:{len_g}bp" 
+            cov = graph.coverage[seg[2]]
+            
             
-        colors = {'11':"#256676",'-1-1': "#a20655",'-11': "#4ea6dc",'1-1': "#f19724", '0-0':'#cdcc50'}
-        x_nan = [xx for xx in x if xx]
-        x_limit = [min(x_nan) - AXIS_OFF, max(x_nan) + AXIS_OFF]
+            hp = ','.join(list(set(['|'.join([str(s1[0]), str(s1[1])]) for s1 in seg[3]])))
+            lab = graph.coordinate[seg[2]] + '<br>Coverage:' + str(cov) + '<br>Length:' + len_label + '<br>Haplotype:' + hp
+            lab_list += [lab, lab, lab, None]
+            
+        x += x1
+        y += y1
         
-        fig = go.Figure()
-        add_legend(fig, colors)
-        add_dbs(fig, db_list, y_pos, colors)
-        add_segments(fig, x,y, lab_list)
-        plots_layout_settings(fig, list(segment_list.keys()), x_limit, subgr_num)
-        fig.write_html(out_dir + '/plots/severus_' + str(subgr_num) + ".html")
-
-def add_legend(fig, colors):
-    fig.add_trace(go.Scatter(x=[-1], y=[1], legendgroup="HH", mode = 'lines',yaxis="y5",  
-                             line = dict(shape = 'spline', color = colors['11'], width= 7, dash = 'solid'),
-                             name="HH"))
-    fig.add_trace(go.Scatter(x=[-1], y=[1], legendgroup="TT", mode = 'lines',  yaxis="y5",
-                             line = dict(shape = 'spline', color = colors['-1-1'], width= 7, dash = 'solid'),
-                             name="TT"))
-    fig.add_trace(go.Scatter(x=[-1], y=[1], legendgroup="TH", mode = 'lines', yaxis="y5", 
-                             line = dict(shape = 'spline', color = colors['-11'], width= 7, dash = 'solid'),
-                             name="TH"))
-    fig.add_trace(go.Scatter(x=[-1], y=[1], legendgroup="HT", mode = 'lines', yaxis="y5", 
-                             line = dict(shape = 'spline', color = colors['1-1'], width= 7, dash = 'solid'),
-                             name="HT"))
-    fig.add_trace(go.Scatter(x=[-1], y=[1], legendgroup="Interchr", mode = 'lines', yaxis="y5", 
-                             line = dict(shape = 'spline', color = colors['0-0'], width= 7, dash = 'solid'),
-                             name="Interchr"))
-    
+    x_nan = [xx for xx in x if xx]
+    x_limit = [min(x_nan) - AXIS_OFF, max(x_nan) + AXIS_OFF]
+    db_traces = get_db_traces(db_list, y_pos, PLOT_COLORS)
+    return (x, y, lab_list, db_traces, list(segment_list.keys()), x_limit)
 
-def add_segments(fig, x,y, hoverdata):
-    fig.add_trace(go.Scatter(
-    x=x,
-    y=y,
-    name='Segments',
-    yaxis="y5",
-    line = dict(shape = 'spline', color = '#7fa970', width= 15, dash = 'solid'),
-    mode='lines',
-    opacity=0.9,
-    showlegend=False,
-    text=hoverdata,
-    hoverinfo="text"))
-    
-    
-def add_dbs(fig, db_list, y_pos, colors):
+def get_db_traces(db_list, y_pos, colors):
     DODGE = 0.02
-    db_ls = []
+    by_nodes = defaultdict(list)
     for db, nodes in db_list.items():
-        if db in db_ls:
-            continue
-        dbs = [db2 for db2, nodes2 in db_list.items() if nodes == nodes2]
-        db_ls += dbs
-        dbs = list(set(dbs))
+        by_nodes[tuple(nodes)].append(db)
+        
+    db_traces = []
+    for dbs in by_nodes.values():
         db = dbs[0]
         
         gen_ids = ','.join(list(set([db.genome_id for db in dbs])))
@@ -513,121 +626,67 @@ def add_dbs(fig, db_list, y_pos, colors):
         else:
             y1 = np.quantile([y0,y2], 0.75)
         y_b = [y0, y1, y2]
+        db_traces.append((x_b, y_b, lab, col))
+    return db_traces
         
-        fig.add_trace(go.Scatter(
-        x=x_b,
-        y=y_b,
-        text=[''],
-        yaxis="y5",
-        line = dict(shape = 'spline', color = col, width= 2, dash = 'solid'),
-        mode='lines',
-        opacity=0.9,
-        showlegend=False,  
-        hoverinfo="text"))
-        
-        fig.add_trace(go.Scatter(
-        x=[x_b[1]],
-        y=[y_b[1]],
-        name='db',
-        text=lab,
-        yaxis="y5",
-        marker=dict(size=8, symbol="diamond-wide", color=col),
-        mode='markers',
-        opacity=0.9,
-        showlegend=False,  
-        hoverinfo="text"))
-    
-
-def plots_layout_settings(fig, chr_list, x_limit, cluster_ind):
-    y_limit = [-1,len(chr_list)]
-    fig.update_layout(
-        xaxis=dict(
-            type="linear",
-            showline=True,
-            zeroline=True,
-            linecolor = "dimgray",
-            range=x_limit,
-            tickfont={"color": "black", 'size':15}
-            
-        ),
-        yaxis5=dict(
-            linecolor="dimgray",
-            tickmode = 'array',
-            range = y_limit,
-            tickvals = list(range(len(chr_list))),
-            ticktext = chr_list,
-            side="left",
-            tickfont={"color": "black", 'size':15},
-            ticks="outside",
-            title=dict(text="", font={"color": "dimgray"}),
-            type="linear",
-            showline=True,
-            zeroline=True,
-        ))
-    
-    fig.update_layout(
-        template="plotly_white",
-        font_family="Helvetica"
-    )
-    
-    fig.update_layout(legend=dict(
-        orientation = 'h', xanchor = "center", x = 0.45, y= 1.2))
-    
-    fig.update_layout(margin=dict(l=5, r=5, b=5, pad=1))
-    fig.update_xaxes(tick0=0.0, rangemode="nonnegative")
-    fig.update_layout(legend={'itemsizing': 'constant'})
-    fig.update_layout(font_family= "Helvetica")
-    
-    fig.update_layout(
-        title={
-            'text': 'subcluster - ' + str(cluster_ind),
-            'y':0.9,
-            'x':0.5,
-            'xanchor': 'center',
-            'yanchor': 'top'},
-
-        font_family = "Helvetica",
-        font_color = "black",
-        font_size = 15,
-        title_font_family = "Helvetica",
-        title_font_color = "black",
-        legend_font_size = 15
-    )
-    
-    if len(chr_list) < 3:
-        height = 400
-        width = 800
-    elif len(chr_list) < 7:
-        height = 600
-        width = 1200
-    else:
-        height = 800
-        width = 1200
-    
-    xlen = x_limit[1]-x_limit[0]
-    if xlen > 100000000:
-        width += 200
-    elif xlen > 150000000:
-        width +=400
-     
-    fig.update_layout(
-        width=width,
-        height=height,
-       )
-
-    
 def build_breakpoint_graph(genomic_segments, adj_segments,
                            components_list, target_genomes, control_genomes):
-    graph, db_to_cl = build_graph(genomic_segments, adj_segments)
-    conn_shared_segments(graph, db_to_cl,genomic_segments, adj_segments)
-    graph, db_to_cl = build_graph(genomic_segments, adj_segments)
+    graph, db_to_cl, node_ids = build_graph(genomic_segments, adj_segments)
+    shared_adj = conn_shared_segments(graph, db_to_cl,genomic_segments)
+    add_ref_adjacencies(graph, node_ids, shared_adj)
     adj_clusters = cluster_adjacencies(graph, db_to_cl, components_list, target_genomes, control_genomes)
     return graph, adj_clusters, db_to_cl
             
             
+def build_cluster_graph(double_breaks, coverage_histograms, hb_points, key, target_genomes, control_genomes, ref_lengths, args):
+    """
+    Genomic segments, breakpoint graph and clusters of the germline or somatic breakpoints
+    """
+    sub_fol = "all_SVs" if key == 'germline' else 'somatic_SVs'
+    logger.info("\tComputing segment coverage")
+    
+    for db in double_breaks:
+        db.cluster_id = 0
+    
+    with profile_stage(sub_fol + '/segments'):
+        (genomic_segments, adj_segments) = get_genomic_segments(double_breaks, coverage_histograms, hb_points,
+                                                                key, ref_lengths, args.min_ref_flank, args.max_genomic_len, args.min_sv_size)
+        components_list = []
+        if key == 'germline':
+            components_list = cluster_indels(double_breaks)
+    logger.info("\tPreparing graph")
+    with profile_stage(sub_fol + '/graph'):
+        graph, adj_clusters, db_to_cl = build_breakpoint_graph(genomic_segments, adj_segments, components_list, target_genomes, control_genomes)
+        clustered = assign_cluster_ids(db_to_cl, adj_clusters)
+    return graph, adj_clusters, db_to_cl, clustered
+
+
+def graph_keys(control_genomes, args):
+    """
+    Breakpoint sets with a graph and outputs: all SVs ('germline') and the somatic SVs
+    """
+    if args.outputs == 'somatic':
+        return ['somatic']
+    return ['germline', 'somatic'] if control_genomes or args.pon_file else ['germline']
+
+
 def output_graphs(db_list, coverage_histograms, thread_pool, target_genomes, control_genomes, genome_ids, ref_lengths, args):
-    keys = ['germline', 'somatic'] if control_genomes or args.pon_file else ['germline']
+    """
+    Writes the graph, cluster and vcf outputs, returns the cluster graphs by germline / somatic key
+    """
+    keys = graph_keys(control_genomes, args)
+    graphs = {}
     
+    hb_points = []
+    if args.phase_vcf:
+        logger.info("Loading phase blocks")
+        with profile_stage('phase_blocks'):
+            hb_points = get_phasingblocks(args.phase_vcf, thread_pool, os.path.join(args.out_dir, "phasing_blocks.json"))
+    if 'germline' not in keys:
+        #done in the germline pass otherwise
+        with profile_stage('annotate_svs'):
+            annotate_svs(db_list['germline'], coverage_histograms, hb_points, args.min_sv_size)
+        
     for key in keys:
         double_breaks = db_list[key]
         
@@ -636,10 +695,6 @@ def output_graphs(db_list, coverage_histograms, thread_pool, target_genomes, con
         if not os.path.isdir(out_folder):
             os.mkdir(out_folder)
             
-        out_folderhtml = os.path.join(out_folder , 'plots')
-        if not os.path.isdir(out_folderhtml):
-            os.mkdir(out_folderhtml)
-            
         all_ids = target_genomes + control_genomes if key == 'germline' else target_genomes   
             
         logger.info(f"Preparing outputs for {sub_fol}")
@@ -647,28 +702,23 @@ def output_graphs(db_list, coverage_histograms, thread_pool, target_genomes, con
         out_clustered_breakpoints = os.path.join(out_folder, "breakpoint_clusters.tsv")
         out_cluster_list = os.path.join(out_folder, "breakpoint_clusters_list.tsv")
         
-        logger.info("\tComputing segment coverage")
-        
-        for db in double_breaks:
-            db.cluster_id = 0
-        
-        (genomic_segments, adj_segments) = get_genomic_segments(double_breaks, coverage_histograms, args.phase_vcf,
-                                                                key, ref_lengths, args.min_ref_flank, args.max_genomic_len, args.min_sv_size)
-        components_list = []
-        if key == 'germline':
-            components_list = cluster_indels(double_breaks)
-            if args.output_read_ids:
-                    output_readids(double_breaks, genome_ids, open(os.path.join(args.out_dir,"read_ids.csv"), "w"))
-        logger.info("\tPreparing graph")
-        graph, adj_clusters, db_to_cl = build_breakpoint_graph(genomic_segments, adj_segments, components_list, target_genomes, control_genomes)
-        html_plot(graph, adj_clusters, db_to_cl, out_folder)
-        output_clusters_csv(db_to_cl, adj_clusters, out_clustered_breakpoints)
-        
-        output_clusters_info(adj_clusters, out_cluster_list)
-        
-        logger.info("\tWriting vcf")
-        write_to_vcf(double_breaks, all_ids, out_folder, key, ref_lengths, args.no_ins, args.multisample)
-        
+        graph, adj_clusters, db_to_cl, clustered = build_cluster_graph(double_breaks, coverage_histograms, hb_points, key,
+                                                                       target_genomes, control_genomes, ref_lengths, args)
+        graphs[key] = (graph, adj_clusters, db_to_cl, clustered)
+        if key == keys[0] and args.output_read_ids:
+            output_readids(db_list['germline'], genome_ids, open(os.path.join(args.out_dir,"read_ids.csv"), "w"))
+        with profile_stage(sub_fol + '/plots'):
+            html_plot(graph, adj_clusters, db_to_cl, out_folder, thread_pool, args.plots)
+        with profile_stage(sub_fol + '/clusters'):
+            output_clusters_csv(clustered, out_clustered_breakpoints)
             
+            output_clusters_info(adj_clusters, out_cluster_list)
         
-    
\ No newline at end of file
+        logger.info("\tWriting vcf")
+        with profile_stage(sub_fol + '/vcf'):
+            write_to_vcf(double_breaks, all_ids, out_folder, key, ref_lengths, args.no_ins, args.multisample, args.bgzip_vcf, args.vcf_index)
+
+    if args.parquet:
+        with profile_stage('parquet'):
+            write_calls_parquet(db_list, graphs, coverage_histograms, genome_ids, ref_lengths, args.out_dir)
+    return graphs
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Stage checkpoints for long runs. After each major stage the pipeline state
+is pickled and gzip-compressed into <out_dir>/checkpoints, and the
+manifest records the inputs, parameters and written stages. --resume
+restarts from the latest readable checkpoint if inputs and parameters
+still match the manifest.
+"""
+
+import os
+import json
+import gzip
+import pickle
+import logging
+
+from severus.__version__ import __version__
+
+
+logger = logging.getLogger()
+
+CHECKPOINT_STAGES = ['parsed', 'annotated', 'breakpoints', 'filtered']
+#parameters used only by the graph and vcf outputs or by the run itself
+OUTPUT_PARAMS = ['out_dir', 'threads', 'executor', 'profile', 'plots', 'bgzip_vcf', 'vcf_index', 'no_ins', 'output_read_ids',
+                 'reference_adjacencies', 'max_genomic_len', 'checkpoint', 'resume', 'scatter_shard']
+COMPRESS_LEVEL = 1
+
+
+def write_state(path, state):
+    """
+    Pickles and compresses state, replacing path only once fully written
+    """
+    tmp_file = path + ".tmp"
+    with gzip.open(tmp_file, "wb", compresslevel=COMPRESS_LEVEL) as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_file, path)
+
+
+def read_state(path):
+    with gzip.open(path, "rb") as f:
+        return pickle.load(f)
+
+
+def file_key(path):
+    st = os.stat(path)
+    return [os.path.realpath(path), st.st_size, int(st.st_mtime)]
+
+
+class StageCheckpoints(object):
+    def __init__(self, checkpoint_dir, input_files, args):
+        self.checkpoint_dir = checkpoint_dir
+        self.manifest_file = os.path.join(checkpoint_dir, "manifest.json")
+        self.inputs = [file_key(path) for path in input_files if path]
+        self.params = {k: v for k, v in sorted(vars(args).items()) if k not in OUTPUT_PARAMS and
+                       isinstance(v, (int, float, str, bool, list, type(None)))}
+        self.stages = {}
+        if not os.path.isdir(checkpoint_dir):
+            os.makedirs(checkpoint_dir)
+
+    def _write_manifest(self):
+        manifest = {'version': __version__, 'inputs': self.inputs, 'params': self.params, 'stages': self.stages}
+        tmp_file = self.manifest_file + ".tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(manifest, f, indent=1)
+        os.replace(tmp_file, self.manifest_file)
+
+    def _stage_file(self, stage):
+        return os.path.join(self.checkpoint_dir, stage + ".pkl.gz")
+
+    def save(self, stage, state):
+        """
+        Writes the state after stage and drops the checkpoints of the later stages
+        """
+        for later in CHECKPOINT_STAGES[CHECKPOINT_STAGES.index(stage):]:
+            self.stages.pop(later, None)
+            if os.path.isfile(self._stage_file(later)):
+                os.remove(self._stage_file(later))
+        self._write_manifest()
+
+        logger.info(f"Writing checkpoint: {stage}")
+        write_state(self._stage_file(stage), state)
+        self.stages[stage] = {'file': os.path.basename(self._stage_file(stage)),
+                              'bytes': os.path.getsize(self._stage_file(stage))}
+        self._write_manifest()
+
+    def load_latest(self):
+        """
+        Returns the latest valid (stage, state), or (None, None) to start from the beginning
+        """
+        if not os.path.isfile(self.manifest_file):
+            logger.info("No checkpoints found, starting from the beginning")
+            return None, None
+        with open(self.manifest_file) as f:
+            manifest = json.load(f)
+        if manifest['version'] != __version__ or manifest['inputs'] != self.inputs or manifest['params'] != self.params:
+            logger.info("Inputs or parameters changed since the checkpoints were written, starting from the beginning")
+            return None, None
+
+        self.stages = manifest['stages']
+        for stage in reversed(CHECKPOINT_STAGES):
+            if stage not in self.stages:
+                continue
+            stage_file = self._stage_file(stage)
+            if not os.path.isfile(stage_file) or os.path.getsize(stage_file) != self.stages[stage]['bytes']:
+                logger.warning(f"Checkpoint {stage} is missing or incomplete")
+                continue
+            try:
+                state = read_state(stage_file)
+            except (OSError, EOFError, pickle.UnpicklingError) as e:
+                logger.warning(f"Checkpoint {stage} could not be read: {e}")
+                continue
+            logger.info(f"Resuming after stage: {stage}")
+            return stage, state
+        logger.info("No valid checkpoints found, starting from the beginning")
+        return None, None
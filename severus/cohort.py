@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Cohort workspaces for longitudinal multi-sample runs. The parsed state of every
+bam (split read, insertion and clipped end records, coverage and mismatch
+histograms and read statistics) is stored in the workspace as a single-sample
+shard. Later runs parse only the new or changed bams and merge them with the
+stored samples before read annotation, breakpoint calling and the outputs.
+"""
+
+import os
+import json
+import logging
+
+from severus.__version__ import __version__
+from severus.checkpoint import write_state, file_key
+from severus.shards import parse_params, SHARD_VERSION
+
+
+logger = logging.getLogger()
+
+
+class CohortWorkspace(object):
+    def __init__(self, cohort_dir, ref_lengths, args):
+        self.cohort_dir = cohort_dir
+        self.manifest_file = os.path.join(cohort_dir, "cohort.json")
+        self.ref_lengths = ref_lengths
+        self.params = parse_params(args)
+        #regions as they are stored in json
+        self.regions = json.loads(json.dumps(args.regions))
+        self.samples = {}
+        if not os.path.isdir(cohort_dir):
+            os.makedirs(cohort_dir)
+
+        if os.path.isfile(self.manifest_file):
+            with open(self.manifest_file) as f:
+                manifest = json.load(f)
+            if (manifest['version'] != __version__ or manifest.get('shard_version') != SHARD_VERSION or
+                    manifest['ref_lengths'] != ref_lengths):
+                logger.info("Cohort workspace was made with a different Severus version or reference, all samples will be parsed again")
+            else:
+                self.samples = manifest['samples']
+
+    def _write_manifest(self):
+        manifest = {'version': __version__, 'shard_version': SHARD_VERSION, 'ref_lengths': self.ref_lengths, 'samples': self.samples}
+        tmp_file = self.manifest_file + ".tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(manifest, f, indent=1)
+        os.replace(tmp_file, self.manifest_file)
+
+    def sample_file(self, genome_id):
+        return os.path.join(self.cohort_dir, self.samples[genome_id]['file'])
+
+    def is_current(self, genome_id, bam_file):
+        """
+        True if the sample is stored and its bam and parsing parameters did not change
+        """
+        sample = self.samples.get(genome_id)
+        return (sample is not None and sample['bam'] == file_key(bam_file) and sample['params'] == self.params and
+                sample['regions'] == self.regions and os.path.isfile(self.sample_file(genome_id)))
+
+    def add(self, genome_id, bam_file, shard):
+        if genome_id in self.samples:
+            file_name = self.samples[genome_id]['file']
+        else:
+            used = set(sample['file'] for sample in self.samples.values())
+            file_name = next(f"sample_{i}.pkl.gz" for i in range(1, len(self.samples) + 2) if f"sample_{i}.pkl.gz" not in used)
+        logger.info(f"Storing sample {genome_id} in the cohort workspace")
+        write_state(os.path.join(self.cohort_dir, file_name), shard)
+        self.samples[genome_id] = {'file': file_name, 'bam': file_key(bam_file), 'params': self.params, 'regions': self.regions}
+        self._write_manifest()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Executors of the parallel stages (--executor). All of them have the subset of the
+multiprocessing.Pool interface used by the pipeline (starmap, imap, imap_unordered,
+close, join, terminate and the context manager):
+
+  process  a pool of worker processes; the tasks and results are pickled
+  thread   a pool of threads of the main process; nothing is copied, but only
+           the code releasing the GIL (BAM decoding in pysam / htslib) runs in parallel
+  serial   the tasks run one after another in the calling process
+"""
+
+import itertools
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+
+
+EXECUTORS = ['process', 'thread', 'serial']
+
+
+class SerialPool(object):
+    """
+    Runs pool tasks in the calling process
+    """
+    def __init__(self, processes=None, initializer=None, initargs=()):
+        if initializer is not None:
+            initializer(*initargs)
+
+    def starmap(self, func, tasks):
+        return list(itertools.starmap(func, tasks))
+
+    def imap(self, func, tasks):
+        return map(func, tasks)
+
+    imap_unordered = imap
+
+    def close(self):
+        pass
+
+    def join(self):
+        pass
+
+    def terminate(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.terminate()
+
+
+def default_executor(threads):
+    return 'serial' if threads == 1 else 'process'
+
+
+def make_pool(executor, threads, initializer=None, initargs=()):
+    """
+    Pool of the given executor with the given number of workers
+    """
+    if executor == 'serial':
+        return SerialPool(threads, initializer, initargs)
+    if executor == 'thread':
+        return ThreadPool(threads, initializer, initargs)
+    return Pool(threads, initializer, initargs)
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Filter flags of read segments and breakpoints. The filter status (is_pass) is
+an integer: 0 if all filters passed, otherwise the bits of the failed filters.
+The names are produced only when writing the outputs (read_qual.txt,
+breakpoints_double.csv, the VCF FILTER column and the tables).
+"""
+
+
+#read segments, the failed filters add up
+SEG_PASS = 0
+SEG_VNTR_ONLY = 1 << 0
+SEG_LOW_MAPQ = 1 << 1
+SEG_HIGH_MM_RATE = 1 << 2
+SEG_LOW_ALIGNED_LEN = 1 << 3
+#not labeled yet, cleared by label_reads
+SEG_UNLABELED = 1 << 4
+
+#in the order the names are joined
+SEG_FILTER_NAMES = [(SEG_VNTR_ONLY, 'vntr_only'), (SEG_LOW_MAPQ, '_LOW_MAPQ'),
+                    (SEG_HIGH_MM_RATE, '_HIGH_MM_rate'), (SEG_LOW_ALIGNED_LEN, '_LOW_ALIGNED_LEN')]
+
+#breakpoints, a failed filter replaces the previous one
+BP_PASS = 0
+BP_FAIL = 1 << 0
+BP_FAIL_CONN_CONS = 1 << 1
+BP_FAIL_MAP_CONS = 1 << 2
+BP_FAIL_SEC_CONS = 1 << 3
+BP_FAIL_IMPRECISE_MULTISAMPLE = 1 << 4
+BP_FAIL_IMPREC_DEL = 1 << 5
+BP_FAIL_MULTISAMPLE = 1 << 6
+BP_FAIL_LOWCOV_NORMAL = 1 << 7
+BP_FAIL_LOWCOV_OTHER = 1 << 8
+BP_FAIL_MERGED = 1 << 9
+BP_FAIL_MERGED_HP = 1 << 10
+BP_FAIL_LONG = 1 << 11
+BP_FAIL_VNTR = 1 << 12
+BP_FAIL_COMPLEX_VNTR = 1 << 13
+
+BP_FILTER_NAMES = [(BP_FAIL, 'FAIL'), (BP_FAIL_CONN_CONS, 'FAIL_CONN_CONS'), (BP_FAIL_MAP_CONS, 'FAIL_MAP_CONS'),
+                   (BP_FAIL_SEC_CONS, 'FAIL_SEC_CONS'), (BP_FAIL_IMPRECISE_MULTISAMPLE, 'FAIL_IMPRECISE_MULTISAMPLE'),
+                   (BP_FAIL_IMPREC_DEL, 'FAIL_IMPREC_DEL'), (BP_FAIL_MULTISAMPLE, 'FAIL_MULTISAMPLE'),
+                   (BP_FAIL_LOWCOV_NORMAL, 'FAIL_LOWCOV_NORMAL'), (BP_FAIL_LOWCOV_OTHER, 'FAIL_LOWCOV_OTHER'),
+                   (BP_FAIL_MERGED, 'FAIL_MERGED'), (BP_FAIL_MERGED_HP, 'FAIL_MERGED_HP'), (BP_FAIL_LONG, 'FAIL_LONG'),
+                   (BP_FAIL_VNTR, 'FAIL_VNTR'), (BP_FAIL_COMPLEX_VNTR, 'FAIL_COMPLEX_VNTR')]
+
+
+def seg_filter_name(flags):
+    """
+    'PASS', '' if not labeled, or the joined names of the failed filters, e.g. '_LOW_MAPQ_HIGH_MM_rate'
+    """
+    if flags == SEG_PASS:
+        return 'PASS'
+    return ''.join(name for flag, name in SEG_FILTER_NAMES if flags & flag)
+
+
+def bp_filter_name(flags):
+    if flags == BP_PASS:
+        return 'PASS'
+    return ';'.join(name for flag, name in BP_FILTER_NAMES if flags & flag)
@@ -13,14 +13,20 @@ import shutil
 import pysam
 import argparse
 import os
-from multiprocessing import Pool
 from collections import defaultdict,Counter
 import logging
 
 from severus.build_graph import output_graphs
-from severus.bam_processing import get_all_reads_parallel, init_hist, init_mm_hist, update_coverage_hist
-from severus.breakpoint_finder import call_breakpoints
+from severus.bam_processing import get_all_reads_parallel, init_hist, init_mm_hist, update_coverage_hist, read_regions, in_regions
+from severus.breakpoint_finder import find_breakpoints, filter_breakpoints
 from severus.resolve_vntr import update_segments_by_read
+from severus.profiling import profiler, profile_stage
+from severus.executor import EXECUTORS, make_pool, default_executor
+from severus.checkpoint import StageCheckpoints, CHECKPOINT_STAGES
+from severus.shards import make_shard, write_shard, gather_shards, ShardError
+from severus.cohort import CohortWorkspace
+from severus.sweep import read_sweep, run_sweep, SweepError
+from severus.parquet_output import pyarrow_available
 from severus.__version__ import __version__
 
 
@@ -49,11 +55,114 @@ def _enable_logging(log_file, debug, overwrite):
     logger.addHandler(console_log)
     logger.addHandler(file_handler)
 
+MIN_SV_THR = 10
+
+
 def _version():
     return __version__
 
 
-def main():
+def _set_defaults(args):
+    args.only_germline = False
+    if args.control_bam is None:
+        args.control_bam = []
+        args.only_germline = True
+
+    if args.bp_min_support == 0:
+        args.bp_min_support = 3
+    else:
+        args.vaf_thr = 0
+    args.sv_size = max(args.min_sv_size - MIN_SV_THR, MIN_SV_THR)
+    if args.executor is None:
+        args.executor = default_executor(args.threads)
+
+
+def _min_aligned_length(args):
+    return 7000 if not args.multisample else 5000
+
+
+def _check_inputs(args):
+    """
+    Returns the error message for invalid input files, None if they are valid
+    """
+    if not len(set(args.control_bam)) == len(args.control_bam):
+        return "Duplicated bams are not allowed"
+    if not len(set(args.target_bam)) == len(args.target_bam):
+        return "Duplicated bams are not allowed"
+    if len(set(args.control_bam)) > 1:
+        return "only one control bam is allowed"
+    if args.control_bam and args.control_bam[0] in args.target_bam:
+        return "Control bam also inputted as target bam"
+    if args.vntr_file and not (args.vntr_file.endswith('.bed') or args.vntr_file.endswith('.bed.gz')):
+        return "VNTR annotation file should be in bed or bed.gz format"
+    if args.outputs == 'somatic' and not args.control_bam and not args.pon_file:
+        return "--outputs somatic requires a control bam or --PON"
+    return None
+
+
+def _genome_ids(args):
+    """
+    Genome ids are the bam file names, or the paths if the names are not unique
+    """
+    all_bams = args.target_bam + args.control_bam
+    bam_files = defaultdict(list)
+    genome_ids = [os.path.basename(bam_file) for bam_file in all_bams]
+    dups = [item for item, count in Counter(genome_ids).items() if count > 1]
+    if dups:
+        genome_ids = all_bams
+        for bam_file in all_bams:
+            bam_files[bam_file] = bam_file
+        target_genomes = args.target_bam
+        control_genomes = args.control_bam
+    else:
+        for bam_file in all_bams:
+            genome_id = os.path.basename(bam_file)
+            bam_files[genome_id] = bam_file
+        target_genomes = [os.path.basename(bam_file) for bam_file in args.target_bam]
+        control_genomes = [os.path.basename(bam_file) for bam_file in args.control_bam]
+    return genome_ids, bam_files, target_genomes, control_genomes
+
+
+def _read_regions(args, ref_lengths):
+    """
+    Sets args.regions from --regions / --chrom, returns the error message if they are invalid
+    """
+    args.regions = None
+    if args.regions_bed or args.chroms:
+        args.regions = read_regions(args.regions_bed, args.chroms, ref_lengths)
+        unknown = [ctg for ctg in args.regions if not ctg in ref_lengths]
+        if unknown:
+            return "contigs not found in the bam header: " + ", ".join(unknown)
+        if not args.regions:
+            return "no regions to analyze"
+        logger.info(f"Restricting the analysis to {sum(len(ls) for ls in args.regions.values())} regions "
+                    f"({sum(end - start for ls in args.regions.values() for start, end in ls)} bp)")
+    return None
+
+
+def _parse_sample(bam_file, genome_id, thread_pool, ref_lengths, args):
+    """
+    Parsed state of a single bam, with its own histograms and read statistics
+    """
+    coverage_histograms = init_hist([genome_id], ref_lengths)
+    mismatch_histograms = init_mm_hist(ref_lengths)
+    n90 = [args.min_aligned_length]
+    bg_mm = []
+    read_qual = defaultdict(int)
+    read_qual_len = defaultdict(int)
+    segments_by_read = get_all_reads_parallel(bam_file, thread_pool, ref_lengths, genome_id,
+                                              coverage_histograms, mismatch_histograms, n90, bg_mm, read_qual, read_qual_len, args)
+    return segments_by_read, coverage_histograms, mismatch_histograms, n90, bg_mm, read_qual, read_qual_len
+
+
+def _save_checkpoint(checkpoints, stage, state):
+    if checkpoints is None:
+        return
+    with profile_stage('checkpoint:' + stage):
+        checkpoints.save(stage, state)
+
+
+def build_parser():
     # default tunable parameters
     MAX_READ_ERROR = 0.005
     MIN_BREAKPOINT_READS = 3
@@ -65,12 +174,8 @@ def main():
     #breakpoint
     BP_CLUSTER_SIZE = 50
     MIN_SV_SIZE = 50
-    MIN_SV_THR = 10
     VAF_THR = 0.05
     CONTROL_VAF = 0.01
-    
-
-    SAMTOOLS_BIN = "samtools"
 
     parser = argparse.ArgumentParser \
         (description="Find breakpoints and build breakpoint graph from a bam file")
@@ -87,6 +192,8 @@ def main():
                         metavar="path", help="Output directory")
     parser.add_argument("-t", "--threads", dest="threads",
                         default=8, metavar="int", type=int, help="number of parallel threads [8]")
+    parser.add_argument("--executor", dest="executor", choices=EXECUTORS, default=None,
+                        help='runs the parallel stages in worker processes, threads or serially in the main process [process, serial with -t 1]')
     parser.add_argument("--min-support", dest="bp_min_support",
                         default=0, metavar="int", type=int,
                         help=f"minimum reads supporting double breakpoint [{MIN_BREAKPOINT_READS}]")
@@ -129,58 +236,74 @@ def main():
     parser.add_argument("--use-supplementary-tag", dest='use_supplementary_tag', action = "store_true", help = 'Uses haplotype tag in supplementary alignments')
     parser.add_argument("--PON", dest='pon_file', metavar="path", help = 'Uses PON data')
     parser.add_argument("--low-quality", dest='multisample', action = "store_true", help = 'Uses set of parameters optimized for the analysis with lower quality')
-    
+    parser.add_argument("--bgzip-vcf", dest='bgzip_vcf', action = "store_true", help = 'outputs bgzip-compressed vcf files')
+    parser.add_argument("--vcf-index", dest='vcf_index', choices=['none', 'tbi', 'csi'], default='tbi', help = 'index type for bgzip-compressed vcf files [tbi]')
+    parser.add_argument("--profile", dest='profile', action = "store_true", help = 'runs cProfile in the main process and workers, outputs merged stats to severus_profile.prof')
+    parser.add_argument("--parquet", dest='parquet', action = "store_true", help = 'also writes the breakpoint, support, cluster and coverage tables in Parquet format to out-dir/parquet (requires pyarrow)')
+    parser.add_argument("--outputs", dest='outputs', choices=['all', 'somatic'], default='all', help = 'outputs to write: all SVs and somatic SVs, or somatic SVs only [all]')
+    parser.add_argument("--plots", dest='plots', choices=['none', 'complex', 'all'], default='complex', help = 'html plots to output: none, complex clusters only or all graph clusters [complex]')
+    parser.add_argument("--regions", dest='regions_bed', metavar="path", help = 'bed file with regions to restrict the analysis to [None]')
+    parser.add_argument("--chrom", dest='chroms', metavar="name", nargs="+", help = 'contigs to restrict the analysis to [None]')
+    parser.add_argument("--checkpoint", dest='checkpoint', action = "store_true", help = 'writes a checkpoint to out-dir/checkpoints after each major stage')
+    parser.add_argument("--resume", dest='resume', action = "store_true", help = 'resumes from the latest valid checkpoint if inputs and parameters did not change (implies --checkpoint)')
+    parser.add_argument("--scatter", dest='scatter_shard', metavar="path", help = 'parses the reads of --regions / --chrom only and writes them to a shard file for --gather [None]')
+    parser.add_argument("--gather", dest='gather_shards', metavar="path", nargs="+", help = 'merges shard files written with --scatter and calls SVs from them [None]')
+    parser.add_argument("--cohort-dir", dest='cohort_dir', metavar="path", help = 'workspace that keeps the parsed reads of every bam, only new or changed bams are parsed in later runs [None]')
+    parser.add_argument("--serve", dest='serve', metavar="port|path", help = 'keeps the annotated reads in memory and calls SVs on request, on a localhost port or a unix socket path [None]')
+    parser.add_argument("--sweep", dest='sweep', metavar="path", help = 'file with parameter sets (one grid of options per line), reads are parsed once and SVs are called for every set [None]')
+    return parser
+
+
+def main():
+    SAMTOOLS_BIN = "samtools"
+
+    parser = build_parser()
     args = parser.parse_args()
     
-    MIN_ALIGNED_LENGTH = 7000 if not args.multisample else 5000
+    MIN_ALIGNED_LENGTH = _min_aligned_length(args)
     
-    args.only_germline = False
-    if args.control_bam is None:
-        args.control_bam = []
-        args.only_germline = True
+    _set_defaults(args)
     all_bams = args.target_bam + args.control_bam
-    target_genomes = list(set(args.target_bam))
-    control_genomes = list(set(args.control_bam))
 
     if not os.path.isdir(args.out_dir):
         os.makedirs(args.out_dir)
         
     log_file = os.path.join(args.out_dir, "severus.log")
-    _enable_logging(log_file, debug=False, overwrite=True)
+    _enable_logging(log_file, debug=False, overwrite=not args.resume)
 
     logger.info("Starting Severus " + _version())
     logger.debug("Cmd: %s", " ".join(sys.argv))
     logger.debug("Python version: " + sys.version)
     
-    args.sv_size = max(args.min_sv_size - MIN_SV_THR, MIN_SV_THR)
-    
     if not shutil.which(SAMTOOLS_BIN):
         logger.error("Error: samtools not found")
         return 1
-    if not len(set(args.control_bam)) == len(args.control_bam):
-        logger.error("Error: Duplicated bams are not allowed")
+    input_error = _check_inputs(args)
+    if input_error:
+        logger.error("Error: " + input_error)
         return 1
-    
-    if not len(set(args.target_bam)) == len(args.target_bam):
-        logger.error("Error: Duplicated bams are not allowed")
+    if args.parquet and not pyarrow_available():
+        logger.error("Error: --parquet requires the pyarrow package")
         return 1
         
-    if len(control_genomes) > 1:
-        logger.error("Error: only one control bam is allowed")
-        return 1
-    
-    if control_genomes and control_genomes[0] in target_genomes:
-        logger.error("Error: Control bam also inputted as target bam")
+    if sum(bool(x) for x in [args.scatter_shard, args.gather_shards, args.cohort_dir]) > 1:
+        logger.error("Error: only one of --scatter, --gather and --cohort-dir can be used")
         return 1
-        
-    if args.vntr_file and not (args.vntr_file.endswith('.bed') or args.vntr_file.endswith('.bed.gz')):
-        logger.error("Error: VNTR annotation file should be in bed or bed.gz format")
+
+    if args.serve and (args.scatter_shard or args.sweep):
+        logger.error("Error: --serve can not be used with --scatter or --sweep")
         return 1
-        
-    if args.bp_min_support == 0:
-        args.bp_min_support = 3
-    else:
-        args.vaf_thr = 0
+
+    sweep_sets = None
+    if args.sweep:
+        if args.scatter_shard:
+            logger.error("Error: --sweep can not be used with --scatter")
+            return 1
+        try:
+            sweep_sets = read_sweep(args.sweep, parser, sys.argv[1:], args, _set_defaults)
+        except SweepError as e:
+            logger.error(f"Error: {e}")
+            return 1
 
     #TODO: check that all bams have the same reference
     first_bam = all_bams[0]
@@ -188,57 +311,138 @@ def main():
     with pysam.AlignmentFile(first_bam, "rb") as a:
         ref_lengths = dict(zip(a.references, a.lengths))
 
-    thread_pool = Pool(args.threads)
+    regions_error = _read_regions(args, ref_lengths)
+    if regions_error:
+        logger.error("Error: " + regions_error)
+        return 1
+
+    checkpoints = None
+    stage, state = None, None
+    if args.checkpoint or args.resume:
+        checkpoints = StageCheckpoints(os.path.join(args.out_dir, "checkpoints"),
+                                       all_bams + [args.phase_vcf, args.vntr_file, args.pon_file, args.regions_bed] +
+                                       (args.gather_shards or []), args)
+        if args.resume:
+            stage, state = checkpoints.load_latest()
+    completed = CHECKPOINT_STAGES.index(stage) + 1 if stage else 0
+
+    #before the profiler, so that forked workers do not inherit it
+    thread_pool = make_pool(args.executor, args.threads)
+    if args.profile:
+        profiler.enable_cprofile()
     
+    #written before the 'annotated' checkpoint, kept from the previous run when resuming after it
     args.write_segdups_out =''
-    if args.write_segdup:
+    if args.write_segdup and completed < 2 and not args.scatter_shard:
         args.write_segdups_out = open(os.path.join(args.out_dir,"severus_collaped_dup.bed"), "w")
         
     args.write_log_out = ''
-    if args.output_loh:
+    if args.output_loh and completed < 2 and not args.scatter_shard:
         args.write_log_out = open(os.path.join(args.out_dir,"severus_LOH.bed"), "w")
         
     args.outpath_readqual = os.path.join(args.out_dir, "read_qual.txt")
     
     segments_by_read = []
-    bam_files = defaultdict(list)
-    genome_ids = [os.path.basename(bam_file) for bam_file in all_bams]
-    
-    dups = [item for item, count in Counter(genome_ids).items() if count > 1]
-    if dups:
-        genome_ids = all_bams
-        for bam_file in all_bams:
-            bam_files[bam_file] = bam_file
-        target_genomes = args.target_bam
-        control_genomes = args.control_bam
+    genome_ids, bam_files, target_genomes, control_genomes = _genome_ids(args)
+
+    if completed < 1:
+        args.min_aligned_length = MIN_ALIGNED_LENGTH
+        coverage_histograms = init_hist(genome_ids, ref_lengths)
+        mismatch_histograms = init_mm_hist(ref_lengths)
+        n90 = [MIN_ALIGNED_LENGTH]
+        read_qual = defaultdict(int)
+        read_qual_len = defaultdict(int)
+        bg_mm = []
+        if args.cohort_dir:
+            cohort = CohortWorkspace(args.cohort_dir, ref_lengths, args)
+            for bam_file, genome_id in zip(all_bams, genome_ids):
+                if cohort.is_current(genome_id, bam_file):
+                    logger.info(f"Using stored reads of {genome_id}")
+                    continue
+                logger.info(f"Parsing reads from {genome_id}")
+                with profile_stage('parse_reads:' + genome_id):
+                    parsed = _parse_sample(bam_file, genome_id, thread_pool, ref_lengths, args)
+                with profile_stage('store_sample:' + genome_id):
+                    cohort.add(genome_id, bam_file, make_shard(ref_lengths, [genome_id], parsed, args))
+                parsed = None
+            args.gather_shards = [cohort.sample_file(genome_id) for genome_id in genome_ids]
+
+        if args.gather_shards:
+            try:
+                with profile_stage('gather_shards'):
+                    segments_by_read, coverage_histograms, mismatch_histograms, n90, bg_mm, read_qual, read_qual_len = \
+                            gather_shards(args.gather_shards, ref_lengths, genome_ids, coverage_histograms, mismatch_histograms, args)
+            except ShardError as e:
+                logger.error(f"Error: {e}")
+                return 1
+        else:
+            for bam_file, genome_id in zip(all_bams, genome_ids):
+                logger.info(f"Parsing reads from {genome_id}")
+                with profile_stage('parse_reads:' + genome_id):
+                    segments_by_read_bam = get_all_reads_parallel(bam_file, thread_pool, ref_lengths, genome_id,
+                                                                  coverage_histograms, mismatch_histograms, n90, bg_mm,read_qual,read_qual_len,args)
+                segments_by_read += segments_by_read_bam
+        if args.scatter_shard:
+            with profile_stage('write_shard'):
+                write_shard(args.scatter_shard, ref_lengths, genome_ids,
+                            (segments_by_read, coverage_histograms, mismatch_histograms, n90, bg_mm, read_qual, read_qual_len), args)
+            profiler.write_report(args.out_dir, args.threads)
+            return 0
+        _save_checkpoint(checkpoints, 'parsed', (segments_by_read, coverage_histograms, mismatch_histograms, n90, bg_mm, read_qual, read_qual_len))
+    elif completed == 1:
+        segments_by_read, coverage_histograms, mismatch_histograms, n90, bg_mm, read_qual, read_qual_len = state
+
+    if completed < 2:
+        args.min_aligned_length = min(n90) if not args.multisample else MIN_ALIGNED_LENGTH
+        logger.info('Computing read quality') 
+        with profile_stage('update_segments_by_read'):
+            update_segments_by_read(segments_by_read, mismatch_histograms, bg_mm, ref_lengths,read_qual,read_qual_len, args)
+        
+        logger.info('Computing coverage histogram')
+        with profile_stage('update_coverage_hist'):
+            update_coverage_hist(coverage_histograms,genome_ids, ref_lengths, segments_by_read, control_genomes, target_genomes, args.write_log_out)
+        _save_checkpoint(checkpoints, 'annotated', (segments_by_read, coverage_histograms))
+    elif completed == 2:
+        segments_by_read, coverage_histograms = state
+
+    if args.serve:
+        from severus.server import SeverusServer, serve
+        state = None
+        severus_server = SeverusServer(segments_by_read, coverage_histograms, ref_lengths, bam_files, genome_ids,
+                                       target_genomes, control_genomes, thread_pool, parser, sys.argv[1:], _set_defaults, args)
+        serve(severus_server, args.serve)
+        profiler.write_report(args.out_dir, args.threads)
+        return 0
+
+    if sweep_sets:
+        state = None
+        run_sweep(sweep_sets, segments_by_read, coverage_histograms, ref_lengths, bam_files, genome_ids,
+                  target_genomes, control_genomes, thread_pool, args)
+        profiler.write_report(args.out_dir, args.threads)
+        return 0
+
+    if completed < 3:
+        with profile_stage('call_breakpoints'):
+            double_breaks, ins_clusters, single_bps = find_breakpoints(segments_by_read, ref_lengths, bam_files, genome_ids, control_genomes, thread_pool, args)
+        _save_checkpoint(checkpoints, 'breakpoints', (segments_by_read, coverage_histograms, double_breaks, ins_clusters, single_bps))
+    elif completed == 3:
+        segments_by_read, coverage_histograms, double_breaks, ins_clusters, single_bps = state
+
+    if completed < 4:
+        with profile_stage('filter_calls'):
+            double_breaks = filter_breakpoints(double_breaks, ins_clusters, single_bps, segments_by_read, ref_lengths, coverage_histograms,
+                                               bam_files, genome_ids, control_genomes, thread_pool, args)
+        _save_checkpoint(checkpoints, 'filtered', (double_breaks, coverage_histograms))
     else:
-        for bam_file in all_bams:
-            genome_id = os.path.basename(bam_file)
-            bam_files[genome_id] = bam_file
-        target_genomes = [os.path.basename(bam_file) for bam_file in args.target_bam]
-        control_genomes = [os.path.basename(bam_file) for bam_file in args.control_bam]
+        double_breaks, coverage_histograms = state
+    state = None
 
-    args.min_aligned_length = MIN_ALIGNED_LENGTH
-    coverage_histograms = init_hist(genome_ids, ref_lengths)
-    mismatch_histograms = init_mm_hist(ref_lengths)
-    n90 = [MIN_ALIGNED_LENGTH]
-    read_qual = defaultdict(int)
-    read_qual_len = defaultdict(int)
-    bg_mm = []
-    for bam_file in all_bams:
-        genome_id = os.path.basename(bam_file) if not dups else bam_file
-        logger.info(f"Parsing reads from {genome_id}")
-        segments_by_read_bam = get_all_reads_parallel(bam_file, thread_pool, ref_lengths, genome_id,
-                                                      coverage_histograms, mismatch_histograms, n90, bg_mm,read_qual,read_qual_len,args)
-        segments_by_read += segments_by_read_bam
-
-    args.min_aligned_length = min(n90) if not args.multisample else MIN_ALIGNED_LENGTH
-    logger.info('Computing read quality') 
-    update_segments_by_read(segments_by_read, mismatch_histograms, bg_mm, ref_lengths,read_qual,read_qual_len, args)
+    if args.regions is not None:
+        for key, db_list in double_breaks.items():
+            double_breaks[key] = [db for db in db_list if in_regions(args.regions, db.bp_1.ref_id, db.bp_1.position) or
+                                  in_regions(args.regions, db.bp_2.ref_id, db.bp_2.position)]
     
-    logger.info('Computing coverage histogram')
-    update_coverage_hist(coverage_histograms,genome_ids, ref_lengths, segments_by_read, control_genomes, target_genomes, args.write_log_out)
-
-    double_breaks = call_breakpoints(segments_by_read, ref_lengths, coverage_histograms, bam_files, genome_ids, control_genomes, thread_pool, args)
+    with profile_stage('output_graphs'):
+        output_graphs(double_breaks, coverage_histograms, thread_pool, target_genomes, control_genomes, genome_ids, ref_lengths, args)
     
-    output_graphs(double_breaks, coverage_histograms, thread_pool, target_genomes, control_genomes, genome_ids, ref_lengths, args)
+    profiler.write_report(args.out_dir, args.threads)
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Parquet output (requires pyarrow). Tables with typed columns are written to
+<out_dir>/parquet in row groups as they are produced:
+
+  candidates.parquet   all detected breakpoints with support and spanning reads by genome and haplotype
+  breakpoints.parquet  one row per SV
+  support.parquet      one row per SV, genome and haplotype, with the supporting read ids
+  clusters.parquet     breakpoint graph cluster membership of the SVs
+  coverage.parquet     read depth by genome, haplotype and coverage window
+"""
+
+import os
+import logging
+import importlib.util
+
+from severus.tables import breakpoint_tables, candidate_table, coverage_chunks, LIST_COLUMNS
+
+
+logger = logging.getLogger()
+
+ROW_GROUP_SIZE = 1000000
+
+
+def pyarrow_available():
+    return importlib.util.find_spec("pyarrow") is not None
+
+
+def _arrow_type(name, column):
+    import pyarrow as pa
+    if name in LIST_COLUMNS:
+        return pa.list_(pa.string())
+    if column.dtype.kind == 'U':
+        return pa.string()
+    return pa.from_numpy_dtype(column.dtype)
+
+
+def _record_batch(columns, schema):
+    import pyarrow as pa
+    return pa.RecordBatch.from_arrays([pa.array(list(col) if name in LIST_COLUMNS else col, type=schema.field(name).type)
+                                       for name, col in columns.items()], schema=schema)
+
+
+def write_parquet(out_file, chunks):
+    """
+    Writes tables (dicts of column name to numpy array) with the same columns to one Parquet file,
+    in row groups of up to ROW_GROUP_SIZE rows
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    writer = None
+    buffered = []
+    n_buffered = 0
+    try:
+        for chunk in chunks:
+            if writer is None:
+                schema = pa.schema([(name, _arrow_type(name, col)) for name, col in chunk.items()])
+                writer = pq.ParquetWriter(out_file, schema)
+            buffered.append(_record_batch(chunk, schema))
+            n_buffered += len(next(iter(chunk.values())))
+            if n_buffered >= ROW_GROUP_SIZE:
+                writer.write_table(pa.Table.from_batches(buffered), row_group_size=ROW_GROUP_SIZE)
+                buffered, n_buffered = [], 0
+        if writer is not None and buffered:
+            writer.write_table(pa.Table.from_batches(buffered), row_group_size=ROW_GROUP_SIZE)
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def _parquet_dir(out_dir):
+    parquet_dir = os.path.join(out_dir, "parquet")
+    if not os.path.isdir(parquet_dir):
+        os.makedirs(parquet_dir)
+    return parquet_dir
+
+
+def write_candidates_parquet(double_breaks, out_dir):
+    write_parquet(os.path.join(_parquet_dir(out_dir), "candidates.parquet"), [candidate_table(double_breaks)])
+
+
+def write_calls_parquet(double_breaks, graphs, coverage_histograms, genome_ids, ref_lengths, out_dir):
+    logger.info("\tWriting parquet tables")
+    parquet_dir = _parquet_dir(out_dir)
+    breakpoints, support, clusters = breakpoint_tables(double_breaks, graphs)
+    for name, table in [("breakpoints", breakpoints), ("support", support), ("clusters", clusters)]:
+        write_parquet(os.path.join(parquet_dir, name + ".parquet"), [table])
+    write_parquet(os.path.join(parquet_dir, "coverage.parquet"), coverage_chunks(coverage_histograms, genome_ids, ref_lengths))
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Rendering of the html cluster plots with plotly. Imported only by the stages
+that write plots, so that plotly is not loaded at startup or in the workers
+of the other stages.
+"""
+
+import plotly
+import plotly.graph_objects as go
+
+from severus.build_graph import PLOT_COLORS
+
+
+def plotly_js():
+    return plotly.offline.get_plotlyjs()
+
+
+def render_cluster_plot(plot_data, subgr_num, out_file):
+    (x, y, lab_list, db_traces, chr_list, x_limit) = plot_data
+    fig = go.Figure()
+    add_legend(fig, PLOT_COLORS)
+    add_dbs(fig, db_traces)
+    add_segments(fig, x,y, lab_list)
+    plots_layout_settings(fig, chr_list, x_limit, subgr_num)
+    fig.write_html(out_file, include_plotlyjs='directory')
+
+def add_legend(fig, colors):
+    fig.add_trace(go.Scatter(x=[-1], y=[1], legendgroup="HH", mode = 'lines',yaxis="y5",  
+                             line = dict(shape = 'spline', color = colors['11'], width= 7, dash = 'solid'),
+                             name="HH"))
+    fig.add_trace(go.Scatter(x=[-1], y=[1], legendgroup="TT", mode = 'lines',  yaxis="y5",
+                             line = dict(shape = 'spline', color = colors['-1-1'], width= 7, dash = 'solid'),
+                             name="TT"))
+    fig.add_trace(go.Scatter(x=[-1], y=[1], legendgroup="TH", mode = 'lines', yaxis="y5", 
+                             line = dict(shape = 'spline', color = colors['-11'], width= 7, dash = 'solid'),
+                             name="TH"))
+    fig.add_trace(go.Scatter(x=[-1], y=[1], legendgroup="HT", mode = 'lines', yaxis="y5", 
+                             line = dict(shape = 'spline', color = colors['1-1'], width= 7, dash = 'solid'),
+                             name="HT"))
+    fig.add_trace(go.Scatter(x=[-1], y=[1], legendgroup="Interchr", mode = 'lines', yaxis="y5", 
+                             line = dict(shape = 'spline', color = colors['0-0'], width= 7, dash = 'solid'),
+                             name="Interchr"))
+    
+
+def add_segments(fig, x,y, hoverdata):
+    fig.add_trace(go.Scatter(
+    x=x,
+    y=y,
+    name='Segments',
+    yaxis="y5",
+    line = dict(shape = 'spline', color = '#7fa970', width= 15, dash = 'solid'),
+    mode='lines',
+    opacity=0.9,
+    showlegend=False,
+    text=hoverdata,
+    hoverinfo="text"))
+
+
+def add_dbs(fig, db_traces):
+    for (x_b, y_b, lab, col) in db_traces:
+        fig.add_trace(go.Scatter(
+        x=x_b,
+        y=y_b,
+        text=[''],
+        yaxis="y5",
+        line = dict(shape = 'spline', color = col, width= 2, dash = 'solid'),
+        mode='lines',
+        opacity=0.9,
+        showlegend=False,  
+        hoverinfo="text"))
+        
+        fig.add_trace(go.Scatter(
+        x=[x_b[1]],
+        y=[y_b[1]],
+        name='db',
+        text=lab,
+        yaxis="y5",
+        marker=dict(size=8, symbol="diamond-wide", color=col),
+        mode='markers',
+        opacity=0.9,
+        showlegend=False,  
+        hoverinfo="text"))
+    
+
+def plots_layout_settings(fig, chr_list, x_limit, cluster_ind):
+    y_limit = [-1,len(chr_list)]
+    fig.update_layout(
+        xaxis=dict(
+            type="linear",
+            showline=True,
+            zeroline=True,
+            linecolor = "dimgray",
+            range=x_limit,
+            tickfont={"color": "black", 'size':15}
+            
+        ),
+        yaxis5=dict(
+            linecolor="dimgray",
+            tickmode = 'array',
+            range = y_limit,
+            tickvals = list(range(len(chr_list))),
+            ticktext = chr_list,
+            side="left",
+            tickfont={"color": "black", 'size':15},
+            ticks="outside",
+            title=dict(text="", font={"color": "dimgray"}),
+            type="linear",
+            showline=True,
+            zeroline=True,
+        ))
+    
+    fig.update_layout(
+        template="plotly_white",
+        font_family="Helvetica"
+    )
+    
+    fig.update_layout(legend=dict(
+        orientation = 'h', xanchor = "center", x = 0.45, y= 1.2))
+    
+    fig.update_layout(margin=dict(l=5, r=5, b=5, pad=1))
+    fig.update_xaxes(tick0=0.0, rangemode="nonnegative")
+    fig.update_layout(legend={'itemsizing': 'constant'})
+    fig.update_layout(font_family= "Helvetica")
+    
+    fig.update_layout(
+        title={
+            'text': 'subcluster - ' + str(cluster_ind),
+            'y':0.9,
+            'x':0.5,
+            'xanchor': 'center',
+            'yanchor': 'top'},
+
+        font_family = "Helvetica",
+        font_color = "black",
+        font_size = 15,
+        title_font_family = "Helvetica",
+        title_font_color = "black",
+        legend_font_size = 15
+    )
+    
+    if len(chr_list) < 3:
+        height = 400
+        width = 800
+    elif len(chr_list) < 7:
+        height = 600
+        width = 1200
+    else:
+        height = 800
+        width = 1200
+    
+    xlen = x_limit[1]-x_limit[0]
+    if xlen > 100000000:
+        width += 200
+    elif xlen > 150000000:
+        width +=400
+     
+    fig.update_layout(
+        width=width,
+        height=height,
+       )
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Per-stage resource report: wall and CPU time, peak RSS and worker task
+timings for each pipeline stage, written to severus_profile.json.
+With --profile, cProfile also runs in the main process and inside every
+worker task, and the merged stats are written to severus_profile.prof.
+"""
+
+import os
+import sys
+import time
+import json
+import logging
+import resource
+import threading
+import cProfile
+import pstats
+from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
+from collections import defaultdict
+
+import numpy as np
+
+from severus.executor import SerialPool
+
+
+logger = logging.getLogger()
+
+#seconds between the progress messages of a pool call
+PROGRESS_INTERVAL = 30
+
+
+class _ProfileStats(object):
+    """
+    Picklable cProfile stats of a single worker task, accepted by pstats.Stats
+    """
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+class StageRecord(object):
+    __slots__ = ('name', 'depth', 'wall', 'cpu', 'peak_rss', 'task_wall', 'task_cpu', 'worker_wall', 'worker_tasks', 'worker_peak_rss')
+    def __init__(self, name, depth):
+        self.name = name
+        self.depth = depth
+        self.wall = 0
+        self.cpu = 0
+        self.peak_rss = 0
+        self.task_wall = []
+        self.task_cpu = []
+        self.worker_wall = defaultdict(float)
+        self.worker_tasks = defaultdict(int)
+        self.worker_peak_rss = 0
+
+    def to_dict(self):
+        stage = {'name': self.name, 'depth': self.depth, 'wall_s': round(self.wall, 3),
+                 'cpu_s': round(self.cpu, 3), 'peak_rss_mb': _to_mb(self.peak_rss)}
+        if self.task_wall:
+            stage['tasks'] = {'count': len(self.task_wall),
+                              'wall_s': {'total': round(sum(self.task_wall), 3), 'min': round(min(self.task_wall), 3),
+                                         'median': round(float(np.median(self.task_wall)), 3), 'max': round(max(self.task_wall), 3)},
+                              'cpu_s': round(sum(self.task_cpu), 3),
+                              'workers': {str(worker): {'tasks': self.worker_tasks[worker], 'wall_s': round(wall, 3)}
+                                          for worker, wall in self.worker_wall.items()},
+                              'worker_peak_rss_mb': _to_mb(self.worker_peak_rss)}
+        return stage
+
+
+class StageProfiler(object):
+    def __init__(self):
+        self.stages = []
+        self.active = []
+        self.cprofile = False
+        self.main_profile = None
+        self.main_pid = None
+        self.worker_stats = None
+        self.start_wall = time.perf_counter()
+
+    def enable_cprofile(self):
+        self.cprofile = True
+        self.main_profile = cProfile.Profile()
+        self.main_profile.enable()
+        self.main_pid = os.getpid()
+
+    def disable_inherited(self):
+        """
+        Stops the main process profiler inherited by a forked worker (pools created after
+        enable_cprofile), which would keep other profilers from starting on Python 3.12+
+        """
+        if self.main_profile is not None and os.getpid() != self.main_pid:
+            self.main_profile.disable()
+            self.main_profile = None
+
+    def add_task(self, wall, cpu, worker, peak_rss, stats):
+        if not self.active or threading.current_thread() is not threading.main_thread():
+            return
+        record = self.active[-1]
+        record.task_wall.append(wall)
+        record.task_cpu.append(cpu)
+        record.worker_wall[worker] += wall
+        record.worker_tasks[worker] += 1
+        record.worker_peak_rss = max(record.worker_peak_rss, peak_rss)
+        if stats is not None:
+            if self.worker_stats is None:
+                self.worker_stats = pstats.Stats(_ProfileStats(stats))
+            else:
+                self.worker_stats.add(_ProfileStats(stats))
+
+    def write_report(self, out_dir, threads):
+        report = {'command': ' '.join(sys.argv[1:]), 'threads': threads,
+                  'wall_s': round(time.perf_counter() - self.start_wall, 3),
+                  'cpu_s': round(time.process_time(), 3),
+                  'peak_rss_mb': _to_mb(_peak_rss()),
+                  'stages': [record.to_dict() for record in self.stages]}
+        with open(os.path.join(out_dir, "severus_profile.json"), "w") as fout:
+            json.dump(report, fout, indent=1)
+
+        if self.cprofile:
+            self.main_profile.disable()
+            stats = pstats.Stats(self.main_profile)
+            if self.worker_stats is not None:
+                stats.add(self.worker_stats)
+            stats.dump_stats(os.path.join(out_dir, "severus_profile.prof"))
+
+
+def _peak_rss():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def _to_mb(rss_kb):
+    return round(rss_kb / 1024, 1)
+
+
+profiler = StageProfiler()
+
+
+@contextmanager
+def profile_stage(name):
+    """
+    Records wall time, main process CPU time and peak RSS of the enclosed block.
+    Stages nest; pool tasks are attributed to the innermost stage. Like those of worker
+    processes, stages entered in the threads of a thread pool are not recorded
+    """
+    if threading.current_thread() is not threading.main_thread():
+        yield StageRecord(name, 0)
+        return
+    path = profiler.active[-1].name + '/' + name if profiler.active else name
+    record = StageRecord(path, len(profiler.active))
+    profiler.stages.append(record)
+    profiler.active.append(record)
+    start_wall = time.perf_counter()
+    start_cpu = time.process_time()
+    try:
+        yield record
+    finally:
+        record.wall = time.perf_counter() - start_wall
+        record.cpu = time.process_time() - start_cpu
+        record.peak_rss = _peak_rss()
+        profiler.active.pop()
+
+
+def _run_task(func, args, cprofile):
+    """
+    Runs a task, timing it with the CPU time of the running thread, so that tasks of a thread pool
+    are not charged for each other. Workers are identified by the native id of their thread
+    (the pid of a worker process on Linux)
+    """
+    start_wall = time.perf_counter()
+    start_cpu = time.thread_time()
+    stats = None
+    prof = None
+    if cprofile:
+        profiler.disable_inherited()
+        prof = cProfile.Profile()
+        try:
+            prof.enable()
+        except ValueError:
+            #another profiler is active, the task runs without stats
+            prof = None
+    result = func(*args)
+    if prof is not None:
+        prof.disable()
+        prof.create_stats()
+        stats = prof.stats
+    return result, time.perf_counter() - start_wall, time.thread_time() - start_cpu, threading.get_native_id(), _peak_rss(), stats
+
+
+def _profiled_by_main(thread_pool):
+    """
+    True if the main process cProfile already records the tasks: serial tasks, and the tasks
+    of a thread pool on Python 3.12+, where profiling covers all threads of the process
+    """
+    if isinstance(thread_pool, SerialPool):
+        return True
+    return isinstance(thread_pool, ThreadPool) and sys.version_info >= (3, 12)
+
+
+def _run_task_args(task):
+    return _run_task(*task)
+
+
+def _format_eta(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}"
+
+
+class _Progress(object):
+    """
+    Completed tasks and items of a pool call, logged every PROGRESS_INTERVAL seconds
+    """
+    __slots__ = ('name', 'total', 'unit', 'item_unit', 'done', 'items', 'start', 'last_report')
+    def __init__(self, name, total, unit, item_unit):
+        self.name = name
+        self.total = total
+        self.unit = unit
+        self.item_unit = item_unit
+        self.done = 0
+        self.items = 0
+        self.start = time.perf_counter()
+        self.last_report = self.start
+
+    def rates(self, elapsed):
+        rates = f"{self.done / elapsed:.1f} {self.unit}/s"
+        if self.item_unit:
+            rates += f", {self.items / elapsed:.0f} {self.item_unit}/s"
+        return rates
+
+    def update(self, items):
+        self.done += 1
+        self.items += items
+        now = time.perf_counter()
+        if now - self.last_report >= PROGRESS_INTERVAL and self.done < self.total:
+            self.last_report = now
+            elapsed = now - self.start
+            eta = elapsed / self.done * (self.total - self.done)
+            logger.info(f"\t{self.name}: {self.done}/{self.total} {self.unit} ({self.rates(elapsed)}), ETA {_format_eta(eta)}")
+
+    def finish(self):
+        if not self.done:
+            return
+        elapsed = max(time.perf_counter() - self.start, 1e-6)
+        logger.debug(f"\t{self.name}: {self.done} {self.unit} in {elapsed:.1f}s ({self.rates(elapsed)})")
+
+
+def pool_imap(thread_pool, func, tasks, ordered=True, unit='tasks', count=None, item_unit=None):
+    """
+    Yields the results of func over the tasks as they complete, in the task order if ordered,
+    and records per-task timings in the current stage. Progress, throughput and ETA are logged
+    every PROGRESS_INTERVAL seconds; count(result) gives the number of item_unit in a result.
+    Tasks already recorded by the cProfile of the main process are not profiled separately
+    """
+    name = profiler.active[-1].name if profiler.active else func.__name__
+    progress = _Progress(name, len(tasks), unit, item_unit)
+    imap = thread_pool.imap if ordered else thread_pool.imap_unordered
+    cprofile = profiler.cprofile and not _profiled_by_main(thread_pool)
+    for (result, wall, cpu, worker, peak_rss, stats) in imap(_run_task_args, [(func, args, cprofile) for args in tasks]):
+        profiler.add_task(wall, cpu, worker, peak_rss, stats)
+        progress.update(count(result) if count is not None else 0)
+        yield result
+    progress.finish()
+
+
+def pool_starmap(thread_pool, func, tasks, unit='tasks'):
+    """
+    thread_pool.starmap that records per-task timings in the current stage
+    """
+    return list(pool_imap(thread_pool, func, tasks, unit=unit))
@@ -7,6 +7,7 @@ import numpy as np
 import gzip
 
 from severus.bam_processing import ReadSegment, add_read_qual
+from severus.filters import SEG_VNTR_ONLY, SEG_UNLABELED
 
 logger = logging.getLogger()
 
@@ -76,13 +77,13 @@ def filter_vntr_only_segments(split_segs, vntr_list):
             if strt - end == 1:
                 vntr_len = tr_reg[1][end] - tr_reg[0][end]
                 if s1.segment_length > vntr_len * OVERLAP_THR:
-                    s1.is_pass = 'vntr_only'
+                    s1.is_pass = SEG_VNTR_ONLY
      
 def calc_new_segments(segments, clipped_segs, vntr_strt, vntr_end, bp_len, bp_pos, split_seg_vntr, min_sv_size, ins_seq):
     BP_TOL = 500
     seg_span_start=[]
     seg_span_end=[]
-    is_pass = ''
+    is_pass = SEG_UNLABELED
     
     if not ins_seq:
         ins_seq = "<DUP>"
@@ -99,8 +100,8 @@ def calc_new_segments(segments, clipped_segs, vntr_strt, vntr_end, bp_len, bp_po
         
     if not seg_span_start or not seg_span_end and [seg for seg in segments if not seg.is_insertion and not seg.is_clipped]:     
         for seg in segments:
-            seg.is_pass = 'vntr_only'
-            is_pass = 'vntr_only'
+            seg.is_pass = SEG_VNTR_ONLY
+            is_pass = SEG_VNTR_ONLY
             
     s1 = seg_span_start[0] if seg_span_start else segments[0] 
     s2 = seg_span_end[0] if seg_span_end else segments[-1] 
@@ -275,7 +276,7 @@ def resolve_read_vntr(read, vntr_list, min_sv_size):
                                         s1.genome_id, s1.mismatch_rate, True, s1.error_rate, s1.is_primary))
             new_read[-1].ins_seq = ins_seq
             if not check_spanning(read, key):
-                new_read[-1].is_pass = 'vntr_only'
+                new_read[-1].is_pass = SEG_VNTR_ONLY
         else:
             segments.sort(key = lambda s:s.ref_start)
             new_segments = calc_new_segments(segments, clipped_segs, key[1], key[2],bp_len, bp_pos, split_seg_vntr, min_sv_size, ins_seq)
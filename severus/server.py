@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Local server mode. Reads are parsed and annotated once and kept in memory,
+then SVs are called on request, optionally for a single locus and with other
+calling parameters. Requests are HTTP GET on localhost or on a Unix socket,
+responses are json (plots are html):
+
+  /call?region=chr1:1000000-2000000&min-support=5   calls SVs, returns the call id and SVs
+  /support?call=1&sv=severus_DEL3                    supporting reads of an SV by sample
+  /plot?call=1&sv=severus_BND7                       html plot of the cluster with the SV
+  /status                                            loaded samples and cached calls
+"""
+
+import os
+import re
+import copy
+import json
+import time
+import socket
+import argparse
+import logging
+from collections import OrderedDict
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+from severus.breakpoint_finder import find_breakpoints, filter_breakpoints, get_phasingblocks
+from severus.build_graph import build_cluster_graph, cluster_plot_data
+from severus.bam_processing import in_regions
+from severus.sweep import set_changes, SweepError
+
+
+logger = logging.getLogger()
+
+MAX_CACHED_CALLS = 32
+
+
+class RequestError(Exception):
+    def __init__(self, message, status=400):
+        Exception.__init__(self, message)
+        self.status = status
+
+
+class CallResult(object):
+    __slots__ = ('call_id', 'options', 'region', 'double_breaks', 'graphs', 'wall_s')
+    def __init__(self, call_id, options, region, double_breaks, graphs, wall_s):
+        self.call_id = call_id
+        self.options = options
+        self.region = region
+        self.double_breaks = double_breaks
+        self.graphs = graphs
+        self.wall_s = wall_s
+
+
+def _sv_records(double_breaks, graphs):
+    """
+    One record per SV id, with the per-sample support and the cluster in the graph of all SVs
+    """
+    cluster_of = {}
+    for subgr_num, db_ls in graphs['germline'][3].items():
+        for db in db_ls:
+            cluster_of[db.vcf_id] = "severus_" + str(subgr_num)
+    records = OrderedDict()
+    somatic = set(db.vcf_id for db in double_breaks.get('somatic', []))
+    for db in double_breaks['germline']:
+        if db.vcf_id not in records:
+            records[db.vcf_id] = {'id': db.vcf_id, 'type': db.vcf_sv_type, 'detailed_type': db.sv_type if isinstance(db.sv_type, str) else '',
+                                  'chrom': db.bp_1.ref_id, 'pos': db.bp_1.position,
+                                  'chrom2': db.bp_2.ref_id, 'pos2': db.bp_2.position,
+                                  'strands': ('+' if db.direction_1 > 0 else '-') + ('+' if db.direction_2 > 0 else '-'),
+                                  'length': db.length, 'somatic': db.vcf_id in somatic, 'cluster': cluster_of.get(db.vcf_id),
+                                  'samples': {}}
+        sample = records[db.vcf_id]['samples'].setdefault(db.genome_id, {'support': 0, 'DR': db.DR, 'DV': db.DV, 'vaf': db.vaf,
+                                                                        'genotype': db.genotype, 'haplotypes': []})
+        sample['support'] += db.supp
+        sample['haplotypes'].append(db.haplotype_1)
+    return list(records.values())
+
+
+def parse_region(region, ref_lengths):
+    match = re.match(r'^([^:]+)(?::([\d,]+)-([\d,]+))?$', region)
+    if not match or match.group(1) not in ref_lengths:
+        raise RequestError(f"invalid region: {region}")
+    ctg = match.group(1)
+    if match.group(2) is None:
+        return {ctg: [[0, ref_lengths[ctg]]]}
+    start, end = int(match.group(2).replace(',', '')), int(match.group(3).replace(',', ''))
+    if start >= end:
+        raise RequestError(f"invalid region: {region}")
+    return {ctg: [[max(start - 1, 0), min(end, ref_lengths[ctg])]]}
+
+
+class SeverusServer(object):
+    """
+    Annotated reads and coverage of a run, and the cached results of the calls made on them
+    """
+    def __init__(self, segments_by_read, coverage_histograms, ref_lengths, bam_files, genome_ids,
+                 target_genomes, control_genomes, thread_pool, parser, base_argv, set_defaults, args):
+        self.segments_by_read = segments_by_read
+        self.coverage_histograms = coverage_histograms
+        self.ref_lengths = ref_lengths
+        self.bam_files = bam_files
+        self.genome_ids = genome_ids
+        self.target_genomes = target_genomes
+        self.control_genomes = control_genomes
+        self.thread_pool = thread_pool
+        self.parser = parser
+        self.base_argv = base_argv
+        self.set_defaults = set_defaults
+        self.args = args
+        self.calls = OrderedDict()
+        self.next_id = 1
+        self.work_dir = os.path.join(args.out_dir, "server")
+        if not os.path.isdir(self.work_dir):
+            os.makedirs(self.work_dir)
+        self.hb_points = []
+        if args.phase_vcf:
+            self.hb_points = get_phasingblocks(args.phase_vcf, thread_pool, os.path.join(args.out_dir, "phasing_blocks.json"))
+
+    def _reads_in_region(self, regions):
+        return [read for read in self.segments_by_read if
+                any(in_regions(regions, seg.ref_id, seg.ref_start, max(seg.ref_end, seg.ref_start)) for seg in read)]
+
+    def call(self, options, region):
+        """
+        Calls SVs with the given options, limited to the reads and SVs in the region if given
+        """
+        key = (tuple(options), region)
+        for result in self.calls.values():
+            if (tuple(result.options), result.region) == key:
+                self.calls.move_to_end(result.call_id)
+                return result
+        start = time.perf_counter()
+        try:
+            changed = set_changes(options, self.parser, self.base_argv, self.args, self.set_defaults)
+        except SweepError as e:
+            raise RequestError(str(e))
+        call_args = argparse.Namespace(**vars(self.args))
+        vars(call_args).update(changed)
+        call_args.out_dir = self.work_dir
+        call_args.regions = parse_region(region, self.ref_lengths) if region else self.args.regions
+
+        reads = self.segments_by_read if call_args.regions is None else self._reads_in_region(call_args.regions)
+        reads = copy.deepcopy(reads)
+        double_breaks, ins_clusters, single_bps = find_breakpoints(reads, self.ref_lengths, self.bam_files, self.genome_ids,
+                                                                   self.control_genomes, self.thread_pool, call_args)
+        double_breaks = filter_breakpoints(double_breaks, ins_clusters, single_bps, reads, self.ref_lengths, self.coverage_histograms,
+                                           self.bam_files, self.genome_ids, self.control_genomes, self.thread_pool, call_args)
+        if call_args.regions is not None:
+            for db_key, db_list in double_breaks.items():
+                double_breaks[db_key] = [db for db in db_list if in_regions(call_args.regions, db.bp_1.ref_id, db.bp_1.position) or
+                                         in_regions(call_args.regions, db.bp_2.ref_id, db.bp_2.position)]
+        keys = ['germline', 'somatic'] if self.control_genomes or call_args.pon_file else ['germline']
+        graphs = {}
+        for db_key in keys:
+            graphs[db_key] = build_cluster_graph(double_breaks[db_key], self.coverage_histograms, self.hb_points, db_key,
+                                                 self.target_genomes, self.control_genomes, self.ref_lengths, call_args)
+
+        result = CallResult(self.next_id, options, region, double_breaks, graphs, time.perf_counter() - start)
+        self.next_id += 1
+        self.calls[result.call_id] = result
+        if len(self.calls) > MAX_CACHED_CALLS:
+            self.calls.popitem(last=False)
+        return result
+
+    def get_call(self, call_id):
+        try:
+            return self.calls[int(call_id)]
+        except (KeyError, ValueError):
+            raise RequestError(f"unknown call: {call_id}", 404)
+
+    def support(self, call_id, sv_id):
+        result = self.get_call(call_id)
+        reads = OrderedDict()
+        for db in result.double_breaks['germline']:
+            if db.vcf_id == sv_id:
+                reads.setdefault(db.genome_id, set()).update(db.supp_read_ids)
+        if not reads:
+            raise RequestError(f"unknown SV: {sv_id}", 404)
+        return {'call': result.call_id, 'sv': sv_id, 'reads': {genome_id: sorted(ids) for genome_id, ids in reads.items()}}
+
+    def plot(self, call_id, sv_id):
+        from severus.plots import render_cluster_plot
+        result = self.get_call(call_id)
+        for db_key in ['somatic', 'germline']:
+            if db_key not in result.graphs:
+                continue
+            graph, adj_clusters, db_to_cl, _clustered = result.graphs[db_key]
+            for subgr_num, (_, _, _type, _, cc, _) in enumerate(adj_clusters):
+                if _type == 'indel':
+                    continue
+                if any(db.vcf_id == sv_id for node in cc for db in db_to_cl.get(node, [])):
+                    out_file = os.path.join(self.work_dir, f"plot_{result.call_id}_{subgr_num}.html")
+                    render_cluster_plot(cluster_plot_data(graph, cc, db_to_cl), subgr_num, out_file)
+                    with open(out_file) as f:
+                        return f.read()
+        raise RequestError(f"no plotted cluster with SV: {sv_id}", 404)
+
+    def status(self):
+        return {'samples': self.genome_ids, 'reads': len(self.segments_by_read),
+                'calls': [{'call': r.call_id, 'options': r.options, 'region': r.region, 'wall_s': round(r.wall_s, 3)}
+                          for r in self.calls.values()]}
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    server_version = "Severus"
+
+    def _send(self, status, content_type, body):
+        body = body.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        severus = self.server.severus
+        url = urlparse(self.path)
+        query = {k: v[-1] for k, v in parse_qs(url.query, keep_blank_values=True).items()}
+        try:
+            if url.path == '/call':
+                region = query.pop('region', None)
+                options = []
+                for opt, value in query.items():
+                    options += ['--' + opt] + ([value] if value else [])
+                result = severus.call(options, region)
+                self._send(200, "application/json", json.dumps({'call': result.call_id, 'wall_s': round(result.wall_s, 3),
+                                                                'svs': _sv_records(result.double_breaks, result.graphs)}))
+            elif url.path == '/support':
+                self._send(200, "application/json", json.dumps(severus.support(query.get('call'), query.get('sv'))))
+            elif url.path == '/plot':
+                self._send(200, "text/html", severus.plot(query.get('call'), query.get('sv')))
+            elif url.path == '/plotly.min.js':
+                from severus.plots import plotly_js
+                self._send(200, "application/javascript", plotly_js())
+            elif url.path == '/status':
+                self._send(200, "application/json", json.dumps(severus.status()))
+            else:
+                raise RequestError(f"unknown request: {url.path}", 404)
+        except RequestError as e:
+            self._send(e.status, "application/json", json.dumps({'error': str(e)}))
+        except Exception as e:
+            logger.exception("Request failed")
+            self._send(500, "application/json", json.dumps({'error': str(e)}))
+
+    def address_string(self):
+        return self.client_address[0] if self.client_address else 'unix'
+
+    def log_message(self, fmt, *args):
+        logger.debug("%s %s", self.address_string(), fmt % args)
+
+
+class _UnixHTTPServer(HTTPServer):
+    address_family = socket.AF_UNIX
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+        self.socket.bind(self.server_address)
+        self.server_name = 'localhost'
+        self.server_port = 0
+
+
+def serve(severus, address):
+    """
+    Answers requests until interrupted. address is a localhost port or a Unix socket path
+    """
+    if address.isdigit():
+        httpd = HTTPServer(('127.0.0.1', int(address)), _RequestHandler)
+        logger.info(f"Serving on http://127.0.0.1:{httpd.server_port}")
+    else:
+        httpd = _UnixHTTPServer(address, _RequestHandler)
+        logger.info(f"Serving on unix socket {address}")
+    httpd.severus = severus
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Server stopped")
+    finally:
+        httpd.server_close()
+        if not address.isdigit() and os.path.exists(address):
+            os.remove(address)
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Scatter/gather execution across nodes. In the scatter mode, every node parses
+a subset of contigs or regions (--chrom / --regions) and writes a shard with
+the parsed split read, insertion and clipped end records together with the
+coverage and mismatch histograms of its regions. The gather mode merges the
+shards and runs read annotation, breakpoint calling and the outputs. Split
+reads spanning several shards are recovered in every shard through the SA
+tag, and their records are merged by read id. An alignment overlapping the
+regions of several shards is parsed (and counted in the histograms) only by
+the shard whose regions contain its start, so shards should tile the contigs.
+"""
+
+import logging
+from collections import defaultdict
+
+from severus.__version__ import __version__
+from severus.checkpoint import write_state, read_state
+from severus.bam_processing import in_regions
+
+
+logger = logging.getLogger()
+
+SHARD_VERSION = 3
+#parameters that change the parsed records
+PARSE_PARAMS = ['min_sv_size', 'use_supplementary_tag', 'multisample', 'min_mapping_quality']
+
+
+class ShardError(Exception):
+    pass
+
+
+def parse_params(args):
+    return {k: getattr(args, k) for k in PARSE_PARAMS}
+
+
+def make_shard(ref_lengths, genome_ids, parsed, args):
+    """
+    Shard with the parsed state of genome_ids, keeping histograms of the shard contigs only
+    """
+    segments_by_read, coverage_histograms, mismatch_histograms, n90, bg_mm, read_qual, read_qual_len = parsed
+    contigs = set(ref_lengths if args.regions is None else args.regions)
+    return {'shard_version': SHARD_VERSION, 'version': __version__, 'params': parse_params(args),
+            'ref_lengths': ref_lengths, 'genome_ids': genome_ids, 'regions': args.regions,
+            'segments_by_read': segments_by_read,
+            'coverage_histograms': {k: v for k, v in coverage_histograms.items() if k[0] in genome_ids and k[2] in contigs},
+            'mismatch_histograms': {k: v for k, v in mismatch_histograms.items() if k in contigs},
+            'n90': n90, 'bg_mm': bg_mm, 'read_qual': dict(read_qual), 'read_qual_len': dict(read_qual_len)}
+
+
+def write_shard(shard_file, ref_lengths, genome_ids, parsed, args):
+    logger.info(f"Writing shard: {shard_file}")
+    write_state(shard_file, make_shard(ref_lengths, genome_ids, parsed, args))
+
+
+def _check_shard(shard_file, shard, ref_lengths, genome_ids, args):
+    if shard.get('shard_version') != SHARD_VERSION or shard['version'] != __version__:
+        raise ShardError(f"shard {shard_file} was written by a different Severus version")
+    if shard['ref_lengths'] != ref_lengths:
+        raise ShardError(f"shard {shard_file} was made with a different reference")
+    if not set(shard['genome_ids']) <= set(genome_ids):
+        raise ShardError(f"shard {shard_file} was made from different bam files")
+    if shard['params'] != parse_params(args):
+        diff = [k for k in PARSE_PARAMS if shard['params'][k] != getattr(args, k)]
+        raise ShardError(f"shard {shard_file} was made with different parameters: {', '.join(diff)}")
+
+
+def _check_overlaps(shard_file, shard, gathered):
+    """
+    Shards of the same bam must not overlap, otherwise the histograms would be counted twice
+    """
+    regions = shard['regions']
+    for other_file, other_genomes, other_regions in gathered:
+        if not set(shard['genome_ids']) & set(other_genomes):
+            continue
+        if regions is None or other_regions is None:
+            raise ShardError(f"shards {other_file} and {shard_file} overlap")
+        for ctg, intervals in regions.items():
+            for start, end in intervals:
+                if in_regions(other_regions, ctg, start, end - 1):
+                    raise ShardError(f"shards {other_file} and {shard_file} overlap at {ctg}:{start}-{end}")
+
+
+def _check_boundaries(gathered):
+    """
+    Warns about shard region starts with no other shard of the same bam right before them:
+    alignments starting in the gap and overlapping the region are parsed by no shard
+    """
+    gaps = []
+    for shard_file, genomes, regions in gathered:
+        for ctg, intervals in (regions or {}).items():
+            start = intervals[0][0] if intervals else 0
+            if start == 0:
+                continue
+            if not any(set(genomes) & set(other_genomes) and other_regions is not None and in_regions(other_regions, ctg, start - 1)
+                       for other_file, other_genomes, other_regions in gathered if other_file != shard_file):
+                gaps.append(f"{ctg}:{start}")
+    if gaps:
+        logger.warning(f"Alignments starting right before these shard regions are not parsed by any shard: {', '.join(gaps[:10])}"
+                       + (f" and {len(gaps) - 10} more" if len(gaps) > 10 else ""))
+
+
+def _segment_key(seg):
+    return (seg.ref_id, seg.ref_start, seg.ref_end, seg.read_start, seg.read_end, seg.strand, seg.is_insertion, seg.is_clipped)
+
+
+def _read_shards(shard_files):
+    for shard_file in shard_files:
+        logger.info(f"Reading shard: {shard_file}")
+        try:
+            yield shard_file, read_state(shard_file)
+        except (OSError, EOFError) as e:
+            raise ShardError(f"shard {shard_file} could not be read: {e}")
+
+
+def gather_shards(shard_files, ref_lengths, genome_ids, coverage_histograms, mismatch_histograms, args):
+    return merge_shards(_read_shards(shard_files), ref_lengths, genome_ids, coverage_histograms, mismatch_histograms, args)
+
+
+def merge_shards(shards, ref_lengths, genome_ids, coverage_histograms, mismatch_histograms, args):
+    """
+    Merges (name, shard) pairs into the parsed state. Records of the same read from different
+    shards are joined, and the alignments parsed by several shards are kept once
+    """
+    reads = {genome_id: defaultdict(list) for genome_id in genome_ids}
+    seen = defaultdict(set)
+    n90 = []
+    bg_mm = []
+    read_qual = defaultdict(int)
+    read_qual_len = defaultdict(int)
+    gathered = []
+    for shard_file, shard in shards:
+        _check_shard(shard_file, shard, ref_lengths, genome_ids, args)
+        _check_overlaps(shard_file, shard, gathered)
+        gathered.append((shard_file, shard['genome_ids'], shard['regions']))
+
+        for read in shard['segments_by_read']:
+            if not read:
+                continue
+            genome_id, read_id = read[0].genome_id, read[0].read_id
+            for seg in read:
+                key = _segment_key(seg)
+                if key in seen[(genome_id, read_id)]:
+                    continue
+                seen[(genome_id, read_id)].add(key)
+                reads[genome_id][read_id].append(seg)
+        for key, hist in shard['coverage_histograms'].items():
+            coverage_histograms[key] += hist
+        for ctg, hist in shard['mismatch_histograms'].items():
+            for i, window in enumerate(hist):
+                mismatch_histograms[ctg][i] += window
+        n90 += shard['n90']
+        bg_mm += shard['bg_mm']
+        for k, v in shard['read_qual'].items():
+            read_qual[k] += v
+        for k, v in shard['read_qual_len'].items():
+            read_qual_len[k] += v
+        shard = None
+
+    missing = [genome_id for genome_id in genome_ids if not any(genome_id in genomes for _, genomes, _ in gathered)]
+    if missing:
+        raise ShardError(f"no shards for {', '.join(missing)}")
+    _check_boundaries(gathered)
+    segments_by_read = [read for genome_id in genome_ids for read in reads[genome_id].values()]
+    logger.info(f"\tMerged {len(gathered)} shards: {len(segments_by_read)} reads")
+    return segments_by_read, coverage_histograms, mismatch_histograms, n90, bg_mm, read_qual, read_qual_len
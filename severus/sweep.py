@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Parameter sweeps. Reads are parsed and annotated once, then breakpoint calling,
+filtering and the outputs run for every parameter set of the sweep file, each
+into its own subdirectory of <out_dir>/sweep. Every line of the sweep file is a
+grid of options, with comma separated values expanded into all combinations:
+
+  --min-support 3,5 --vaf-thr 0.05,0.1
+  --TIN-ratio 0.02 --resolve-overlaps
+"""
+
+import os
+import re
+import copy
+import shlex
+import argparse
+import itertools
+import logging
+
+from severus.breakpoint_finder import find_breakpoints, filter_breakpoints
+from severus.build_graph import output_graphs
+from severus.bam_processing import in_regions
+from severus.shards import PARSE_PARAMS
+from severus.profiling import profile_stage, pool_starmap
+from severus.executor import SerialPool, make_pool
+
+
+logger = logging.getLogger()
+
+#parameters shared by all sets: inputs, run settings and everything used before breakpoint calling
+FIXED_PARAMS = PARSE_PARAMS + ['target_bam', 'control_bam', 'out_dir', 'threads', 'executor', 'vntr_file', 'regions_bed', 'chroms',
+                               'scatter_shard', 'gather_shards', 'cohort_dir', 'checkpoint', 'resume', 'profile', 'sweep', 'serve']
+
+
+class SweepError(Exception):
+    pass
+
+
+def _expand_grid(tokens):
+    options = []
+    for token in tokens:
+        if token.startswith('--') or not options:
+            options.append([token, []])
+        else:
+            options[-1][1].append(token.split(','))
+    grid = []
+    for opt, values in options:
+        grid.append([[opt] + list(combination) for combination in itertools.product(*values)])
+    return [sum(combination, []) for combination in itertools.product(*grid)]
+
+
+def _set_name(set_opts):
+    return re.sub(r'[^\w.=,+-]', '_', '_'.join(set_opts).lstrip('-').replace('_--', '_'))
+
+
+def set_changes(set_opts, parser, base_argv, base_args, set_defaults):
+    """
+    Parameters changed by the options of a set, relative to the base run
+    """
+    try:
+        set_args = parser.parse_args(base_argv + set_opts)
+    except SystemExit:
+        raise SweepError(f"could not parse options: {' '.join(set_opts)}")
+    set_defaults(set_args)
+    changed = {k: v for k, v in vars(set_args).items() if v != getattr(base_args, k)}
+    fixed = [k for k in changed if k in FIXED_PARAMS]
+    if fixed:
+        raise SweepError(f"parameters {', '.join(fixed)} change read parsing or inputs and can not vary: {' '.join(set_opts)}")
+    return changed
+
+
+def read_sweep(sweep_file, parser, base_argv, base_args, set_defaults):
+    """
+    Returns (name, options, changed parameters) of every set in the sweep file
+    """
+    sets = []
+    names = set()
+    with open(sweep_file) as f:
+        for line in f:
+            line = line.split('#')[0].strip()
+            if not line:
+                continue
+            for set_opts in _expand_grid(shlex.split(line)):
+                changed = set_changes(set_opts, parser, base_argv, base_args, set_defaults)
+                name = _set_name(set_opts)
+                if name in names:
+                    continue
+                names.add(name)
+                sets.append((name, set_opts, changed))
+    if not sets:
+        raise SweepError(f"no parameter sets in {sweep_file}")
+    return sets
+
+
+def _call_set(set_args, segments_by_read, coverage_histograms, ref_lengths, bam_files, genome_ids,
+              target_genomes, control_genomes, thread_pool):
+    double_breaks, ins_clusters, single_bps = find_breakpoints(segments_by_read, ref_lengths, bam_files, genome_ids,
+                                                               control_genomes, thread_pool, set_args)
+    double_breaks = filter_breakpoints(double_breaks, ins_clusters, single_bps, segments_by_read, ref_lengths, coverage_histograms,
+                                       bam_files, genome_ids, control_genomes, thread_pool, set_args)
+    if set_args.regions is not None:
+        for key, db_list in double_breaks.items():
+            double_breaks[key] = [db for db in db_list if in_regions(set_args.regions, db.bp_1.ref_id, db.bp_1.position) or
+                                  in_regions(set_args.regions, db.bp_2.ref_id, db.bp_2.position)]
+    output_graphs(double_breaks, coverage_histograms, thread_pool, target_genomes, control_genomes, genome_ids, ref_lengths, set_args)
+    return {key: len(db_list) for key, db_list in double_breaks.items()}
+
+
+_sweep_state = None
+
+def _init_sweep_worker(state):
+    global _sweep_state
+    _sweep_state = state
+
+
+def _call_set_worker(name, set_args):
+    segments_by_read, coverage_histograms = copy.deepcopy(_sweep_state[:2])
+    return _call_set(set_args, segments_by_read, coverage_histograms, *_sweep_state[2:], SerialPool())
+
+
+def run_sweep(sets, segments_by_read, coverage_histograms, ref_lengths, bam_files, genome_ids,
+              target_genomes, control_genomes, thread_pool, args):
+    """
+    Calls SVs for every parameter set. With several threads and sets, the sets run in parallel,
+    one per worker of the executor, otherwise one after another using the pool
+    """
+    sweep_dir = os.path.join(args.out_dir, "sweep")
+    if not os.path.isdir(sweep_dir):
+        os.makedirs(sweep_dir)
+    tasks = []
+    with open(os.path.join(sweep_dir, "sweep_sets.tsv"), "w") as f:
+        f.write("name\toptions\n")
+        for name, set_opts, changed in sets:
+            set_args = argparse.Namespace(**vars(args))
+            vars(set_args).update(changed)
+            set_args.out_dir = os.path.join(sweep_dir, name)
+            set_args.write_segdups_out = ''
+            set_args.write_log_out = ''
+            if not os.path.isdir(set_args.out_dir):
+                os.makedirs(set_args.out_dir)
+            tasks.append((name, set_args))
+            f.write(f"{name}\t{' '.join(set_opts)}\n")
+
+    logger.info(f"Running {len(tasks)} parameter sets")
+    if args.threads > 1 and len(tasks) > 1 and args.executor != 'serial':
+        state = (segments_by_read, coverage_histograms, ref_lengths, bam_files, genome_ids, target_genomes, control_genomes)
+        sweep_pool = make_pool(args.executor, min(args.threads, len(tasks)), initializer=_init_sweep_worker, initargs=(state,))
+        with profile_stage('sweep'):
+            counts = pool_starmap(sweep_pool, _call_set_worker, tasks)
+        sweep_pool.close()
+    else:
+        counts = []
+        for i, (name, set_args) in enumerate(tasks):
+            logger.info(f"Parameter set {name}")
+            set_state = (segments_by_read, coverage_histograms) if i == len(tasks) - 1 else copy.deepcopy((segments_by_read, coverage_histograms))
+            with profile_stage('sweep:' + name):
+                counts.append(_call_set(set_args, *set_state, ref_lengths, bam_files, genome_ids,
+                                        target_genomes, control_genomes, thread_pool))
+
+    for (name, _set_args), set_counts in zip(tasks, counts):
+        logger.info(f"\t{name}: " + ", ".join(f"{key} {n}" for key, n in set_counts.items()))
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Columnar tables of the calls: dicts of column name to numpy array, used by the
+Python API and the Parquet output
+"""
+
+from collections import defaultdict, OrderedDict
+
+import numpy as np
+
+from severus.bam_processing import COV_WINDOW, NUM_HAPLOTYPES
+from severus.filters import bp_filter_name
+
+
+INT_COLUMNS = ['pos', 'pos2', 'length', 'haplotype', 'support', 'DR', 'DV', 'spanning_1', 'spanning_2',
+               'start', 'end', 'segments']
+FLOAT_COLUMNS = ['vaf', 'hvaf']
+BOOL_COLUMNS = ['somatic']
+#columns of lists
+LIST_COLUMNS = ['read_ids']
+
+
+def _table(columns):
+    table = OrderedDict()
+    for name, values in columns.items():
+        if name in LIST_COLUMNS:
+            table[name] = np.empty(len(values), dtype=object)
+            table[name][:] = values
+        elif name in INT_COLUMNS:
+            table[name] = np.array(values, dtype=np.int64)
+        elif name in FLOAT_COLUMNS:
+            table[name] = np.array(values, dtype=np.float64)
+        elif name in BOOL_COLUMNS:
+            table[name] = np.array(values, dtype=bool)
+        else:
+            table[name] = np.array(values, dtype=str)
+    return table
+
+
+def _spanning(bp, genome_id, haplotype):
+    span = bp.spanning_reads.get(genome_id)
+    return int(span[haplotype]) if span is not None and not np.isscalar(span) else 0
+
+
+def _detailed_type(db):
+    #paired inversions keep their coordinates in sv_type
+    return db.sv_type if isinstance(db.sv_type, str) else ''
+
+
+def breakpoint_tables(double_breaks, graphs):
+    """
+    breakpoints, support and clusters tables of the filtered breakpoints and their cluster graphs
+    """
+    cluster_of = defaultdict(dict)
+    clusters = OrderedDict((name, []) for name in ['key', 'cluster', 'cluster_type', 'id'])
+    for key, (_graph, adj_clusters, _db_to_cl, clustered) in graphs.items():
+        for subgr_num, db_ls in clustered.items():
+            cluster_id = "severus_" + str(subgr_num)
+            for sv_id in OrderedDict.fromkeys(db.vcf_id for db in db_ls):
+                cluster_of[key][sv_id] = cluster_id
+                clusters['key'].append(key)
+                clusters['cluster'].append(cluster_id)
+                clusters['cluster_type'].append(adj_clusters[subgr_num][2])
+                clusters['id'].append(sv_id)
+
+    somatic = set(db.vcf_id for db in double_breaks.get('somatic', []))
+    breakpoints = OrderedDict((name, []) for name in ['id', 'type', 'detailed_type', 'chrom', 'pos', 'chrom2', 'pos2',
+                                                      'strand1', 'strand2', 'length', 'somatic', 'cluster'])
+    support = OrderedDict((name, []) for name in ['id', 'genome_id', 'haplotype', 'filter', 'support', 'spanning_1', 'spanning_2',
+                                                  'DR', 'DV', 'vaf', 'hvaf', 'genotype', 'read_ids'])
+    seen = set()
+    for db in double_breaks['germline']:
+        if db.vcf_id not in seen:
+            seen.add(db.vcf_id)
+            for name, value in [('id', db.vcf_id), ('type', db.vcf_sv_type), ('detailed_type', _detailed_type(db)),
+                                ('chrom', db.bp_1.ref_id), ('pos', db.bp_1.position), ('chrom2', db.bp_2.ref_id),
+                                ('pos2', db.bp_2.position), ('strand1', '+' if db.direction_1 > 0 else '-'),
+                                ('strand2', '+' if db.direction_2 > 0 else '-'), ('length', db.length),
+                                ('somatic', db.vcf_id in somatic), ('cluster', cluster_of['germline'].get(db.vcf_id, ''))]:
+                breakpoints[name].append(value)
+        for name, value in [('id', db.vcf_id), ('genome_id', db.genome_id), ('haplotype', db.haplotype_1), ('filter', bp_filter_name(db.is_pass)),
+                            ('support', db.supp), ('spanning_1', _spanning(db.bp_1, db.genome_id, db.haplotype_1)),
+                            ('spanning_2', _spanning(db.bp_2, db.genome_id, db.haplotype_2)), ('DR', db.DR), ('DV', db.DV),
+                            ('vaf', db.vaf), ('hvaf', db.hvaf), ('genotype', db.genotype), ('read_ids', list(db.supp_read_ids))]:
+            support[name].append(value)
+    return _table(breakpoints), _table(support), _table(clusters)
+
+
+def candidate_table(double_breaks):
+    """
+    All detected breakpoints before the final filters, as in breakpoints_double.csv
+    """
+    candidates = OrderedDict((name, []) for name in ['breakpoint', 'genome_id', 'haplotype', 'filter',
+                                                     'support', 'spanning_1', 'spanning_2'])
+    for db in double_breaks:
+        for name, value in [('breakpoint', db.to_string()), ('genome_id', db.genome_id), ('haplotype', db.haplotype_1),
+                            ('filter', bp_filter_name(db.is_pass)), ('support', db.supp), ('spanning_1', _spanning(db.bp_1, db.genome_id, db.haplotype_1)),
+                            ('spanning_2', _spanning(db.bp_2, db.genome_id, db.haplotype_2))]:
+            candidates[name].append(value)
+    return _table(candidates)
+
+
+def coverage_chunks(coverage_histograms, genome_ids, ref_lengths):
+    """
+    Read depth of every coverage window, one table per genome, haplotype and contig
+    """
+    for genome_id in genome_ids:
+        for ctg, ctg_len in ref_lengths.items():
+            for hp in range(NUM_HAPLOTYPES):
+                hist = coverage_histograms.get((genome_id, hp, ctg))
+                if hist is None:
+                    continue
+                start = np.arange(len(hist), dtype=np.int64) * COV_WINDOW
+                yield OrderedDict([('genome_id', np.full(len(hist), genome_id)), ('haplotype', np.full(len(hist), hp, dtype=np.int64)),
+                                   ('chrom', np.full(len(hist), ctg)), ('start', start),
+                                   ('end', np.minimum(start + COV_WINDOW, ctg_len)), ('depth', hist)])
+
+
+def coverage_table(coverage_histograms, genome_ids, ref_lengths):
+    chunks = list(coverage_chunks(coverage_histograms, genome_ids, ref_lengths))
+    if not chunks:
+        return _table(OrderedDict((name, []) for name in ['genome_id', 'haplotype', 'chrom', 'start', 'end', 'depth']))
+    return OrderedDict((name, np.concatenate([chunk[name] for chunk in chunks])) for name in chunks[0])
+
+
+def read_stats_table(read_qual, read_qual_len):
+    return _table(OrderedDict([('status', list(read_qual)), ('segments', list(read_qual.values())),
+                               ('length', [read_qual_len[k] for k in read_qual])]))
@@ -2,10 +2,13 @@
 # -*- coding: utf-8 -*-
 
 from severus.__version__ import __version__
+from severus.filters import BP_PASS, BP_FAIL_LOWCOV_OTHER, bp_filter_name
 from collections import defaultdict
 from datetime import datetime
 import sys
 import os
+import io
+import pysam
 
 class vcf_format(object):
     __slots__ = ('chrom', 'pos', 'haplotype', 'ID', 'sv_type','alt', 'sv_len', 'qual', 'Filter', 'chr2', 'pos2','mut_type', 'tra_pos',
@@ -39,77 +42,38 @@ class vcf_format(object):
         self.tra_pos = tra_pos
         self.low_cov = low_cov
      
-    def precision(self):
-        return 'PRECISE' if self.prec else 'IMPRECISE'
-    
-    def strands_vcf(self):
-        if self.sv_type == 'INS':
-            return ''
-        if len(self.strands) == 1:
-            return f"STRANDS={self.strands[0]};"
-        else:
-            return f"STRANDS={self.strands[0]}{self.strands[1]};"
-        
-    def has_ins(self):
-        if self.sv_type == 'INS':
-            return ""
-        if self.ins_len and self.ins_len_seq:
-            return f"INSLEN={self.ins_len};INSSEQ={self.ins_len_seq};"
-        elif self.ins_len:
-            return f"INSLEN={self.ins_len};"
-        else:
-            return ""
-    
-    def add_vntr(self):
+    def info(self):
+        sv_type = self.sv_type
+        info = ['PRECISE' if self.prec else 'IMPRECISE', 'SVTYPE=' + sv_type]
+        if self.sv_len > 0:
+            info.append(f"SVLEN={self.sv_len}")
+        if not self.alt == '.N':
+            if sv_type == 'BND':
+                if self.mate_id:
+                    info.append(f"MATE_ID={self.mate_id}")
+            elif sv_type == 'DEL' or sv_type == 'DUP' or sv_type == 'INV':
+                info.append(f"END={self.pos2}")
+        if self.tra_pos:
+            info.append(f"ALINGED_POS={self.tra_pos}")
+        if not sv_type == 'INS':
+            info.append("STRANDS=" + ''.join(self.strands[:2]))
+        if self.low_cov:
+            info.append('LOW_COV_IN=' + ','.join(self.low_cov))
         if self.vntr:
-            return "INSIDE_VNTR=TRUE;"
-        else:
-            return ''
-    def detailedtype(self):
+            info.append("INSIDE_VNTR=TRUE")
         if self.detailed_type:
-            return f"DETAILED_TYPE={self.detailed_type};"
-        else:
-            return ""
-    def trapos(self):
-        if self.tra_pos:
-            return f"ALINGED_POS={self.tra_pos};"
-        else:
-            return ""
-    def clusterid(self):
-        if self.cluster_id and 'severus' in self.cluster_id:
-            return f";CLUSTERID={self.cluster_id}"
-        else:
-            return ""
-    def end_pos(self):
-        if self.alt == '.N':
-            return ''
-        if self.sv_type == 'BND':
-            if self.mate_id:
-                return f"MATE_ID={self.mate_id};"
-            else:
-                return ""
-        elif self.sv_type == 'DEL' or self.sv_type == 'DUP' or self.sv_type == 'INV':
-            return  f"END={self.pos2};"
-        else:
-            return ""
-        
-    def svlen(self):
-        if self.sv_len > 0:
-            return f"SVLEN={self.sv_len};"
-        else:
-            return ""
-            
-    def HP_inf(self):
+            info.append(f"DETAILED_TYPE={self.detailed_type}")
+        if not sv_type == 'INS' and self.ins_len:
+            info.append(f"INSLEN={self.ins_len}")
+            if self.ins_len_seq:
+                info.append(f"INSSEQ={self.ins_len_seq}")
+        info.append(f"MAPQ={self.qual}")
         if self.HP and self.phaseset_id:
             phase_id = str(self.phaseset_id[0]) if self.phaseset_id[0] == self.phaseset_id[1] else '{0}|{1}'.format(self.phaseset_id[0], self.phaseset_id[1])
-            return f";PHASESETID={phase_id};HP={self.HP}"
-        else:
-            return ""
-    def low_covls(self):
-        return 'LOW_COV_IN=' + ','.join(self.low_cov) + ';' if self.low_cov else ''
-    
-    def info(self):
-        return f"{self.precision()};SVTYPE={self.sv_type};{self.svlen()}{self.end_pos()}{self.trapos()}{self.strands_vcf()}{self.low_covls()}{self.add_vntr()}{self.detailedtype()}{self.has_ins()}MAPQ={self.qual}{self.HP_inf()}{self.clusterid()}"
+            info.append(f"PHASESETID={phase_id};HP={self.HP}")
+        if self.cluster_id and 'severus' in self.cluster_id:
+            info.append(f"CLUSTERID={self.cluster_id}")
+        return ';'.join(info)
     
     def to_vcf(self):
         if self.sv_type == 'INS':
@@ -183,11 +147,11 @@ def db_2_vcf(double_breaks, no_ins, sample_ids, multisample):
         db_list = defaultdict(list)
         
         pass_list = [db.is_pass for db in db_clust]
-        new_pass = True if 'PASS' in pass_list else False
+        new_pass = True if BP_PASS in pass_list else False
         
         for db in db_clust:
             if new_pass:
-                db.is_pass = 'PASS'
+                db.is_pass = BP_PASS
             if db.ins_seq == '<DUP>':
                 db.ins_seq = ''
                 db.has_ins = ''
@@ -196,12 +160,12 @@ def db_2_vcf(double_breaks, no_ins, sample_ids, multisample):
         sv_type = db.vcf_sv_type
         
         pass_list = [db.is_pass for db in db_clust]
-        if 'PASS' in pass_list:
+        if BP_PASS in pass_list:
             sv_pass = 'PASS' 
-        elif 'FAIL_LOWCOV_OTHER' in pass_list:
+        elif BP_FAIL_LOWCOV_OTHER in pass_list:
             sv_pass = 'FAIL_LOWCOV_OTHER'
         else:
-            sv_pass = db[0].is_pass
+            sv_pass = bp_filter_name(db_clust[0].is_pass)
         
         low_cov = None
         if multisample:
@@ -372,36 +336,40 @@ def write_vcf_header(ref_lengths, outfile, sample_list):
     outfile.write(f"#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\t{sample}\n")
     
 
-def _sorted_breakpoints(bp_list,ref_lengths):
+def _breakpoints_by_chrom(bp_list,ref_lengths):
     db_ls = defaultdict(list)
-    dbls= []
     for chr_id in ref_lengths.keys():
         db_ls[chr_id]=[]
         
     for db in bp_list:
         db_ls[db.chrom].append(db)
         
-    for chr_id, dbs in db_ls.items():
-        dbls += sorted(dbs, key=lambda x:x.pos)
-
-    return dbls
+    return db_ls
 
     
 def write_germline_vcf(vcf_list, outfile,ref_lengths):
-    for db in _sorted_breakpoints(vcf_list,ref_lengths):
-        outfile.write(db.to_vcf())
+    """
+    Writes records chromosome by chromosome in reference order, sorted by position
+    """
+    for chr_id, dbs in _breakpoints_by_chrom(vcf_list,ref_lengths).items():
+        dbs.sort(key=lambda x:x.pos)
+        outfile.write(''.join([db.to_vcf() for db in dbs]))
     outfile.close()
     
     
-def write_to_vcf(double_breaks, all_ids, outpath, out_key, ref_lengths, no_ins, multisample):
+def write_to_vcf(double_breaks, all_ids, outpath, out_key, ref_lengths, no_ins, multisample, bgzip = False, index = None):
     vcf_list = db_2_vcf(double_breaks, no_ins, all_ids, multisample)
     key = 'somatic' if out_key == 'somatic' else 'all'
     sample_ids = [target_id.replace('.bam' , '') for target_id in all_ids]
     
-    germline_outfile = open(os.path.join(outpath, 'severus_' + key + ".vcf"), "w")
+    vcf_path = os.path.join(outpath, 'severus_' + key + ".vcf")
+    if bgzip:
+        vcf_path += '.gz'
+        germline_outfile = io.TextIOWrapper(pysam.BGZFile(vcf_path, "wb"))
+    else:
+        germline_outfile = open(vcf_path, "w")
     write_vcf_header(ref_lengths, germline_outfile, sample_ids)
     write_germline_vcf(vcf_list, germline_outfile,ref_lengths)
     
-            
-    
-
+    if bgzip and index in ('tbi', 'csi'):
+        pysam.tabix_index(vcf_path, preset = 'vcf', force = True, csi = (index == 'csi'))